@@ -0,0 +1,169 @@
+import time
+import queue
+import threading
+from collections import deque
+from metrics import METRICS
+
+
+class Command:
+    def __init__(self, name, args=(), issued=None):
+        self.name = name
+        self.args = args
+        self.issued = issued if issued is not None else time.monotonic()
+        self.started = None
+        self.finished = None
+        self.error = None
+        self._done = threading.Event()
+
+    @property
+    def latency(self):
+        ''' s from the vision loop issuing the command to the belt receiving it '''
+        if self.started is None:
+            return None
+        return self.started - self.issued
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self
+
+
+class ConveyorActuator:
+    ''' Runs all belt commands on one thread with one persistent Conveyor.
+
+    Has the Conveyor interface (speed/forward/reverse/stop) but every call
+    just enqueues a timestamped Command and returns it, so the vision loop
+    never blocks on the drive. pulse() runs a timed move on the actuator
+    thread; stop() cancels a running pulse and skips queued moves.
+    '''
+    def __init__(self, conveyor=None, history=200):
+        if conveyor is None:
+            from conveyor import Conveyor
+            conveyor = Conveyor()
+        self.conveyor = conveyor
+        self._queue = queue.Queue()
+        self._cancel = threading.Event()
+        self._closed = False
+        self.history = deque(maxlen=history) # finished commands, newest last
+        self._thread = threading.Thread(target=self._run, name="conveyor", daemon=True)
+        self._thread.start()
+
+    def _submit(self, name, *args):
+        if self._closed:
+            raise RuntimeError("Conveyor actuator is closed")
+        cmd = Command(name, args)
+        if name == "stop":
+            # a stop overrides whatever is still waiting or running
+            self._cancel.set()
+        self._queue.put(cmd)
+        return cmd
+
+    def speed(self, hz):
+        return self._submit("speed", hz)
+
+    def forward(self):
+        return self._submit("forward")
+
+    def reverse(self):
+        return self._submit("reverse")
+
+    def stop(self):
+        return self._submit("stop")
+
+    def pulse(self, direction, duration, speed=None):
+        ''' move for `duration` s then stop, direction 'forw' or 'reve' '''
+        return self._submit("pulse", direction, duration, speed)
+
+    def _run(self):
+        while True:
+            cmd = self._queue.get()
+            if cmd is None:
+                return
+            cmd.started = time.monotonic()
+            # commands issued before a pending stop are skipped
+            if cmd.name == "stop" or not self._cancel.is_set():
+                try:
+                    self._execute(cmd)
+                except Exception as e:
+                    cmd.error = e
+                    print(f"Conveyor command {cmd.name} failed: {e}")
+            if cmd.name == "stop":
+                self._cancel.clear()
+            cmd.finished = time.monotonic()
+            if cmd.name in ("stop", "pulse"):
+                METRICS.observe("actuate_queue", cmd.latency)
+                if cmd.name == "stop":
+                    METRICS.observe("actuate", cmd.finished - cmd.started)
+            self.history.append(cmd)
+            cmd._done.set()
+
+    def _execute(self, cmd):
+        if cmd.name == "pulse":
+            direction, duration, speed = cmd.args
+            if speed is not None:
+                self.conveyor.speed(speed)
+            if direction == 'reve':
+                self.conveyor.reverse()
+            else:
+                self.conveyor.forward()
+            # interrupted early by stop()
+            self._cancel.wait(duration)
+            self.conveyor.stop()
+        else:
+            getattr(self.conveyor, cmd.name)(*cmd.args)
+
+    def latency_stats(self):
+        ''' {command: (count, median s, max s)} of issue -> start latency '''
+        by_name = {}
+        for cmd in self.history:
+            if cmd.latency is not None:
+                by_name.setdefault(cmd.name, []).append(cmd.latency)
+        stats = {}
+        for name, values in by_name.items():
+            values.sort()
+            stats[name] = (len(values), values[len(values) // 2], values[-1])
+        return stats
+
+    def close(self):
+        ''' stop the belt and the actuator thread '''
+        if self._closed:
+            return
+        self.stop().wait(2)
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class SimulatedConveyor:
+    ''' Conveyor backend for tests: logs every call and optionally drives an
+    alignment.SimulatedBelt, with a fixed per-command delay like the real drive link '''
+    def __init__(self, belt=None, command_delay=0.0):
+        self.belt = belt
+        self.command_delay = command_delay
+        self.log = [] # (monotonic time, command, args)
+
+    def _call(self, name, *args):
+        if self.command_delay:
+            time.sleep(self.command_delay)
+        self.log.append((time.monotonic(), name, args))
+        if self.belt is not None:
+            getattr(self.belt, name)(*args)
+
+    def speed(self, hz):
+        self._call("speed", hz)
+
+    def forward(self):
+        self._call("forward")
+
+    def reverse(self):
+        self._call("reverse")
+
+    def stop(self):
+        self._call("stop")
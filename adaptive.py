@@ -0,0 +1,222 @@
+import random
+import argparse
+from collections import deque
+
+# candidate bbox expansions in percent, smallest first
+EXPANSIONS = (25, 50, 100, 150, 200)
+TARGET_SUCCESS = 0.9 # decode rate an expansion / confidence band has to hold
+WINDOW = 40 # decodes at one expansion before it is judged
+MIN_ATTEMPTS = 20 # decodes in a confidence band before it can move the threshold
+BAND_WINDOW = 100 # recent decodes per confidence band the threshold is judged on
+FAIL_MARGIN = 0.05 # a band only counts as failing this far below the target, against noise
+EXPLORE = 0.1 # share of below-threshold detections still decoded, to learn their rate
+CONFIDENCE_STEP = 0.05
+SIZE_STEP = 32 # px, crop size buckets of the stats table
+
+
+class DecodeStats:
+    ''' attempts, successes and total decode time per key '''
+    def __init__(self):
+        self._stats = {}
+
+    def record(self, key, success, seconds):
+        row = self._stats.setdefault(key, [0, 0, 0.0])
+        row[0] += 1
+        row[1] += 1 if success else 0
+        row[2] += seconds
+
+    def attempts(self, key):
+        return self._stats.get(key, [0])[0]
+
+    def rate(self, key):
+        attempts, successes, _ = self._stats.get(key, [0, 0, 0.0])
+        return successes / attempts if attempts else None
+
+    def mean_time(self, key):
+        attempts, _, seconds = self._stats.get(key, [0, 0, 0.0])
+        return seconds / attempts if attempts else None
+
+    def table(self, kind):
+        ''' [(value, attempts, success rate, mean ms)] for one key kind, sorted by value '''
+        rows = []
+        for (k, value), (attempts, successes, seconds) in sorted(self._stats.items()):
+            if k == kind:
+                rows.append((value, attempts, successes / attempts, seconds / attempts * 1000))
+        return rows
+
+
+def confidence_bucket(confidence):
+    return round(int(confidence / CONFIDENCE_STEP) * CONFIDENCE_STEP, 2)
+
+
+def size_bucket(bbox):
+    return max(bbox[2] - bbox[0], bbox[3] - bbox[1]) // SIZE_STEP * SIZE_STEP
+
+
+class AdaptiveTuner:
+    ''' Picks the bbox expansion and host confidence threshold from decode results.
+
+    Expansion: after WINDOW decodes at the current expansion, a success rate
+    of at least `target` steps down to the next smaller expansion (smaller
+    crop, faster zbar), a lower rate steps back up. An expansion that failed
+    is not probed again for 10 windows. QRDecoder retries a failed decode at
+    the full expansion, so a probe never costs a code.
+
+    Threshold: the device runs the network at `floor`, detections below the
+    current threshold are dropped on the host except for an EXPLORE share
+    that is decoded to measure them. The threshold follows the lowest
+    confidence band from which every band up decodes at `target` or better
+    over its last BAND_WINDOW decodes: it is lowered while they do and raised
+    again, up to the starting `threshold`, when a band at or above it falls
+    behind (glare, a dirty label), and comes back down once it recovers.
+    '''
+    def __init__(self, expansion=200, threshold=0.9, floor=0.5, expansions=EXPANSIONS,
+                 target=TARGET_SUCCESS, window=WINDOW, explore=EXPLORE, seed=None):
+        self.expansions = sorted(set(expansions) | {expansion})
+        self.max_expansion = expansion
+        self.expansion = expansion
+        self.threshold = threshold
+        self.max_threshold = threshold
+        self.floor = floor
+        self.target = target
+        self.window = window
+        self.explore = explore
+        self.stats = DecodeStats()
+        self._recent = deque(maxlen=window)
+        self._bands = {} # confidence bucket -> recent successes, for the threshold
+        self._blocked = {} # expansion -> attempts count until it may be probed again
+        self._attempts = 0
+        self._random = random.Random(seed)
+
+    def accept(self, confidence):
+        ''' decode this detection? '''
+        if confidence >= self.threshold:
+            return True
+        return confidence >= self.floor and self._random.random() < self.explore
+
+    def record(self, expansion, confidence, bbox, success, seconds):
+        self._attempts += 1
+        self.stats.record(("expansion", expansion), success, seconds)
+        self.stats.record(("confidence", confidence_bucket(confidence)), success, seconds)
+        self._bands.setdefault(confidence_bucket(confidence), deque(maxlen=BAND_WINDOW)).append(success)
+        self.stats.record(("size", size_bucket(bbox)), success, seconds)
+        # exploration decodes below the threshold say nothing about the expansion
+        if expansion == self.expansion and confidence >= self.threshold:
+            self._recent.append(success)
+            self._adapt_expansion()
+        if self._attempts % self.window == 0:
+            self._adapt_threshold()
+
+    def _adapt_expansion(self):
+        if len(self._recent) < self.window:
+            return
+        rate = sum(self._recent) / len(self._recent)
+        i = self.expansions.index(self.expansion)
+        if rate >= self.target and i > 0:
+            smaller = self.expansions[i - 1]
+            if self._blocked.get(smaller, 0) <= self._attempts:
+                self._set_expansion(smaller)
+        elif rate < self.target and self.expansion < self.max_expansion:
+            self._blocked[self.expansion] = self._attempts + 10 * self.window
+            self._set_expansion(self.expansions[i + 1])
+
+    def _set_expansion(self, expansion):
+        print(f"Bbox expansion {self.expansion}% -> {expansion}%")
+        self.expansion = expansion
+        self._recent.clear()
+
+    def _adapt_threshold(self):
+        threshold = None
+        failing = False
+        bucket = confidence_bucket(1.0)
+        # walk down from the top band while the bands keep decoding
+        while bucket >= self.floor:
+            recent = self._bands.get(bucket, ())
+            if len(recent) >= MIN_ATTEMPTS:
+                rate = sum(recent) / len(recent)
+                if rate < self.target:
+                    # just under the target holds the threshold, clearly under raises it
+                    failing = rate < self.target - FAIL_MARGIN
+                    break
+                threshold = bucket
+            bucket = round(bucket - CONFIDENCE_STEP, 2)
+        if failing:
+            # up to the lowest band above the failing one, the start value if none holds
+            threshold = self.max_threshold if threshold is None else threshold
+        elif threshold is None:
+            return
+        else:
+            threshold = min(threshold, self.threshold)
+        threshold = max(self.floor, min(threshold, self.max_threshold))
+        if threshold != self.threshold:
+            print(f"Detection threshold {self.threshold:.2f} -> {threshold:.2f}")
+            self.threshold = threshold
+
+    def report(self):
+        lines = []
+        for kind in ("expansion", "confidence", "size"):
+            lines.append(f"{kind:<12}{'attempts':>10}{'decoded':>10}{'mean ms':>10}")
+            for value, attempts, rate, ms in self.stats.table(kind):
+                lines.append(f"{value:<12}{attempts:>10}{rate * 100:>9.0f}%{ms:>10.2f}")
+        lines.append(f"current expansion {self.expansion}%, threshold {self.threshold:.2f}")
+        return "\n".join(lines)
+
+
+def sweep(path, expansions=EXPANSIONS, thresholds=(0.5, 0.6, 0.7, 0.8, 0.9)):
+    ''' decode every detection of a .oakrec recording at every expansion
+
+    prints decode rate and time per expansion and the codes found / decode
+    time per threshold, and returns (expansion, threshold) that find the most
+    codes at the lowest decode time
+    '''
+    import time
+    import cv2
+    import numpy as np
+    import zbar
+    from replay import read_recording, FRAME
+    from qr_pipeline import expandBBox, frameNorm, decode
+
+    scanner = zbar.Scanner()
+    stats = DecodeStats()
+    found = {} # expansion -> [(confidence, decoded, seconds)]
+    for kind, meta, jpeg in read_recording(path):
+        if kind != FRAME or jpeg is None:
+            continue
+        frame = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+        for xmin, ymin, xmax, ymax, confidence, label in meta["detections"]:
+            for expansion in expansions:
+                bbox = frameNorm(frame, expandBBox((xmin, ymin, xmax, ymax), expansion))
+                start = time.perf_counter()
+                text = decode(frame, bbox, scanner)
+                elapsed = time.perf_counter() - start
+                stats.record(("expansion", expansion), text is not None, elapsed)
+                found.setdefault(expansion, []).append((confidence, text is not None, elapsed))
+
+    print(f"{'expansion':<12}{'attempts':>10}{'decoded':>10}{'mean ms':>10}")
+    for value, attempts, rate, ms in stats.table("expansion"):
+        print(f"{value:<12}{attempts:>10}{rate * 100:>9.0f}%{ms:>10.2f}")
+
+    best = None
+    print(f"\n{'expansion':<12}{'threshold':>10}{'codes':>8}{'total ms':>10}")
+    for expansion in expansions:
+        for threshold in thresholds:
+            kept = [(ok, t) for c, ok, t in found.get(expansion, []) if c >= threshold]
+            codes = sum(ok for ok, _ in kept)
+            total = sum(t for _, t in kept) * 1000
+            print(f"{expansion:<12}{threshold:>10.2f}{codes:>8}{total:>10.1f}")
+            # most codes first, then cheapest
+            if best is None or (codes, -total) > (best[2], -best[3]):
+                best = (expansion, threshold, codes, total)
+    if best is not None:
+        print(f"\nBest: expansion {best[0]}%, threshold {best[1]:.2f} ({best[2]} codes, {best[3]:.1f} ms decoding)")
+        return best[0], best[1]
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline sweep of bbox expansion and detection threshold.")
+    parser.add_argument("path", help=".oakrec recording, record it with DETECTION_THRESHOLD_FLOOR to see low confidence boxes")
+    parser.add_argument("--expansions", type=int, nargs="+", default=list(EXPANSIONS), help="Expansions to try in percent")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.6, 0.7, 0.8, 0.9], help="Thresholds to try")
+    args = parser.parse_args()
+    sweep(args.path, args.expansions, args.thresholds)
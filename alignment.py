@@ -0,0 +1,314 @@
+import time
+import random
+
+TARGET_MIN_X = 700 # panel QR bbox x window that counts as aligned
+TARGET_MAX_X = 780
+ALIGN_SPEED = 19 # belt speed (Hz) used for corrections
+
+STOP_LATENCY = 0.08 # s from conveyor.stop() being issued to the drive braking
+COAST_PX = 8 # px the panel slides after the drive brakes
+
+# px the panel QR moves per second of belt travel at ALIGN_SPEED
+# starting guess only, replaced by the rate measured on the first correction and refined after every later one
+PX_PER_SECOND = 600
+
+
+class AlignmentResult:
+    def __init__(self, converged, final_x, moves, elapsed, overshoot, start_x=None):
+        self.converged = converged
+        self.final_x = final_x
+        self.start_x = start_x # first measurement, where the coarse move left the panel
+        self.moves = moves # number of belt pulses issued
+        self.elapsed = elapsed # seconds from first measurement to convergence/give up
+        self.overshoot = overshoot # worst px past the target window on the far side
+
+    def __repr__(self):
+        return (f"AlignmentResult(converged={self.converged}, final_x={self.final_x}, "
+                f"moves={self.moves}, elapsed={self.elapsed:.2f}s, overshoot={self.overshoot}px)")
+
+
+class AlignmentController:
+    ''' Proportional belt alignment for the panel QR.
+
+    Each correction converts the pixel error into a pulse length from the
+    px-per-second rate measured at `speed`, so a panel far from target moves
+    in one long pulse instead of many fixed 0.25 s ones. `px_per_second` is
+    only the starting guess: the displacement of the first pulse replaces it
+    and every later pulse refines it.
+
+    `measure()` must return the current panel QR bbox x (or None if the panel
+    was not seen) from a frame taken after the belt has stopped.
+    '''
+    def __init__(self, target_min=TARGET_MIN_X, target_max=TARGET_MAX_X, speed=ALIGN_SPEED,
+                 px_per_second=PX_PER_SECOND, gain=0.9, min_pulse=0.05, max_pulse=2.0,
+                 settle_time=0.3, max_moves=6, clock=time.monotonic, sleep=time.sleep):
+        self.target_min = target_min
+        self.target_max = target_max
+        self.speed = speed
+        self.px_per_second = px_per_second
+        self.rate_measured = False # px_per_second still the guess
+        self.gain = gain
+        self.min_pulse = min_pulse
+        self.max_pulse = max_pulse
+        self.settle_time = settle_time
+        self.max_moves = max_moves
+        self.clock = clock
+        self.sleep = sleep
+
+    @property
+    def target_x(self):
+        return (self.target_min + self.target_max) / 2
+
+    def in_window(self, x):
+        return self.target_min <= x <= self.target_max
+
+    def pulse_for(self, x):
+        ''' (direction, seconds) that should bring x to the middle of the window '''
+        error = x - self.target_x
+        duration = abs(error) / self.px_per_second * self.gain
+        duration = max(self.min_pulse, min(duration, self.max_pulse))
+        # reverse moves the panel towards smaller x
+        direction = 'reve' if error > 0 else 'forw'
+        return direction, duration
+
+    def pulse(self, conveyor, direction, duration):
+        if hasattr(conveyor, 'pulse'):
+            # actuator.ConveyorActuator times the pulse on its own thread
+            conveyor.pulse(direction, duration, self.speed).wait()
+            self.sleep(self.settle_time)
+            return
+        conveyor.speed(self.speed)
+        if direction == 'reve':
+            conveyor.reverse()
+        else:
+            conveyor.forward()
+        self.sleep(duration)
+        conveyor.stop()
+        self.sleep(self.settle_time)
+
+    def _update_rate(self, before, after, duration):
+        moved = abs(after - before)
+        if moved > 0 and duration >= self.min_pulse:
+            if not self.rate_measured:
+                # the first pulse at `speed` is the calibration, the guess is dropped
+                self.px_per_second = moved / duration
+                self.rate_measured = True
+                return
+            # smooth so one bad measurement does not throw the next pulse off
+            self.px_per_second = 0.5 * self.px_per_second + 0.5 * (moved / duration)
+
+    def align(self, measure, conveyor, x=None):
+        start = self.clock()
+        if x is None:
+            x = measure()
+        start_x = x
+        moves = 0
+        overshoot = 0
+        first_side = None
+
+        while x is not None and not self.in_window(x) and moves < self.max_moves:
+            direction, duration = self.pulse_for(x)
+            if first_side is None:
+                first_side = direction
+            self.pulse(conveyor, direction, duration)
+            moves += 1
+
+            new_x = measure()
+            if new_x is None:
+                x = None
+                break
+            self._update_rate(x, new_x, duration)
+            x = new_x
+
+            # overshoot: ended up past the window on the side we started from
+            if first_side == 'reve' and x < self.target_min:
+                overshoot = max(overshoot, self.target_min - x)
+            elif first_side == 'forw' and x > self.target_max:
+                overshoot = max(overshoot, x - self.target_max)
+
+        converged = x is not None and self.in_window(x)
+        return AlignmentResult(converged, x, moves, self.clock() - start, overshoot, start_x)
+
+
+class ArrivalPredictor:
+    ''' Tracks the panel QR x over detection timestamps during the coarse move.
+
+    Fits a line to the last few (timestamp, x) observations to get the belt
+    velocity in px/s and tells the move loop to stop as soon as the panel
+    would coast to `target_x`: current x + v * (latency since capture +
+    stop latency) + coast. Calling should_stop() on frames where the panel
+    was not decoded still extrapolates from the last fit. Without a velocity
+    (a single sighting) it stops once the panel is within `half_window` of
+    the target or past it in `direction` (+1: x grows while the belt runs).
+    '''
+    def __init__(self, target_x=(TARGET_MIN_X + TARGET_MAX_X) / 2, stop_latency=STOP_LATENCY,
+                 coast_px=COAST_PX, window=6, max_age=0.5, min_velocity=50,
+                 half_window=(TARGET_MAX_X - TARGET_MIN_X) / 2, direction=1):
+        self.target_x = target_x
+        self.half_window = half_window
+        self.direction = direction
+        self.min_velocity = min_velocity # px/s below this is jitter, not belt motion
+        self.stop_latency = stop_latency
+        self.coast_px = coast_px
+        self.window = window
+        self.max_age = max_age
+        self.observations = []
+        self.predicted_x = None
+
+    def reset(self):
+        self.observations = []
+        self.predicted_x = None
+
+    def update(self, timestamp, x):
+        self.observations.append((timestamp, x))
+        # drop old points so a speed change is picked up quickly
+        self.observations = [(t, px) for t, px in self.observations[-self.window:]
+                             if timestamp - t <= self.max_age]
+
+    @property
+    def velocity(self):
+        ''' least squares px/s over the kept observations, None until two points '''
+        if len(self.observations) < 2:
+            return None
+        n = len(self.observations)
+        mean_t = sum(t for t, _ in self.observations) / n
+        mean_x = sum(x for _, x in self.observations) / n
+        var_t = sum((t - mean_t) ** 2 for t, _ in self.observations)
+        if var_t == 0:
+            return None
+        v = sum((t - mean_t) * (x - mean_x) for t, x in self.observations) / var_t
+        return v if abs(v) >= self.min_velocity else None
+
+    def stop_position(self, now):
+        ''' where the panel ends up if stop() is sent at host time `now` '''
+        if not self.observations:
+            return None
+        t_last, x_last = self.observations[-1]
+        v = self.velocity
+        if v is None:
+            return x_last
+        direction = 1 if v > 0 else -1
+        return x_last + v * (now - t_last + self.stop_latency) + direction * self.coast_px
+
+    def should_stop(self, now):
+        x = self.stop_position(now)
+        if x is None:
+            return False
+        v = self.velocity
+        self.predicted_x = x
+        if v is None:
+            # one sighting only, stop if it is already in the window or past the target
+            t_last, x_last = self.observations[-1]
+            return (x_last - self.target_x) * self.direction >= -self.half_window
+        # stop on the frame that lands closest to target, not the first one past it
+        times = [t for t, _ in self.observations]
+        half_step = abs(v) * (times[-1] - times[0]) / (len(times) - 1) / 2
+        if v > 0:
+            return x >= self.target_x - half_step
+        return x <= self.target_x + half_step
+
+    def record_outcome(self, final_x):
+        ''' correct the coast estimate from where the panel actually stopped '''
+        if self.predicted_x is None or final_x is None:
+            return
+        v = self.velocity
+        direction = 1 if (v or 0) >= 0 else -1
+        error = (final_x - self.predicted_x) * direction
+        self.coast_px = max(0.0, self.coast_px + 0.5 * error)
+
+
+class SimClock:
+    ''' manual clock so the simulation runs instantly '''
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class SimulatedBelt:
+    ''' Conveyor stand-in: speed()/forward()/reverse()/stop() move a panel along x.
+
+    `px_per_hz` is px/s per Hz of belt speed, `coast_px` is how far the panel
+    keeps sliding after stop() and `start_lag` is the drive ramp-up time.
+    '''
+    def __init__(self, x, clock, px_per_hz=32, coast_px=8, start_lag=0.05):
+        self.x = x
+        self.clock = clock
+        self.px_per_hz = px_per_hz
+        self.coast_px = coast_px
+        self.start_lag = start_lag
+        self._hz = 0
+        self._direction = 0
+        self._started = None
+
+    def speed(self, hz):
+        self._hz = hz
+
+    def forward(self):
+        self._direction = 1
+        self._started = self.clock()
+
+    def reverse(self):
+        self._direction = -1
+        self._started = self.clock()
+
+    def stop(self):
+        if self._started is not None:
+            moving = max(0.0, self.clock() - self._started - self.start_lag)
+            self.x += self._direction * (self._hz * self.px_per_hz * moving + self.coast_px)
+        self._direction = 0
+        self._started = None
+
+
+class SimulatedCamera:
+    ''' measure() for the controller: belt x plus detection jitter '''
+    def __init__(self, belt, noise_px=3, miss_rate=0.0, seed=None):
+        self.belt = belt
+        self.noise_px = noise_px
+        self.miss_rate = miss_rate
+        self.rng = random.Random(seed)
+
+    def __call__(self):
+        if self.rng.random() < self.miss_rate:
+            return None
+        return int(round(self.belt.x + self.rng.uniform(-self.noise_px, self.noise_px)))
+
+
+def simulate(start_x, **controller_args):
+    ''' run one alignment against the simulated belt/camera '''
+    clock = SimClock()
+    belt = SimulatedBelt(start_x, clock)
+    camera = SimulatedCamera(belt, seed=0)
+    controller = AlignmentController(clock=clock, sleep=clock.sleep, **controller_args)
+    return controller.align(camera, belt)
+
+
+def simulate_coarse_move(start_x=0, speed=ALIGN_SPEED, fps=30, latency=0.05, target_x=(TARGET_MIN_X + TARGET_MAX_X) / 2):
+    ''' forward move with the predictor deciding when to stop, returns the stop x '''
+    clock = SimClock()
+    belt = SimulatedBelt(start_x, clock)
+    camera = SimulatedCamera(belt, seed=0)
+    predictor = ArrivalPredictor(target_x, stop_latency=0, coast_px=belt.coast_px)
+    belt.speed(speed)
+    belt.forward()
+    while clock() < 30:
+        clock.sleep(1 / fps)
+        # x as seen in a frame captured `latency` s ago
+        moving = max(0.0, clock() - latency - belt._started - belt.start_lag)
+        seen = belt.x + speed * belt.px_per_hz * moving
+        predictor.update(clock() - latency, seen + camera.rng.uniform(-camera.noise_px, camera.noise_px))
+        if predictor.should_stop(clock()):
+            break
+    belt.stop()
+    return belt.x
+
+
+if __name__ == "__main__":
+    for start_x in (790, 850, 1000, 1200, 650):
+        print(start_x, simulate(start_x))
+    for speed in (19, 25, 30):
+        print(f"coarse move at {speed} Hz stops at x={simulate_coarse_move(speed=speed):.0f}")
@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+from pathlib import Path
+
+# Content addressed blob store: blobs/<sha256>.blob plus manifest.json that
+# pins (model, zoo type, shaves, OpenVINO version) -> sha256. Pipeline builds
+# read the blob straight from disk and never call blobconverter once warm.
+CACHE_DIR = Path(os.environ.get("OAK_BLOB_CACHE", Path.home() / ".cache" / "oak_blobs"))
+
+# set OAK_BLOB_OFFLINE=1 on line PCs: a missing blob is an error instead of a download
+OFFLINE = os.environ.get("OAK_BLOB_OFFLINE", "0") == "1"
+
+# blobconverter's own download cache, None keeps its default ~/.cache/blobconverter
+CONVERTER_DIR = None
+
+OPENVINO_VERSION = "2021.4"
+
+QR_MODEL = "qr_code_detection_384x384"
+
+# blobs already hash-checked by this process
+_verified = {}
+
+
+def _key(name, zoo_type, shaves, version):
+    return f"{name}|{zoo_type}|{shaves}|{version}"
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_manifest(cache_dir=None):
+    path = Path(cache_dir or CACHE_DIR) / "manifest.json"
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_manifest(manifest, cache_dir):
+    path = Path(cache_dir) / "manifest.json"
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    # atomic so a crash never leaves a half written manifest
+    os.replace(tmp, path)
+
+
+def _fetch(name, zoo_type, shaves, version, cache_dir):
+    import blobconverter
+
+    print(f"Fetching blob {name} (shaves={shaves}, OpenVINO {version})...")
+    kwargs = {"output_dir": CONVERTER_DIR} if CONVERTER_DIR is not None else {}
+    src = blobconverter.from_zoo(name=name, zoo_type=zoo_type, shaves=shaves, version=version, **kwargs)
+    digest = _sha256(src)
+    blobs = Path(cache_dir) / "blobs"
+    blobs.mkdir(parents=True, exist_ok=True)
+    dst = blobs / f"{digest}.blob"
+    if not dst.exists():
+        shutil.copyfile(src, dst)
+
+    manifest = load_manifest(cache_dir)
+    manifest[_key(name, zoo_type, shaves, version)] = {
+        "model": name,
+        "zoo_type": zoo_type,
+        "shaves": shaves,
+        "openvino_version": version,
+        "sha256": digest,
+        "path": f"blobs/{digest}.blob",
+    }
+    _save_manifest(manifest, cache_dir)
+    return dst, digest
+
+
+def get_blob(name=QR_MODEL, zoo_type="depthai", shaves=6, version=OPENVINO_VERSION, offline=None, cache_dir=None):
+    ''' path to the blob, from the local cache when pinned there '''
+    cache_dir = Path(cache_dir or CACHE_DIR)
+    offline = OFFLINE if offline is None else offline
+    key = _key(name, zoo_type, shaves, version)
+
+    entry = load_manifest(cache_dir).get(key)
+    if entry is not None:
+        path = cache_dir / entry["path"]
+        if _verified.get(str(path)) == entry["sha256"]:
+            return path
+        if path.exists() and _sha256(path) == entry["sha256"]:
+            _verified[str(path)] = entry["sha256"]
+            return path
+        print(f"Cached blob for {key} is missing or does not match its pinned hash")
+
+    if offline:
+        raise FileNotFoundError(f"No cached blob for {key} in {cache_dir} and offline mode is on. "
+                                f"Run `python blob_cache.py --warm` with network access first.")
+
+    path, digest = _fetch(name, zoo_type, shaves, version, cache_dir)
+    _verified[str(path)] = digest
+    return path
+
+
+def benchmark(repeat=3):
+    ''' pipeline build time with an empty cache vs a warm one
+
+    the cold run starts with both this cache and blobconverter's empty, so it
+    includes the download (or compile) from the blobconverter server
+    '''
+    import qr_pipeline
+
+    global CACHE_DIR, CONVERTER_DIR
+    saved = CACHE_DIR, CONVERTER_DIR
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        CACHE_DIR = Path(tmp) / "oak_blobs"
+        CONVERTER_DIR = Path(tmp) / "blobconverter"
+        CONVERTER_DIR.mkdir()
+        _verified.clear()
+        try:
+            start = time.perf_counter()
+            qr_pipeline.create_pipeline()
+            results["cold"] = time.perf_counter() - start
+
+            warm = []
+            for _ in range(repeat):
+                # new process on a warm cache: hash check once, no blobconverter call
+                _verified.clear()
+                start = time.perf_counter()
+                qr_pipeline.create_pipeline()
+                warm.append(time.perf_counter() - start)
+            results["warm"] = min(warm)
+        finally:
+            CACHE_DIR, CONVERTER_DIR = saved
+            _verified.clear()
+
+    print(f"Pipeline build, cold cache (blob download): {results['cold'] * 1000:.1f} ms")
+    print(f"Pipeline build, warm cache: {results['warm'] * 1000:.1f} ms (best of {repeat})")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local blob cache for the OAK pipelines.")
+    parser.add_argument("--warm", action="store_true", help="Fetch and pin the QR detection blob")
+    parser.add_argument("--list", action="store_true", help="Show the pinned manifest")
+    parser.add_argument("--benchmark", action="store_true", help="Time pipeline build with a cold and a warm cache")
+    parser.add_argument("--shaves", type=int, default=6, help="Number of shaves to compile the blob for")
+    args = parser.parse_args()
+
+    if args.warm:
+        print(get_blob(shaves=args.shaves, offline=False))
+    if args.list:
+        print(json.dumps(load_manifest(), indent=2, sort_keys=True))
+    if args.benchmark:
+        benchmark()
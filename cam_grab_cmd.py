@@ -1,6 +1,5 @@
-import time
-from pathlib import Path
 import depthai as dai
+from capture import grab_jpegs
 import argparse
 
 # Default mxids for the cameras
@@ -31,18 +30,8 @@ def cam_grab_s2(mxid=dipro_s2_mxid, duration=2, output_dir='image_eval_data'):
         # Output queue to get JPEG frames from the output defined above
         qJpeg = device.getOutputQueue(name="jpeg", maxSize=30, blocking=True)
 
-        # Make sure the destination path is present before starting to store the examples
-        Path(output_dir).mkdir(parents=True, exist_ok=True)
-
-        start_time = time.time()
-        end_time = start_time + duration
-        while time.time() < end_time:
-            # Save JPEG images after the first 1.5 seconds
-            if time.time() > (start_time + 1.5):
-                for encFrame in qJpeg.tryGetAll():
-                    with open(f"{output_dir}/{int(time.time() * 1)}.jpeg", "wb") as f:  # Time as milliseconds
-                        f.write(bytearray(encFrame.getData()))
-        print(f"Images saved in {output_dir}")
+        # JPEGs go to a writer pool, named by device sequence number and timestamp
+        grab_jpegs(qJpeg, duration, output_dir)
 
 def cam_grab_sr(mxid=dipro_sr_mxid, duration=2, output_dir='image_eval_data'):
     # Start defining a pipeline
@@ -68,20 +57,8 @@ def cam_grab_sr(mxid=dipro_sr_mxid, duration=2, output_dir='image_eval_data'):
         # Output queue to get JPEG frames from the output defined above
         qJpeg = device.getOutputQueue(name="jpeg", maxSize=30, blocking=True)
 
-        # Make sure the destination path is present before starting to store the examples
-        Path(output_dir).mkdir(parents=True, exist_ok=True)
-
-        start_time = time.time()
-        end_time = start_time + duration
-        while time.time() < end_time:
-            # Save JPEG images after the first 1.5 seconds
-            if time.time() > (start_time + 1.5):
-                for encFrame in qJpeg.tryGetAll():
-                    # Use time in milliseconds for the filename as in your original format
-                    filename = f"{output_dir}/{int(time.time() * 1)}.jpeg"
-                    with open(filename, "wb") as f:
-                        f.write(bytearray(encFrame.getData()))
-        print(f"Images saved in {output_dir}")
+        # JPEGs go to a writer pool, named by device sequence number and timestamp
+        grab_jpegs(qJpeg, duration, output_dir)
 
 if __name__ == '__main__':
     # Argument parser to select between cam_grab_s2 and cam_grab_sr
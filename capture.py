@@ -0,0 +1,215 @@
+import time
+import queue
+import threading
+from pathlib import Path
+
+WRITER_THREADS = 2
+MAX_PENDING = 90 # encoded frames waiting for a writer, ~3 s at 30 FPS
+
+
+class JpegWriterPool:
+    ''' Writes MJPEG packets to disk on a bounded pool of writer threads.
+
+    submit() only takes a reference to the packet's numpy buffer (getData()
+    does not copy and file.write() accepts the buffer as is) and returns, so
+    the capture loop keeps draining the device queue while files are written.
+    Files are named <seq>_<device timestamp ms>.jpeg and never collide. When
+    all writers are behind by `max_pending` frames new frames are dropped and
+    counted instead of stalling capture.
+    '''
+    def __init__(self, output_dir, workers=WRITER_THREADS, max_pending=MAX_PENDING):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self._queue = queue.Queue(max_pending)
+        self._lock = threading.Lock()
+        self.received = 0
+        self.written = 0
+        self.dropped = 0 # host side, writers could not keep up
+        self.skipped = 0 # device side, gaps in the sequence numbers
+        self.bytes = 0
+        self._last_seq = None
+        self._start = None
+        self._end = None
+        self._threads = [threading.Thread(target=self._run, name=f"jpeg-writer-{i}", daemon=True)
+                         for i in range(workers)]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, encFrame):
+        seq = encFrame.getSequenceNum()
+        ts_ms = int(encFrame.getTimestamp().total_seconds() * 1000)
+        if self._start is None:
+            self._start = time.monotonic()
+        self.received += 1
+        if self._last_seq is not None and seq > self._last_seq + 1:
+            self.skipped += seq - self._last_seq - 1
+        self._last_seq = seq
+        try:
+            self._queue.put_nowait((self.output_dir / f"{seq:06d}_{ts_ms}.jpeg", encFrame.getData()))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            path, data = item
+            with open(path, "wb") as f:
+                f.write(data)
+            with self._lock:
+                self.written += 1
+                self.bytes += len(data)
+                self._end = time.monotonic()
+
+    def close(self):
+        ''' wait for the pending frames and stop the writers '''
+        for _ in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join()
+        return self.stats()
+
+    def stats(self):
+        elapsed = (self._end - self._start) if self._start and self._end else 0.0
+        return {
+            "received": self.received,
+            "written": self.written,
+            "dropped": self.dropped,
+            "skipped": self.skipped,
+            "fps": self.written / elapsed if elapsed > 0 else 0.0,
+            "mb_per_s": self.bytes / elapsed / 1e6 if elapsed > 0 else 0.0,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+WARMUP_MAX = 1.5 # s, the old fixed warm-up, now only the upper bound
+SETTLE_FRAMES = 5
+SETTLE_TOLERANCE = 0.05
+
+
+def _exposure(msg):
+    ''' (exposure us, iso) of a frame, None if the message has no camera metadata '''
+    try:
+        return msg.getExposureTime().total_seconds() * 1e6, msg.getSensitivity()
+    except (AttributeError, RuntimeError):
+        return None
+
+
+class ExposureSettle:
+    ''' True once auto exposure has stopped moving.
+
+    Converged when exposure time and ISO of the last `frames` frames stay
+    within `tolerance` of each other. Frames without exposure metadata never
+    converge, the caller's upper bound applies then.
+    '''
+    def __init__(self, frames=SETTLE_FRAMES, tolerance=SETTLE_TOLERANCE):
+        self.frames = frames
+        self.tolerance = tolerance
+        self._history = []
+
+    def update(self, msg):
+        exposure = _exposure(msg)
+        if exposure is None or not all(exposure):
+            # no metadata (0 us / ISO 0 on some streams) says nothing about convergence
+            self._history = []
+            return False
+        self._history = (self._history + [exposure])[-self.frames:]
+        if len(self._history) < self.frames:
+            return False
+        for i in range(2):
+            values = [e[i] for e in self._history]
+            if max(values) - min(values) > self.tolerance * max(values):
+                return False
+        return True
+
+
+class QueueReader:
+    ''' Blocking reads of a depthai output queue on a background thread.
+
+    get(timeout) waits on a Python queue instead of spinning on tryGetAll(),
+    the reader thread sits in the blocking dai get() with the GIL released.
+    Returns None once the device is closed or the link is lost.
+    '''
+    def __init__(self, q):
+        self._q = q
+        self._out = queue.Queue()
+        self._stop = threading.Event()
+        self.error = None
+        self._thread = threading.Thread(target=self._run, name="queue-reader", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                msg = self._q.get()
+            except Exception as e:
+                self.error = e
+                self._out.put(None)
+                return
+            self._out.put(msg)
+
+    def get(self, timeout=None):
+        ''' next message, raises queue.Empty after `timeout` s '''
+        return self._out.get(timeout=timeout)
+
+    def stop(self):
+        # the thread itself ends when the device closes and its get() raises
+        self._stop.set()
+
+
+def warm_up(reader, max_time=WARMUP_MAX):
+    ''' drop frames until auto exposure settled or `max_time` s passed, returns the time taken '''
+    settle = ExposureSettle()
+    start = time.monotonic()
+    while True:
+        remaining = max_time - (time.monotonic() - start)
+        if remaining <= 0:
+            break
+        try:
+            msg = reader.get(timeout=remaining)
+        except queue.Empty:
+            break
+        if msg is None or settle.update(msg):
+            break
+    return time.monotonic() - start
+
+
+def grab_jpegs(qJpeg, duration, output_dir, warmup=WARMUP_MAX):
+    ''' save every JPEG from `qJpeg` for `duration - warmup` s once exposure settled, returns the writer stats
+
+    the capture window is as long as with the old fixed warm-up, it just
+    starts (and ends) as soon as auto exposure converged
+    '''
+    reader = QueueReader(qJpeg)
+    warmup_time = warm_up(reader, warmup)
+    window = max(0.0, duration - warmup)
+    with JpegWriterPool(output_dir) as writer:
+        end_time = time.monotonic() + window
+        while True:
+            remaining = end_time - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                encFrame = reader.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if encFrame is None:
+                print(f"Lost camera during capture: {reader.error}")
+                break
+            writer.submit(encFrame)
+    reader.stop()
+    stats = writer.stats()
+    stats["warmup"] = warmup_time
+    if warmup_time < warmup:
+        print(f"Exposure settled after {warmup_time:.2f} s")
+    else:
+        print(f"Exposure did not settle within {warmup} s, capturing anyway")
+    print(f"Saved {stats['written']} images in {output_dir} ({stats['fps']:.1f} fps, {stats['mb_per_s']:.1f} MB/s), "
+          f"dropped {stats['dropped']} on the host, {stats['skipped']} missing on the device")
+    return stats
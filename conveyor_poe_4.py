@@ -1,15 +1,21 @@
 import time
-import cv2
-import depthai as dai
-import numpy as np
-import blobconverter
-import zbar
 import eval_loop_notimeout
-from conveyor import Conveyor
-
-def move(panel_id,my_speed,direction, corr_40):
-
-    conveyor = Conveyor()
+import qr_pipeline
+from qr_pipeline import QRDecoder, find
+from oak_session import OakSession
+from alignment import ArrivalPredictor
+from actuator import ConveyorActuator
+from replay import Recorder, RecordingConveyor
+from metrics import METRICS
+from ring_buffer import EventRecorder
+from viewer import AnnotationSink
+from station import load_profile, ProfileWatcher, live_updater
+
+def move(panel_id,my_speed,direction, corr_40, session=None, conveyor=None, viewer=None, predictor=None):
+
+    # commands go through the actuator thread, the frame loop never waits on the belt
+    if conveyor is None:
+        conveyor = ConveyorActuator()
     # my_speed = 20 # set speed to 20 Hz
     conveyor.speed(my_speed)
 
@@ -24,222 +30,124 @@ def move(panel_id,my_speed,direction, corr_40):
     # if direction == 'reve':
     #     reve = True
 
-    DISPLAY = False # display camera image (set to none on RPi)
-
-    FRAME_SIZE = (1440,1080)
-    FOCUS_VALUE = 175 # 0-255, 0>inf, 150>30cm, 200>10cm, 255>8cm
-    FPS = 30
-
-    BLUR = False # apply blur to image before decoding
-    BLUR_KERNEL = (7,7) # blur kernel size (width, height)
-
-    BBOX_EXPANSION_PERCENT = 200 # expand bounding box by percent before decoding
-    DETECTION_THRESHOLD = 0.9 # minimum confidence threshold for detection
-
-    USE_EXP_LIMIT_TUNING = False # use exposure limit tuning, will disable manual exposure
-    EXP_LIMIT = 8300 # exposure limit in us, either 8300 (default) or 500
-
-    MANUAL_EXPOSURE = True # set manual exposure
-    EXP_TIME = 1000 # sensor exposure time, range 1 to 33000
-    SENS_ISO = 1600 # sesnor sensitivity, range 100 to 1600
-
-    # Create pipeline
-    pipeline = dai.Pipeline()
-    if USE_EXP_LIMIT_TUNING:
-        MANUAL_EXPOSURE = False
-        if EXP_LIMIT == 500:
-            pipeline.setCameraTuningBlobPath('./tuning_exp_limit_500us.bin')
-        else:
-            pipeline.setCameraTuningBlobPath('./tuning_exp_limit_8300us.bin')
-
-    # Define camera node
-    cam = pipeline.create(dai.node.ColorCamera)
-    cam.setResolution(dai.ColorCameraProperties.SensorResolution.THE_1080_P)
-    cam.setPreviewSize(FRAME_SIZE)
-    cam.setInterleaved(False)
-    cam.initialControl.setManualFocus(FOCUS_VALUE)
-    cam.setFps(FPS)
+    # the session stays open after move() returns so finetune() can reuse it
+    if session is None:
+        session = OakSession().open()
 
-    # Define image preprocessor node
-    # --> dection model requires 384x384, grayscale input image
-    proc = pipeline.create(dai.node.ImageManip)
-    proc.initialConfig.setResize(384,384)
-    proc.initialConfig.setFrameType(dai.ImgFrame.Type.GRAY8)
-    proc.initialConfig.setKeepAspectRatio(False)
-
-    # Define QR detection model
-    nn = pipeline.create(dai.node.MobileNetDetectionNetwork)
-    nn.setConfidenceThreshold(DETECTION_THRESHOLD)
-    nn.setBlobPath(blobconverter.from_zoo(name="qr_code_detection_384x384", zoo_type="depthai", shaves=6))
-    nn.input.setQueueSize(1)
-    nn.input.setBlocking(False)
-
-    # Define input nodes
-    controlIn = pipeline.create(dai.node.XLinkIn)
-    controlIn.setStreamName("control")
-
-    # Define output nodes
-    camOut = pipeline.create(dai.node.XLinkOut)
-    camOut.setStreamName("camera")
-    nnOut = pipeline.create(dai.node.XLinkOut)
-    nnOut.setStreamName("nn")
-
-    # Link the nodes
-    cam.preview.link(proc.inputImage)
-    proc.out.link(nn.input)
-    cam.preview.link(camOut.input)
-    nn.out.link(nnOut.input)
-    controlIn.out.link(cam.inputControl)
-
-    # Define a variable to specify the number of connection retry attempts
-    MAX_CONNECTION_RETRIES = 5
-
-    oak_d_poe = "1844301021A55C1200"
+    decoder = QRDecoder()
+    if predictor is None:
+        predictor = ArrivalPredictor(direction=-1 if direction == 'reve' else 1)
+    # a predictor reused across moves keeps its coast estimate, not the last move's sightings
+    predictor.reset()
+    panel_seen = False
+    stop_event = False
 
     while True:
         try:
-
-            # Connect to a device and start the pipeline
-            with dai.Device(pipeline, dai.DeviceInfo(oak_d_poe)) as device:
-        
-                class TextHelper:
-                    def __init__(self) -> None:
-                        self.bg_color = (0, 0, 0)
-                        self.color = (255, 255, 255)
-                        self.text_type = cv2.FONT_HERSHEY_SIMPLEX
-                        self.line_type = cv2.LINE_AA
-                    def putText(self, frame, text, coords):
-                        cv2.putText(frame, text, coords, self.text_type, 0.8, self.bg_color, 3, self.line_type)
-                        cv2.putText(frame, text, coords, self.text_type, 0.8, self.color, 1, self.line_type)
-                    def rectangle(self, frame, p1, p2):
-                        cv2.rectangle(frame, p1, p2, self.bg_color, 6)
-                        cv2.rectangle(frame, p1, p2, self.color, 1)
-                
-                def decode(frame, bbox, scanner):
-                    # crop frame to bbox area
-                    img = frame[bbox[1]:bbox[3], bbox[0]:bbox[2]]
-                    
-                    # zbar requires grayscale images
-                    img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-                    if BLUR:
-                        # remove high frequency noise
-                        img = cv2.GaussianBlur(img, BLUR_KERNEL, 0)
-        
-                    # decode QR code
-                    results = scanner.scan(img)
-        
-                    if results:
-                        # decoding successful
-                        return results[0].data.decode('utf-8')
-                        
-                    else:
-                        # decoding failed
-                        return None
-        
-                def expandDetection(det, percent=BBOX_EXPANSION_PERCENT):
-                    ''' expand bounding box by percent '''
-                    percent /= 200
-                    w = det.xmax - det.xmin
-                    h = det.ymax - det.ymin
-                    det.xmin = max(0, det.xmin - w * percent)
-                    det.xmax = min(1, det.xmax + w * percent)
-                    det.ymin = max(0, det.ymin - h * percent)
-                    det.ymax = min(1, det.ymax + h * percent)
-                    
-                def frameNorm(frame, bbox):
-                    ''' de-normalize bounding box coordinates '''
-                    normVals = np.full(len(bbox), frame.shape[0])
-                    normVals[::2] = frame.shape[1]
-                    return (np.clip(np.array(bbox), 0, 1) * normVals).astype(int)
-                
-                def clamp(num, v0, v1):
-                    return max(v0, min(num, v1))
-        
-                qCam = device.getOutputQueue("camera", maxSize=4, blocking=False)
-                qDet = device.getOutputQueue("nn", maxSize=4, blocking=False)
-                controlQueue = device.getInputQueue('control')
-        
-                if MANUAL_EXPOSURE:
-                    # set manual exposure
-                    expTime = EXP_TIME
-                    sensIso = SENS_ISO
-                    expTime = clamp(expTime, 1, 33000)
-                    sensIso = clamp(sensIso, 100, 1600)
-                    print("Setting manual exposure -- time:", expTime, "  iso:", sensIso)
-                    ctrl = dai.CameraControl()
-                    ctrl.setManualExposure(expTime, sensIso)
-                    controlQueue.send(ctrl)
-        
-                c = TextHelper()
-                scanner = zbar.Scanner()
-        
-                while True:
-                    frame = qCam.get().getCvFrame()
-                    detections = qDet.get().detections
-                    qr_bbox = [9999, 9999, 9999, 9999]
-                    stop_bbox = [999,999,999,999]
-        
-                    qr_bbox_left_bound = 50
-                    qr_bbox_right_bound = 999
-
-                    if direction == "reve":
-                        time.sleep(7) # allows time for focus
-                        conveyor.reverse()
-        
-                    for det in detections:
-                        # expand and denormalize bbox
-                        expandDetection(det)
-                        bbox = frameNorm(frame, (det.xmin, det.ymin, det.xmax, det.ymax))
-        
-                        # decode QR image
-                        text = decode(frame, bbox, scanner)
-        
-                        if text == "STOP":
-                            print("Text = STOP")
-                            stop_bbox = bbox
-                            print("STOP bbox: ",stop_bbox)
-        
-                        elif text != None and len(text) > 5 and text == panel_id:
-                            print("Panel QR code")
-                            qr_bbox = bbox
-                            print("QR bbox: ",qr_bbox)
-                            time.sleep(0.1)
-                            conveyor.stop()
-                            device.close()
-                            return qr_bbox[0]
-                        c.putText(frame, text, (bbox[0] + 10, bbox[1] + 40))
-        
-                        if qr_bbox[0]-500 < stop_bbox[0] < qr_bbox[0]+500:
-                            print("ALIGNED")
-                            conveyor.stop()
-                            device.close()
-                            return
-                
-                        # add bbox, confidence, and decoded text to image
-                        c.rectangle(frame, (bbox[0], bbox[1]), (bbox[2], bbox[3]))
-                        c.putText(frame, f"{int(det.confidence * 100)}%", (bbox[0] + 10, bbox[1] + 30))
-                        c.putText(frame, text, (bbox[0] + 10, bbox[1] + 60))
-                    
-        
-                    if DISPLAY:
-                        cv2.imshow("Image", frame)
-        
-                        if cv2.waitKey(1) == ord('q'):
-                            break
+            frame, detections = session.get()
         except RuntimeError as e:
             print(f"Error: {e}")
-            print("Camera not detected. Retrying in 5 seconds...")
-            time.sleep(5) # wait for 5 s before retry
+            print("Lost connection to camera. Reconnecting...")
+            session.reconnect()
+            continue
+        received = time.perf_counter()
+
+        if direction == "reve":
+            time.sleep(7) # allows time for focus
+            conveyor.reverse()
+
+        results = decoder.process(frame, detections, session.crops)
+
+        stop = find(results, "STOP")
+        if stop is not None:
+            print("Text = STOP")
+            print("STOP bbox: ",stop.bbox)
+
+        panel = find(results, panel_id)
+        # the STOP code reached the target before the panel showed up, save the footage once per move
+        if (stop is not None and not panel_seen and not stop_event
+                and (stop.bbox[0] - predictor.target_x) * predictor.direction >= -predictor.half_window):
+            stop_event = True
+            session.event("stop_without_panel")
+        if panel is not None:
+            panel_seen = True
+            print("Panel QR code")
+            print("QR bbox: ",panel.bbox)
+            # a box clipped by the frame edge does not move with the panel
+            if 0 < panel.bbox[0] and panel.bbox[2] < qr_pipeline.FRAME_SIZE[0]:
+                predictor.update(session.timestamp, panel.bbox[0])
+
+        # stop early enough that the panel coasts onto the target x
+        if predictor.should_stop(session.clock()):
+            conveyor.stop()
+            METRICS.observe("decision", time.perf_counter() - received)
+            print("Stopped at predicted x: ",int(predictor.predicted_x), " belt velocity [px/s]: ",predictor.velocity)
+            return int(predictor.predicted_x)
+
+        # drawn on the viewer's thread, a no-op when nobody watches
+        if viewer is not None:
+            viewer.submit(frame, results, session.roi_offset)
+            if viewer.quit:
+                conveyor.stop()
+                return
 
 # my_id = input("Which panel would you like to move? ")
 # my_speed = int(input("What speed would you like to run at? "))
-my_id = "11-111-111"
-my_speed = 19
-qr_bbox_0 = move(my_id,my_speed,'forw',False)
-
-time.sleep(8)
-eval_loop_notimeout.finetune(my_id)
+# only send detections + GRAY8 crops over PoE, not the full 1440x1080 preview
+CROP_MODE = False
+# write the run to this .oakrec file, replay it with `python replay.py <file>`
+RECORD_PATH = None
+# display the annotated camera image (not on the RPi) and/or write it to this video, see viewer.py
+DISPLAY = False
+VIEW_RECORD_PATH = None
+# crop the preview around the panel QR and the target window during finetune(), not with CROP_MODE
+FINETUNE_ROI = False
+# keep a ring buffer of H.265 on the device stream and save clips of misalignments etc.
+EVENT_CLIPS = False
+# per-stage latency dump, Prometheus text for *.prom, CSV otherwise
+METRICS_PATH = None
+# station profile YAML (station.py): exposure, thresholds, target window, speeds; reloaded when it changes
+PROFILE_PATH = None
+
+if __name__ == "__main__":
+    if CROP_MODE and RECORD_PATH:
+        # crop mode sends no frames and the crops are not recorded, the recording could not be replayed
+        raise ValueError("RECORD_PATH cannot be used with CROP_MODE")
+    my_id = "11-111-111"
+    profile = load_profile(PROFILE_PATH).apply()
+    my_speed = profile.speed
+    controller = profile.controller()
+    predictor = profile.predictor()
+
+    # one device session and one belt connection for both phases, no reconnect in between
+    events = EventRecorder() if EVENT_CLIPS else None
+    with OakSession(profile.mxid, crop_mode=CROP_MODE, events=events, roi=FINETUNE_ROI,
+                    settings=profile.device_settings()) as session, ConveyorActuator() as conveyor, \
+            AnnotationSink(DISPLAY, VIEW_RECORD_PATH) as viewer:
+        if PROFILE_PATH:
+            ProfileWatcher(PROFILE_PATH, live_updater(session, controller, predictor), profile=profile).start()
+        recorder = None
+        if RECORD_PATH:
+            recorder = Recorder(RECORD_PATH, clock=session.clock, panel_id=my_id, speed=my_speed)
+            session.recorder = recorder
+            conveyor = RecordingConveyor(conveyor, session.clock, recorder)
+        qr_bbox_0 = move(my_id,my_speed,'forw',False,session,conveyor,viewer,predictor)
+        session.flush()
+        # finetune() only pulses the belt if the coarse stop missed the window
+        result = eval_loop_notimeout.finetune(my_id,session,conveyor,viewer,controller)
+        if qr_bbox_0 is not None:
+            # where the panel really came to rest corrects the coast estimate of the next stop
+            predictor.record_outcome(result.start_x)
+            print("Coast estimate [px]: ",predictor.coast_px)
+        print("Conveyor command latency (count, median s, max s): ",conveyor.latency_stats())
+        if recorder is not None:
+            recorder.close()
+        print(METRICS.report())
+        if METRICS_PATH:
+            METRICS.dump(METRICS_PATH)
+        if events is not None:
+            # the post-event footage still has to come from the device
+            events.wait(events.post_seconds + 2)
 
 # mini_budge = True
 # time_step = 0.25
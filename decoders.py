@@ -0,0 +1,199 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import cv2
+import zbar
+
+from metrics import METRICS
+
+FRAME_BUDGET = 0.015 # s of decoding per frame before the fallbacks are skipped
+REORDER_EVERY = 50 # decodes between re-sorting the chain
+UPSCALE = 2
+DECODE_WORKERS = 4 # threads decoding the crops of one frame, 1 decodes serially
+DECODE_DEADLINE = 0.05 # s, crops not decoded by then count as failed for this frame
+
+
+class ZbarDecoder:
+    ''' zbar on the crop as is; scanners are not thread safe, one per thread '''
+    name = "zbar"
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def scanner(self):
+        scanner = getattr(self._local, "scanner", None)
+        if scanner is None:
+            scanner = self._local.scanner = zbar.Scanner()
+        return scanner
+
+    def prepare(self, img):
+        return img
+
+    def __call__(self, img):
+        results = self.scanner.scan(self.prepare(img))
+        if results:
+            return results[0].data.decode('utf-8')
+        return None
+
+
+class ClaheDecoder(ZbarDecoder):
+    ''' zbar on a local contrast equalized crop, for glare and shadows across the code '''
+    name = "zbar_clahe"
+
+    def prepare(self, img):
+        clahe = getattr(self._local, "clahe", None)
+        if clahe is None:
+            clahe = self._local.clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(4, 4))
+        return clahe.apply(img)
+
+
+class ThresholdDecoder(ZbarDecoder):
+    ''' zbar on an Otsu binarized crop, for low contrast prints '''
+    name = "zbar_otsu"
+
+    def prepare(self, img):
+        return cv2.threshold(img, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+
+
+class UpscaleDecoder(ZbarDecoder):
+    ''' zbar on a 2x crop, for codes with modules only a pixel or two wide '''
+    name = "zbar_upscale"
+
+    def prepare(self, img):
+        return cv2.resize(img, None, fx=UPSCALE, fy=UPSCALE, interpolation=cv2.INTER_CUBIC)
+
+
+class OpenCVDecoder:
+    ''' cv2 QRCodeDetectorAruco (OpenCV >= 4.8) or QRCodeDetector, handles perspective better than zbar '''
+    name = "opencv"
+
+    def __init__(self):
+        self._local = threading.local()
+        self._detector = getattr(cv2, "QRCodeDetectorAruco", None) or cv2.QRCodeDetector
+
+    def __call__(self, img):
+        detector = getattr(self._local, "detector", None)
+        if detector is None:
+            detector = self._local.detector = self._detector()
+        text, points, _ = detector.detectAndDecode(img)
+        return text or None
+
+
+class DecoderChain:
+    ''' Tries decoders on a grayscale crop until one reads it, cheapest per success first.
+
+    Every decoder keeps attempts, successes and total time; every
+    REORDER_EVERY decodes the chain is sorted by expected cost per decoded
+    code (mean time / success rate). A fallback is only measured on crops
+    the decoders ahead of it failed on, and stays behind every measured
+    decoder until it has been tried. The first decoder always runs, the rest
+    only while the frame's time budget (start_frame()) lasts, so one hard
+    crop cannot stall the loop. Safe to call from several decode threads.
+    '''
+    def __init__(self, decoders, budget=FRAME_BUDGET):
+        self.decoders = list(decoders)
+        self.budget = budget
+        self.stats = {d.name: [0, 0, 0.0] for d in self.decoders} # attempts, successes, seconds
+        self._rank = {d.name: i for i, d in enumerate(self.decoders)} # given order, breaks ties
+        self._decodes = 0
+        self._deadline = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def default(cls, budget=FRAME_BUDGET):
+        ''' zbar raw -> CLAHE -> Otsu -> OpenCV -> upscaled, until reordered by the stats '''
+        return cls([ZbarDecoder(), ClaheDecoder(), ThresholdDecoder(), OpenCVDecoder(), UpscaleDecoder()], budget)
+
+    def start_frame(self):
+        self._deadline = time.perf_counter() + self.budget if self.budget is not None else None
+
+    def __call__(self, img):
+        if img is None or img.size == 0:
+            return None
+        text = None
+        with self._lock:
+            decoders = list(self.decoders)
+        for i, decoder in enumerate(decoders):
+            if i > 0 and self._deadline is not None and time.perf_counter() >= self._deadline:
+                break
+            start = time.perf_counter()
+            try:
+                text = decoder(img)
+            except cv2.error:
+                text = None
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                row = self.stats[decoder.name]
+                row[0] += 1
+                row[2] += elapsed
+                if text is not None:
+                    row[1] += 1
+            if text is not None:
+                break
+
+        with self._lock:
+            self._decodes += 1
+            if self._decodes % REORDER_EVERY == 0:
+                self._reorder()
+        return text
+
+    def _cost(self, decoder):
+        attempts, successes, seconds = self.stats[decoder.name]
+        if attempts == 0:
+            # untried, behind everything measured and in its given order
+            return (float("inf"), self._rank[decoder.name])
+        # +1 / +2 smoothing so a decoder with no success yet is expensive, not infinite
+        return ((seconds / attempts) / ((successes + 1) / (attempts + 2)), self._rank[decoder.name])
+
+    def _reorder(self):
+        self.decoders.sort(key=self._cost)
+
+    def report(self):
+        lines = [f"{'decoder':<14}{'attempts':>10}{'decoded':>10}{'mean ms':>10}"]
+        for d in self.decoders:
+            attempts, successes, seconds = self.stats[d.name]
+            rate = successes / attempts * 100 if attempts else 0
+            ms = seconds / attempts * 1000 if attempts else 0
+            lines.append(f"{d.name:<14}{attempts:>10}{rate:>9.0f}%{ms:>10.2f}")
+        return "\n".join(lines)
+
+
+class DecodeExecutor:
+    ''' Decodes all crops of a frame in parallel and gathers them within a deadline.
+
+    OpenCV releases the GIL while it works, so the contrast fixes and the
+    OpenCV decoder overlap across cores; a crop that is not done by
+    `deadline` s counts as failed for this frame (its thread finishes in the
+    background). Per-frame wall time goes to METRICS as "decode_frame".
+    '''
+    def __init__(self, workers=DECODE_WORKERS, deadline=DECODE_DEADLINE):
+        self.workers = workers
+        self.deadline = deadline
+        self.late = 0
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="decode") if workers > 1 else None
+
+    def map(self, fn, items):
+        ''' [fn(item) or None if late] in the order of items '''
+        start = time.perf_counter()
+        if self._pool is None or len(items) < 2:
+            results = [fn(item) for item in items]
+        else:
+            futures = [self._pool.submit(fn, item) for item in items]
+            done, _ = wait(futures, timeout=self.deadline)
+            results = []
+            for f in futures:
+                if f in done:
+                    results.append(f.result())
+                else:
+                    f.cancel()
+                    self.late += 1
+                    results.append(None)
+        if items:
+            METRICS.observe("decode_frame", time.perf_counter() - start)
+        return results
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
@@ -0,0 +1,137 @@
+import os
+import time
+import argparse
+import itertools
+
+import depthai as dai
+
+# None keeps the depthai default of each setting
+WATCHDOG_MS = None # device resets this long after the host stops talking to it, 0 disables
+WATCHDOG_INITIAL_DELAY_MS = None # grace period after boot before the watchdog is armed
+XLINK_CHUNK_SIZE = None # bytes per XLink write, 0 sends every message in one piece
+BOOTUP_TIMEOUT_MS = None # max wait for the device to boot the firmware
+CONNECT_TIMEOUT_MS = None # max wait for a booted device to accept the connection
+
+
+class DeviceSettings:
+    ''' Watchdog, XLink chunk size and boot/connect timeouts used to open a device.
+
+    After a pulled cable or a crashed host the PoE device keeps the old
+    connection until its watchdog resets it, only then can it be opened again
+    (reconnect.probe() sees it as busy until then). A shorter watchdog gives a
+    faster reconnect, one shorter than the longest host stall drops a working
+    device. The timeouts bound a single open attempt before the
+    ReconnectSupervisor backs off and retries. Measure with
+    `python device_config.py --watchdog ...` instead of guessing sleeps.
+    '''
+    def __init__(self, watchdog_ms=WATCHDOG_MS, watchdog_initial_delay_ms=WATCHDOG_INITIAL_DELAY_MS,
+                 xlink_chunk_size=XLINK_CHUNK_SIZE, bootup_timeout_ms=BOOTUP_TIMEOUT_MS,
+                 connect_timeout_ms=CONNECT_TIMEOUT_MS):
+        self.watchdog_ms = watchdog_ms
+        self.watchdog_initial_delay_ms = watchdog_initial_delay_ms
+        self.xlink_chunk_size = xlink_chunk_size
+        self.bootup_timeout_ms = bootup_timeout_ms
+        self.connect_timeout_ms = connect_timeout_ms
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**{k: v for k, v in (d or {}).items() if v is not None})
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def __repr__(self):
+        return "DeviceSettings(" + ", ".join(f"{k}={v}" for k, v in vars(self).items() if v is not None) + ")"
+
+    def config(self, pipeline):
+        ''' dai.Device.Config of `pipeline` with the watchdog overrides '''
+        config = pipeline.getDeviceConfig()
+        if self.watchdog_ms is not None:
+            config.board.watchdogTimeoutMs = self.watchdog_ms
+        if self.watchdog_initial_delay_ms is not None:
+            config.board.watchdogInitialDelayMs = self.watchdog_initial_delay_ms
+        return config
+
+    def apply(self, pipeline):
+        if self.xlink_chunk_size is not None:
+            pipeline.setXLinkChunkSize(self.xlink_chunk_size)
+        # depthai reads the boot and connect timeouts from the environment only
+        for name, value in (("DEPTHAI_BOOTUP_TIMEOUT", self.bootup_timeout_ms),
+                            ("DEPTHAI_CONNECT_TIMEOUT", self.connect_timeout_ms)):
+            if value is not None:
+                os.environ[name] = str(value)
+
+    def open(self, pipeline, mxid=None):
+        ''' dai.Device running `pipeline`, on `mxid` or the first device found '''
+        self.apply(pipeline)
+        info = dai.DeviceInfo(mxid) if mxid else None
+        if self.watchdog_ms is None and self.watchdog_initial_delay_ms is None:
+            return dai.Device(pipeline, info) if info is not None else dai.Device(pipeline)
+
+        config = self.config(pipeline)
+        device = dai.Device(config, info) if info is not None else dai.Device(config)
+        try:
+            device.startPipeline(pipeline)
+        except RuntimeError:
+            device.close()
+            raise
+        return device
+
+
+def time_to_first_frame(settings, mxid, runs=3, stream="nn", pipeline=None):
+    ''' [(open s, first frame s, ready again s)] for `runs` open/close cycles
+
+    open: dai.Device created and the pipeline running, first frame: open
+    until the first `stream` message arrives, ready again: clean close until
+    the probe sees the device openable again. After an unclean loss the
+    watchdog comes on top of "ready again", that sum is the shortest safe
+    reconnect wait.
+    '''
+    from qr_pipeline import create_pipeline
+    from reconnect import ReconnectSupervisor, probe, OK
+
+    pipeline = pipeline if pipeline is not None else create_pipeline()
+    supervisor = ReconnectSupervisor(mxid, name="bench", base_delay=0.1, max_delay=0.5, jitter=0)
+    rows = []
+    for _ in range(runs):
+        start = time.monotonic()
+        device = supervisor.connect(lambda: settings.open(pipeline, mxid))
+        opened = time.monotonic()
+        try:
+            device.getOutputQueue(stream, maxSize=1, blocking=False).get()
+            first = time.monotonic()
+        finally:
+            device.close()
+        closed = time.monotonic()
+        while probe(mxid)[0] != OK:
+            time.sleep(0.05)
+        rows.append((opened - start, first - opened, time.monotonic() - closed))
+    return rows
+
+
+def benchmark(mxid, watchdogs=(None,), chunks=(None,), runs=3):
+    ''' time_to_first_frame() for every watchdog x chunk size combination, prints a table '''
+    print(f"{'watchdog ms':>12}{'chunk':>8}{'open s':>9}{'frame s':>9}{'ttff s':>9}{'ready s':>9}{'safe s':>9}")
+    results = []
+    for watchdog, chunk in itertools.product(watchdogs, chunks):
+        settings = DeviceSettings(watchdog_ms=watchdog, xlink_chunk_size=chunk)
+        rows = time_to_first_frame(settings, mxid, runs)
+        # median run, one slow PoE boot should not decide it
+        opened, first, ready = (sorted(col)[len(col) // 2] for col in zip(*rows))
+        safe = ready + (watchdog if watchdog is not None else 0) / 1000
+        print(f"{str(watchdog):>12}{str(chunk):>8}{opened:>9.2f}{first:>9.2f}{opened + first:>9.2f}"
+              f"{ready:>9.2f}{safe:>9.2f}")
+        results.append((settings, opened + first, safe))
+    return results
+
+
+if __name__ == "__main__":
+    from oak_session import oak_d_poe
+
+    parser = argparse.ArgumentParser(description="Time to first frame and reconnect time per device setting.")
+    parser.add_argument("--mxid", type=str, default=oak_d_poe, help="Device to benchmark")
+    parser.add_argument("--watchdog", type=int, nargs="+", default=[None], help="Watchdog timeouts in ms to try")
+    parser.add_argument("--chunk", type=int, nargs="+", default=[None], help="XLink chunk sizes in bytes to try")
+    parser.add_argument("--runs", type=int, default=3, help="Open/close cycles per setting")
+    args = parser.parse_args()
+    benchmark(args.mxid, args.watchdog, args.chunk, args.runs)
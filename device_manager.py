@@ -0,0 +1,221 @@
+import time
+import argparse
+import threading
+from pathlib import Path
+
+import depthai as dai
+from reconnect import ReconnectSupervisor, OK
+
+# role -> camera, overridden by a YAML file with the same layout:
+#   s2:
+#     mxid: 18443010E157E40F00
+#     task: grab_s2
+DEFAULT_CONFIG = {
+    "s2": {"mxid": "18443010E157E40F00", "task": "grab_s2"},
+    "sr": {"mxid": "19443010F156DF1200", "task": "grab_sr"},
+    "poe": {"mxid": "1844301021A55C1200", "task": "detect"},
+}
+
+
+def _grab_s2(mxid, duration, output_dir):
+    from cam_grab_cmd import cam_grab_s2
+    cam_grab_s2(mxid=mxid, duration=duration, output_dir=output_dir)
+
+
+def _grab_sr(mxid, duration, output_dir):
+    from cam_grab_cmd import cam_grab_sr
+    cam_grab_sr(mxid=mxid, duration=duration, output_dir=output_dir)
+
+
+def _record_s2(mxid, duration, output_dir):
+    from record_cam_cmd import record_oak_s2
+    record_oak_s2(mxid=mxid, duration_seconds=duration, output_dir=output_dir)
+
+
+def _record_sr(mxid, duration, output_dir):
+    from record_cam_cmd import record_oak_sr
+    record_oak_sr(mxid=mxid, duration_seconds=duration, output_dir=output_dir)
+
+
+def _detect(mxid, duration, output_dir):
+    ''' print every QR code the detection pipeline decodes for `duration` s '''
+    from oak_session import OakSession
+    from qr_pipeline import QRDecoder
+
+    decoder = QRDecoder()
+    # a single open attempt, the CameraWorker does the backoff and retries
+    with OakSession(mxid, supervisor=ReconnectSupervisor(mxid, name="detect", max_retries=0)) as session:
+        end_time = time.time() + duration
+        while time.time() < end_time:
+            frame, detections = session.get()
+            for r in decoder.process(frame, detections, session.crops):
+                if r.text is not None:
+                    print(f"[{mxid}] {r.text} {r.bbox}")
+
+
+# every task is task(mxid, duration, output_dir) and opens its own device
+TASKS = {
+    "grab_s2": _grab_s2,
+    "grab_sr": _grab_sr,
+    "record_s2": _record_s2,
+    "record_sr": _record_sr,
+    "detect": _detect,
+}
+
+
+def load_config(path=None):
+    ''' role -> {"mxid", "task"} from a YAML file, or DEFAULT_CONFIG '''
+    if path is None:
+        return {role: dict(cam) for role, cam in DEFAULT_CONFIG.items()}
+    import yaml
+
+    with open(path) as f:
+        config = yaml.safe_load(f) or {}
+    for role, cam in config.items():
+        if "mxid" not in cam:
+            raise ValueError(f"Camera role {role} in {path} has no mxid")
+        if cam.get("task") not in TASKS:
+            raise ValueError(f"Camera role {role} in {path} has unknown task {cam.get('task')!r}, "
+                             f"expected one of {sorted(TASKS)}")
+        cam["mxid"] = str(cam["mxid"])
+    return config
+
+
+def discover():
+    ''' {mxid: state} of every device on USB and the network, see get_mxid.py '''
+    return {info.getMxId(): info.state for info in dai.Device.getAllAvailableDevices()}
+
+
+class CameraWorker(threading.Thread):
+    ''' Runs one role's task on its own thread and reconnects it independently.
+
+    A RuntimeError from depthai (device lost, not found, boot failed) only
+    restarts this camera, with backoff and once its probe sees it again
+    (reconnect.ReconnectSupervisor); the other cameras keep running.
+    With `repeat` the task runs again until stop() instead of once.
+    '''
+    def __init__(self, role, mxid, task, duration, output_dir, repeat=False, retries=3):
+        super().__init__(name=f"cam-{role}", daemon=True)
+        self.role = role
+        self.mxid = mxid
+        self.task = TASKS[task]
+        self.duration = duration
+        self.output_dir = output_dir
+        self.repeat = repeat
+        self.retries = retries
+        self.runs = 0
+        self.errors = 0
+        self.last_error = None
+        self.supervisor = ReconnectSupervisor(mxid, name=role)
+        self._halt = threading.Event()
+
+    def run(self):
+        failures = 0
+        while not self._halt.is_set():
+            # after a failure only reopen once the device is back on the network
+            status = self.supervisor.check() if failures else OK
+            if status == OK:
+                try:
+                    self.task(self.mxid, self.duration, self.output_dir)
+                    self.runs += 1
+                    failures = 0
+                    self.supervisor.recovered()
+                    if not self.repeat:
+                        return
+                    continue
+                except RuntimeError as e:
+                    self.errors += 1
+                    self.last_error = e
+                    print(f"[{self.role}] Error: {e}")
+            failures += 1
+            self.supervisor.lost()
+            if not self.repeat and failures > self.retries:
+                print(f"[{self.role}] Giving up after {failures} attempts")
+                return
+            delay = self.supervisor.delay(failures)
+            print(f"[{self.role}] Device {'lost' if status == OK else status}, retrying in {delay:.1f} s")
+            self._halt.wait(delay)
+
+    def stop(self):
+        self._halt.set()
+
+
+class DeviceManager:
+    ''' Starts the configured task of every camera present, all at the same time.
+
+    Each camera runs on its own CameraWorker thread (depthai releases the GIL
+    while waiting on XLink) so a grab from the S2, the SR and the PoE falls
+    in the same time window instead of one device after the other. Output of
+    each role goes to output_dir/<role>.
+    '''
+    def __init__(self, config=None, output_dir='image_eval_data', duration=2, repeat=False):
+        self.config = config if config is not None else load_config()
+        self.output_dir = output_dir
+        self.duration = duration
+        self.repeat = repeat
+        self.workers = []
+
+    def assign(self, available=None):
+        ''' roles whose camera is connected, warns about missing and unassigned devices '''
+        available = discover() if available is None else available
+        present = {}
+        for role, cam in self.config.items():
+            if cam["mxid"] in available:
+                present[role] = cam
+            else:
+                print(f"Camera {role} ({cam['mxid']}) not found")
+        known = {cam["mxid"] for cam in self.config.values()}
+        for mxid in available:
+            if mxid not in known:
+                print(f"Device {mxid} has no role in the config, ignoring it")
+        return present
+
+    def start(self, available=None):
+        for role, cam in self.assign(available).items():
+            output_dir = str(Path(self.output_dir) / role)
+            worker = CameraWorker(role, cam["mxid"], cam["task"], cam.get("duration", self.duration),
+                                  output_dir, self.repeat)
+            worker.start()
+            self.workers.append(worker)
+        return self
+
+    def join(self):
+        try:
+            for worker in self.workers:
+                while worker.is_alive():
+                    worker.join(0.5)
+        except KeyboardInterrupt:
+            self.stop()
+        return self.status()
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+    def status(self):
+        return {w.role: {"mxid": w.mxid, "runs": w.runs, "errors": w.errors, "last_error": w.last_error,
+                         "reconnects": w.supervisor.reconnects, "downtime": w.supervisor.downtime}
+                for w in self.workers}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a task on every connected OAK camera in parallel.")
+    parser.add_argument("--config", type=str, help="YAML file mapping roles to mxid and task")
+    parser.add_argument("--duration", type=int, default=2, help="Duration of each task in seconds")
+    parser.add_argument("--output_dir", type=str, default='image_eval_data', help="Output directory, one subdirectory per role")
+    parser.add_argument("--repeat", action="store_true", help="Run the tasks again until Ctrl+C")
+    parser.add_argument("--list", action="store_true", help="Only list the connected devices and their roles")
+    args = parser.parse_args()
+
+    manager = DeviceManager(load_config(args.config), args.output_dir, args.duration, args.repeat)
+    if args.list:
+        roles = {cam["mxid"]: role for role, cam in manager.config.items()}
+        for mxid, state in discover().items():
+            print(f"{mxid} {state} {roles.get(mxid, '-')}")
+    else:
+        start = time.time()
+        status = manager.start().join()
+        for role, s in status.items():
+            print(f"{role} ({s['mxid']}): {s['runs']} runs, {s['errors']} errors, "
+                  f"{s['reconnects']} reconnects, {s['downtime']:.1f} s down")
+        print(f"All cameras done in {time.time() - start:.1f} s")
@@ -1,230 +1,64 @@
-import time
-import cv2
-import depthai as dai
-import numpy as np
-import blobconverter
-import zbar
-from conveyor import Conveyor
-
-def finetune(panel_id):
-
-    DISPLAY = False # display camera image (set to none on RPi)
-
-    FRAME_SIZE = (1440,1080)
-    FOCUS_VALUE = 175 # 0-255, 0>inf, 150>30cm, 200>10cm, 255>8cm
-    FPS = 30
-
-    BLUR = False # apply blur to image before decoding
-    BLUR_KERNEL = (7,7) # blur kernel size (width, height)
-
-    BBOX_EXPANSION_PERCENT = 200 # expand bounding box by percent before decoding
-    DETECTION_THRESHOLD = 0.9 # minimum confidence threshold for detection
-
-    USE_EXP_LIMIT_TUNING = False # use exposure limit tuning, will disable manual exposure
-    EXP_LIMIT = 8300 # exposure limit in us, either 8300 (default) or 500
-
-    MANUAL_EXPOSURE = True # set manual exposure
-    EXP_TIME = 1000 # sensor exposure time, range 1 to 33000
-    SENS_ISO = 1600 # sesnor sensitivity, range 100 to 1600
-
-    # Create pipeline
-    pipeline = dai.Pipeline()
-    if USE_EXP_LIMIT_TUNING:
-        MANUAL_EXPOSURE = False
-        if EXP_LIMIT == 500:
-            pipeline.setCameraTuningBlobPath('./tuning_exp_limit_500us.bin')
+import eval_align
+from qr_pipeline import QRDecoder, roi_rect
+from oak_session import OakSession
+from alignment import AlignmentController
+from actuator import ConveyorActuator
+
+MEASURE_MAX_FRAMES = 60 # frames measure() waits for the panel before the alignment counts it as lost
+
+def finetune(panel_id, session=None, conveyor=None, viewer=None, controller=None):
+
+    # reuse the caller's session (e.g. the one move() ran on) instead of reconnecting
+    owns_session = session is None
+    if owns_session:
+        session = OakSession().open()
+
+    decoder = QRDecoder()
+
+    def measure():
+        ''' panel QR bbox x from the first frame it decodes in after the belt stopped '''
+        # frames queued during the last pulse show the belt in motion, and a
+        # frame captured before the stop can still arrive after the flush
+        session.flush()
+        session.skip_before(session.clock())
+        # the belt moved, a cached text would stick to whatever code now sits in an old box
+        decoder.tracker.reset()
+        bbox = eval_align.locate(panel_id, session, decoder, viewer, MEASURE_MAX_FRAMES)
+        if bbox is None:
+            return None
+        if session.roi:
+            # only the band between the panel and the target window from here on,
+            # higher resolution for the network and less to send and decode
+            w = bbox[2] - bbox[0]
+            target = (controller.target_min, bbox[1], controller.target_max + w, bbox[3])
+            rect = roi_rect([bbox, target])
+            if rect != session.roi_rect:
+                session.set_roi(rect)
+        qr_bbox_0 = bbox[0]
+        print("QR bbox [0]: ",qr_bbox_0)
+        return qr_bbox_0
+
+    # one persistent belt connection, pulses sized from the pixel error
+    owns_conveyor = conveyor is None
+    if owns_conveyor:
+        conveyor = ConveyorActuator()
+    if controller is None:
+        controller = AlignmentController()
+
+    try:
+        result = controller.align(measure, conveyor)
+        print(result)
+        if not result.converged:
+            session.event("misaligned")
+        return result
+    finally:
+        if session.roi_rect is not None:
+            session.set_roi(None)
+        if owns_conveyor:
+            conveyor.close()
         else:
-            pipeline.setCameraTuningBlobPath('./tuning_exp_limit_8300us.bin')
-
-    # Define camera node
-    cam = pipeline.create(dai.node.ColorCamera)
-    cam.setResolution(dai.ColorCameraProperties.SensorResolution.THE_1080_P)
-    cam.setPreviewSize(FRAME_SIZE)
-    cam.setInterleaved(False)
-    cam.initialControl.setManualFocus(FOCUS_VALUE)
-    cam.setFps(FPS)
-
-    # Define image preprocessor node
-    # --> dection model requires 384x384, grayscale input image
-    proc = pipeline.create(dai.node.ImageManip)
-    proc.initialConfig.setResize(384,384)
-    proc.initialConfig.setFrameType(dai.ImgFrame.Type.GRAY8)
-    proc.initialConfig.setKeepAspectRatio(False)
-
-    # Define QR detection model
-    nn = pipeline.create(dai.node.MobileNetDetectionNetwork)
-    nn.setConfidenceThreshold(DETECTION_THRESHOLD)
-    nn.setBlobPath(blobconverter.from_zoo(name="qr_code_detection_384x384", zoo_type="depthai", shaves=6))
-    nn.input.setQueueSize(1)
-    nn.input.setBlocking(False)
-
-    # Define input nodes
-    controlIn = pipeline.create(dai.node.XLinkIn)
-    controlIn.setStreamName("control")
-
-    # Define output nodes
-    camOut = pipeline.create(dai.node.XLinkOut)
-    camOut.setStreamName("camera")
-    nnOut = pipeline.create(dai.node.XLinkOut)
-    nnOut.setStreamName("nn")
-
-    # Link the nodes
-    cam.preview.link(proc.inputImage)
-    proc.out.link(nn.input)
-    cam.preview.link(camOut.input)
-    nn.out.link(nnOut.input)
-    controlIn.out.link(cam.inputControl)
-
-    # Define a variable to specify the number of connection retry attempts
-    MAX_CONNECTION_RETRIES = 5
-
-    oak_d_poe = "1844301021A55C1200"
-
-    while True:
-        try:
-
-            # Connect to a device and start the pipeline
-            with dai.Device(pipeline, dai.DeviceInfo(oak_d_poe)) as device:
-        
-                class TextHelper:
-                    def __init__(self) -> None:
-                        self.bg_color = (0, 0, 0)
-                        self.color = (255, 255, 255)
-                        self.text_type = cv2.FONT_HERSHEY_SIMPLEX
-                        self.line_type = cv2.LINE_AA
-                    def putText(self, frame, text, coords):
-                        cv2.putText(frame, text, coords, self.text_type, 0.8, self.bg_color, 3, self.line_type)
-                        cv2.putText(frame, text, coords, self.text_type, 0.8, self.color, 1, self.line_type)
-                    def rectangle(self, frame, p1, p2):
-                        cv2.rectangle(frame, p1, p2, self.bg_color, 6)
-                        cv2.rectangle(frame, p1, p2, self.color, 1)
-                
-                def decode(frame, bbox, scanner):
-                    # crop frame to bbox area
-                    img = frame[bbox[1]:bbox[3], bbox[0]:bbox[2]]
-                    
-                    # zbar requires grayscale images
-                    img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-                    if BLUR:
-                        # remove high frequency noise
-                        img = cv2.GaussianBlur(img, BLUR_KERNEL, 0)
-        
-                    # decode QR code
-                    results = scanner.scan(img)
-        
-                    if results:
-                        # decoding successful
-                        return results[0].data.decode('utf-8')
-                        
-                    else:
-                        # decoding failed
-                        return None
-        
-                def expandDetection(det, percent=BBOX_EXPANSION_PERCENT):
-                    ''' expand bounding box by percent '''
-                    percent /= 200
-                    w = det.xmax - det.xmin
-                    h = det.ymax - det.ymin
-                    det.xmin = max(0, det.xmin - w * percent)
-                    det.xmax = min(1, det.xmax + w * percent)
-                    det.ymin = max(0, det.ymin - h * percent)
-                    det.ymax = min(1, det.ymax + h * percent)
-                    
-                def frameNorm(frame, bbox):
-                    ''' de-normalize bounding box coordinates '''
-                    normVals = np.full(len(bbox), frame.shape[0])
-                    normVals[::2] = frame.shape[1]
-                    return (np.clip(np.array(bbox), 0, 1) * normVals).astype(int)
-                
-                def clamp(num, v0, v1):
-                    return max(v0, min(num, v1))
-        
-                qCam = device.getOutputQueue("camera", maxSize=4, blocking=False)
-                qDet = device.getOutputQueue("nn", maxSize=4, blocking=False)
-                controlQueue = device.getInputQueue('control')
-        
-                if MANUAL_EXPOSURE:
-                    # set manual exposure
-                    expTime = EXP_TIME
-                    sensIso = SENS_ISO
-                    expTime = clamp(expTime, 1, 33000)
-                    sensIso = clamp(sensIso, 100, 1600)
-                    print("Setting manual exposure -- time:", expTime, "  iso:", sensIso)
-                    ctrl = dai.CameraControl()
-                    ctrl.setManualExposure(expTime, sensIso)
-                    controlQueue.send(ctrl)
-        
-                c = TextHelper()
-                scanner = zbar.Scanner()
-                qr_bbox_0 = 9999
-
-                while qr_bbox_0 > 780:
-                    frame = qCam.get().getCvFrame()
-                    detections = qDet.get().detections
-                    qr_bbox = [9999, 9999, 9999, 9999]
-                    stop_bbox = [999,999,999,999]
-        
-                    qr_bbox_left_bound = 50
-                    qr_bbox_right_bound = 999
-
-        
-                    for det in detections:
-                        # expand and denormalize bbox
-                        expandDetection(det)
-                        bbox = frameNorm(frame, (det.xmin, det.ymin, det.xmax, det.ymax))
-        
-                        # decode QR image
-                        text = decode(frame, bbox, scanner)
-        
-                        if text == "STOP":
-                            print("Text = STOP")
-                            stop_bbox = bbox
-                            print("STOP bbox: ",stop_bbox)
-        
-                        elif text != None and len(text) > 5 and text == panel_id:
-                            print("Panel QR code")
-                            qr_bbox = bbox
-                            print("QR bbox: ",qr_bbox)
-                            qr_bbox_0 = qr_bbox[0]
-                            print("QR bbox [0]: ",qr_bbox_0)
-                            conveyor = Conveyor()
-                            conveyor.speed(19)
-
-                            if qr_bbox_0 > 840:
-                                conveyor.reverse()
-                                time.sleep(0.25)
-                                conveyor.stop()
-                                time.sleep(2)
-                            elif qr_bbox_0 > 700:
-                                conveyor.reverse()
-                                time.sleep(0.25)
-                                conveyor.stop()
-                                time.sleep(2)
-                            if qr_bbox_0 < 780:
-                                return
-                        c.putText(frame, text, (bbox[0] + 10, bbox[1] + 40))
-        
-                        # if qr_bbox[0]-500 < stop_bbox[0] < qr_bbox[0]+500:
-                        #     print("ALIGNED")
-                        #     # conveyor.stop()
-                        #     # device.close()
-                        #     return
-                
-                        # add bbox, confidence, and decoded text to image
-                        c.rectangle(frame, (bbox[0], bbox[1]), (bbox[2], bbox[3]))
-                        c.putText(frame, f"{int(det.confidence * 100)}%", (bbox[0] + 10, bbox[1] + 30))
-                        c.putText(frame, text, (bbox[0] + 10, bbox[1] + 60))
-                    
-        
-                    if DISPLAY:
-                        cv2.imshow("Image", frame)
-        
-                        if cv2.waitKey(1) == ord('q'):
-                            break
-        except RuntimeError as e:
-            print(f"Error: {e}")
-            print("Camera not detected. Retrying in 5 seconds...")
-            time.sleep(5) # wait for 5 s before retry
+            conveyor.stop()
+        if owns_session:
+            session.close()
 
-#finetune(panel_id)
\ No newline at end of file
+#finetune(panel_id)
@@ -0,0 +1,150 @@
+import time
+import datetime
+import threading
+from collections import deque
+
+
+class FakeDetection:
+    ''' same fields as dai.ImgDetection, normalized 0..1 '''
+    def __init__(self, xmin, ymin, xmax, ymax, confidence=1.0, label=0):
+        self.xmin = xmin
+        self.ymin = ymin
+        self.xmax = xmax
+        self.ymax = ymax
+        self.confidence = confidence
+        self.label = label
+
+
+class FakeImgFrame:
+    def __init__(self, frame, seq=0, timestamp=None):
+        self._frame = frame
+        self._seq = seq
+        self._timestamp = timestamp if timestamp is not None else time.monotonic()
+
+    def getCvFrame(self):
+        return self._frame
+
+    def getFrame(self):
+        return self._frame
+
+    def getSequenceNum(self):
+        return self._seq
+
+    def getTimestamp(self):
+        return datetime.timedelta(seconds=self._timestamp)
+
+
+class FakeImgDetections:
+    def __init__(self, detections, seq=0, timestamp=None):
+        self.detections = detections
+        self._seq = seq
+        self._timestamp = timestamp if timestamp is not None else time.monotonic()
+
+    def getSequenceNum(self):
+        return self._seq
+
+    def getTimestamp(self):
+        return datetime.timedelta(seconds=self._timestamp)
+
+
+class FakeOutputQueue:
+    def __init__(self, source):
+        # source is a callable returning the next message or None when exhausted
+        self._source = source
+
+    def get(self):
+        msg = self._source()
+        if msg is None:
+            # not a RuntimeError, the loops would treat it as a lost link and reconnect
+            raise EOFError("Fake device has no more frames")
+        return msg
+
+    def tryGet(self):
+        return self._source()
+
+    def tryGetAll(self):
+        return []
+
+    def has(self):
+        return True
+
+
+class FakeInputQueue:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, msg):
+        self.sent.append(msg)
+
+
+class FakeDevice:
+    ''' Stand-in for dai.Device that replays (frame, detections) pairs.
+
+    `frames` is an iterable of (bgr_frame, [FakeDetection, ...]) or, for
+    recorded sessions, (bgr_frame, [FakeDetection, ...], timestamp_s). Each pair
+    is served once on the "camera" and "nn" queues with a shared sequence
+    number; without a timestamp frames are spaced 1/fps apart.
+    Control messages sent to any input queue are kept in `sent` for inspection.
+    '''
+    def __init__(self, frames, fps=30, realtime=False):
+        self._frames = iter(frames)
+        self._fps = fps
+        self._realtime = realtime
+        self._seq = 0
+        self._pending = {"camera": deque(), "nn": deque()}
+        self._input_queues = {}
+        self._last = None
+        self._last_ts = None
+        # queues may be read from FrameSync threads, one reader must not run
+        # more than `ahead` frames in front of the other
+        self._cond = threading.Condition()
+        self.ahead = 4
+        self.closed = False
+
+    def _advance(self):
+        try:
+            item = next(self._frames)
+        except StopIteration:
+            return False
+        frame, detections = item[:2]
+        ts = item[2] if len(item) > 2 else self._seq / self._fps
+        if self._realtime and self._last is not None:
+            delay = self._last + (ts - self._last_ts) - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        self._last = time.monotonic()
+        self._last_ts = ts
+        self._pending["camera"].append(FakeImgFrame(frame, self._seq, ts))
+        self._pending["nn"].append(FakeImgDetections(detections, self._seq, ts))
+        self._seq += 1
+        return True
+
+    def _next(self, name):
+        with self._cond:
+            pending = self._pending[name]
+            others = [q for n, q in self._pending.items() if n != name]
+            while not pending and any(len(q) >= self.ahead for q in others):
+                self._cond.wait(0.1)
+            if not pending and not self._advance():
+                return None
+            self._cond.notify_all()
+            return pending.popleft()
+
+    def getOutputQueue(self, name, maxSize=4, blocking=False):
+        return FakeOutputQueue(lambda: self._next(name))
+
+    def getInputQueue(self, name):
+        return self._input_queues.setdefault(name, FakeInputQueue())
+
+    def clock(self):
+        ''' replay time: capture time of the newest frame served '''
+        if self._last_ts is None:
+            return 0.0
+        return self._last_ts
+
+    @property
+    def sent(self):
+        return [msg for q in self._input_queues.values() for msg in q.sent]
+
+    def close(self):
+        self.closed = True
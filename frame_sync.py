@@ -0,0 +1,119 @@
+import queue
+import threading
+from metrics import METRICS
+
+
+class FrameSync:
+    ''' Pairs camera ImgFrames with their ImgDetections in background threads.
+
+    One reader thread per output queue files messages by sequence number; a
+    pair is emitted once both halves of the same capture have arrived. Any
+    unmatched message older than an emitted pair can no longer be matched and
+    is dropped. get_synced() returns (frame, detections, latency_ms) where
+    latency_ms is the time from sensor capture to the pair being handed out.
+
+    With drop_old the output keeps only the newest `maxsize` pairs (live
+    device); without it readers block instead so a replay loses nothing.
+    '''
+    def __init__(self, qCam, qDet, clock, maxsize=4, drop_old=True):
+        self.clock = clock
+        self.drop_old = drop_old
+        self._queues = {"frame": qCam, "det": qDet}
+        self._pending = {"frame": {}, "det": {}}
+        self._lock = threading.Lock()
+        self._out = queue.Queue(maxsize)
+        self._stop = threading.Event()
+        self._threads = []
+        self._alive = 0
+        self.error = None
+        self.matched = 0
+        self.dropped = 0
+        self.timestamp = None # capture time of the last pair handed out
+
+    def start(self):
+        self._alive = len(self._queues)
+        for kind, q in self._queues.items():
+            t = threading.Thread(target=self._reader, args=(kind, q), name=f"sync-{kind}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _reader(self, kind, q):
+        while not self._stop.is_set():
+            try:
+                msg = q.get()
+            except Exception as e:
+                # link lost or replay finished, hand the error to get_synced()
+                # once the other reader has delivered what it still had
+                with self._lock:
+                    self.error = self.error or e
+                    self._alive -= 1
+                    last = self._alive == 0
+                if last:
+                    self._put(None)
+                return
+            METRICS.observe("xlink_" + ("nn" if kind == "det" else kind), self.clock() - msg.getTimestamp().total_seconds())
+            self._add(kind, msg)
+
+    def _add(self, kind, msg):
+        seq = msg.getSequenceNum()
+        other = "det" if kind == "frame" else "frame"
+        with self._lock:
+            match = self._pending[other].pop(seq, None)
+            if match is None:
+                self._pending[kind][seq] = msg
+                return
+            for pending in self._pending.values():
+                for s in [s for s in pending if s < seq]:
+                    del pending[s]
+                    self.dropped += 1
+            self.matched += 1
+        frame_msg, det_msg = (msg, match) if kind == "frame" else (match, msg)
+        self._put((frame_msg.getCvFrame(), det_msg))
+
+    def _put(self, item):
+        if self.drop_old:
+            while True:
+                try:
+                    self._out.put_nowait(item)
+                    return
+                except queue.Full:
+                    try:
+                        self._out.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+        while not self._stop.is_set():
+            try:
+                self._out.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def get_synced(self, timeout=None):
+        ''' next (frame, detections, latency_ms), raises the reader error if the stream ended '''
+        item = self._out.get(timeout=timeout)
+        if item is None:
+            raise self.error
+        frame, det_msg = item
+        self.timestamp = det_msg.getTimestamp().total_seconds()
+        latency_ms = (self.clock() - self.timestamp) * 1000
+        return frame, det_msg.detections, latency_ms
+
+    def flush(self):
+        ''' drop every pair and half pair received so far '''
+        with self._lock:
+            for pending in self._pending.values():
+                pending.clear()
+        while True:
+            try:
+                item = self._out.get_nowait()
+            except queue.Empty:
+                return
+            if item is None:
+                # keep the end-of-stream marker
+                self._out.put_nowait(None)
+                return
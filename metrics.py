@@ -0,0 +1,129 @@
+import time
+import threading
+from collections import deque
+
+# Stage latencies of the detect -> decode -> actuate path, all in seconds:
+#   xlink_frame / xlink_nn  device capture -> message read on the host
+#   capture_to_loop         device capture -> frame/detections pair handed to the loop
+#   decode                  one zbar decode of one bbox (cache misses only)
+#   decode_frame            wall time decoding all cache misses of one frame
+#   process                 QRDecoder.process() for one frame
+#   decision                pair handed to the loop -> stop command issued
+#   actuate_queue           stop/pulse issued -> picked up by the actuator thread
+#   actuate                 actuator thread executing the command on the drive
+#   reconnect               device lost -> connected again (downtime per outage)
+WINDOW = 1000 # samples kept per stage for the percentiles
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def percentile(sorted_values, q):
+    ''' nearest rank percentile of an already sorted list '''
+    if not sorted_values:
+        return None
+    i = min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values))) - 1))
+    return sorted_values[i]
+
+
+class StageMetrics:
+    ''' Rolling latency histograms per stage, safe to feed from any thread.
+
+    Keeps the last `window` samples of every stage for p50/p95/p99 plus an
+    all-time count and sum, and exports them as Prometheus text or CSV.
+    '''
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self._samples = {}
+        self._count = {}
+        self._sum = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        if seconds is None:
+            return
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = self._samples[stage] = deque(maxlen=self.window)
+                self._count[stage] = 0
+                self._sum[stage] = 0.0
+            samples.append(seconds)
+            self._count[stage] += 1
+            self._sum[stage] += seconds
+
+    def time(self, stage):
+        ''' context manager timing its block into `stage` '''
+        return _Timer(self, stage)
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._count.clear()
+            self._sum.clear()
+
+    def summary(self):
+        ''' {stage: {"count", "sum", "p50", "p95", "p99", "max"}} over the rolling window '''
+        with self._lock:
+            snapshot = {stage: sorted(samples) for stage, samples in self._samples.items()}
+            counts = dict(self._count)
+            sums = dict(self._sum)
+        result = {}
+        for stage, values in snapshot.items():
+            row = {"count": counts[stage], "sum": sums[stage]}
+            for q in QUANTILES:
+                row[f"p{int(q * 100)}"] = percentile(values, q)
+            row["max"] = values[-1] if values else None
+            result[stage] = row
+        return result
+
+    def report(self):
+        ''' one line per stage in ms, for the end of a run '''
+        lines = [f"{'stage':<16}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+        for stage, row in sorted(self.summary().items()):
+            lines.append(f"{stage:<16}{row['count']:>8}" + "".join(
+                f"{row[k] * 1000:>10.2f}" for k in ("p50", "p95", "p99", "max")))
+        return "\n".join(lines)
+
+    def to_prometheus(self, name="oak_stage_latency_seconds"):
+        ''' Prometheus text exposition format, one summary with a stage label '''
+        lines = [f"# HELP {name} Latency of each detect/decode/actuate stage.", f"# TYPE {name} summary"]
+        for stage, row in sorted(self.summary().items()):
+            for q in QUANTILES:
+                lines.append(f'{name}{{stage="{stage}",quantile="{q}"}} {row[f"p{int(q * 100)}"]:.6f}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {row["sum"]:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {row["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def to_csv(self):
+        lines = ["stage,count,sum_s,p50_s,p95_s,p99_s,max_s"]
+        for stage, row in sorted(self.summary().items()):
+            lines.append(",".join([stage, str(row["count"])] + [
+                f"{row[k]:.6f}" for k in ("sum", "p50", "p95", "p99", "max")]))
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        ''' write to `path`, Prometheus text for .prom and CSV otherwise '''
+        text = self.to_prometheus() if str(path).endswith(".prom") else self.to_csv()
+        with open(path, "w") as f:
+            f.write(text)
+
+
+class _Timer:
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+
+
+# shared by the session, decoder and actuator of one process
+METRICS = StageMetrics()
+
+
+def observe(stage, seconds):
+    METRICS.observe(stage, seconds)
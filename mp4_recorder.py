@@ -0,0 +1,171 @@
+import time
+from fractions import Fraction
+from pathlib import Path
+
+# fragmented MP4: a moof/mdat pair per keyframe, everything up to the last
+# complete fragment plays back even if the recorder is killed mid-file
+FRAGMENTED_MP4 = {"movflags": "frag_keyframe+empty_moov+default_base_moof"}
+
+CONTAINERS = {"mp4": ".mp4", "mkv": ".mkv"}
+
+# H.265 IRAP NAL unit types (BLA/IDR/CRA), a segment may only start on one
+_HEVC_IRAP = range(16, 24)
+_H264_IDR = 5
+
+
+def _nal_types(data, scan_bytes=256):
+    ''' NAL unit header bytes in the start of an Annex-B packet
+
+    the encoder puts VPS/SPS/PPS and the IRAP slice first, only the first
+    `scan_bytes` are searched so a 4K keyframe is not walked byte by byte
+    '''
+    head = bytes(memoryview(data).cast("B")[:scan_bytes])
+    i = head.find(b"\x00\x00\x01")
+    while i != -1 and i + 3 < len(head):
+        yield head[i + 3]
+        i = head.find(b"\x00\x00\x01", i + 3)
+
+
+def is_keyframe(data, codec):
+    if codec == "mjpeg":
+        return True
+    for header in _nal_types(data):
+        if codec == "hevc" and (header >> 1) & 0x3F in _HEVC_IRAP:
+            return True
+        if codec == "h264" and header & 0x1F == _H264_IDR:
+            return True
+    return False
+
+
+class Mp4Recorder:
+    ''' Muxes VideoEncoder packets into MP4/MKV while streaming, no remux needed after.
+
+    PTS come from the device timestamps of the packets, so dropped frames
+    show up as gaps instead of speeding the video up. MP4 is written
+    fragmented so a partial file survives a crash. A new segment is started
+    at the first keyframe after `max_seconds` or `max_bytes`; segments are
+    <base>.mp4, <base>_001.mp4, ... and listed in `files`.
+
+    Needs PyAV (`pip install av`). Without it packets are written as the raw
+    bitstream (<base>.h265) like before, which still needs an ffmpeg remux.
+    '''
+    def __init__(self, base, codec="hevc", fps=30, size=None, container="mp4", max_seconds=None, max_bytes=None):
+        self.base = str(base)
+        self.codec = codec
+        self.fps = fps
+        self.size = size
+        self.container = container
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self.files = []
+        self.frames = 0
+        self.dropped = 0 # packets before the first keyframe
+        self._output = None
+        self._stream = None
+        self._raw = None
+        self._segment_start = None
+        self._segment_bytes = 0
+        self._last_pts = None
+        Path(self.base).parent.mkdir(parents=True, exist_ok=True)
+        try:
+            import av
+            self._av = av
+        except ImportError:
+            self._av = None
+            print("PyAV is not installed, writing the raw bitstream instead of MP4")
+
+    def _path(self, suffix):
+        index = len(self.files)
+        return f"{self.base}{'' if index == 0 else f'_{index:03d}'}{suffix}"
+
+    def _open_segment(self, ts):
+        self._close_segment()
+        self._segment_start = ts
+        self._segment_bytes = 0
+        self._last_pts = None
+        if self._av is None:
+            path = self._path("." + ("h265" if self.codec == "hevc" else self.codec))
+            self._raw = open(path, "wb")
+        else:
+            path = self._path(CONTAINERS[self.container])
+            options = FRAGMENTED_MP4 if self.container == "mp4" else {}
+            self._output = self._av.open(path, "w", format=self.container, options=options)
+            self._stream = self._output.add_stream(self.codec, rate=self.fps)
+            self._stream.time_base = Fraction(1, 1000 * 1000)
+            if self.size is not None:
+                self._stream.width, self._stream.height = self.size
+            if self.codec == "mjpeg":
+                self._stream.pix_fmt = "yuvj420p"
+        self.files.append(path)
+
+    def _close_segment(self):
+        if self._output is not None:
+            self._output.close()
+            self._output = None
+            self._stream = None
+        if self._raw is not None:
+            self._raw.close()
+            self._raw = None
+
+    def _rotate_due(self, ts):
+        if self.max_seconds is not None and ts - self._segment_start >= self.max_seconds:
+            return True
+        return self.max_bytes is not None and self._segment_bytes >= self.max_bytes
+
+    def write(self, packet):
+        ''' mux one encoded ImgFrame from the VideoEncoder bitstream output '''
+        data = packet.getData()
+        ts = packet.getTimestamp().total_seconds()
+        key = is_keyframe(data, self.codec)
+        if self._segment_start is None or (key and self._rotate_due(ts)):
+            if not key:
+                # a segment has to start with a keyframe to be decodable
+                self.dropped += 1
+                return
+            self._open_segment(ts)
+
+        self._segment_bytes += len(data)
+        self.frames += 1
+        if self._raw is not None:
+            data.tofile(self._raw)
+            return
+
+        pts = int((ts - self._segment_start) * 1e6)
+        if self._last_pts is not None and pts <= self._last_pts:
+            # two packets with the same timestamp, keep PTS strictly increasing
+            pts = self._last_pts + 1
+        self._last_pts = pts
+        av_packet = self._av.Packet(data)
+        av_packet.pts = av_packet.dts = pts
+        av_packet.time_base = self._stream.time_base
+        av_packet.stream = self._stream
+        if key:
+            av_packet.is_keyframe = True
+        self._output.mux_one(av_packet)
+
+    def close(self):
+        self._close_segment()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def record_stream(q, duration_seconds, base, size=None, codec="hevc", fps=30, **options):
+    ''' mux packets from `q` into `base`.mp4 for `duration_seconds`, returns the files written '''
+    with Mp4Recorder(base, codec, fps, size, **options) as recorder:
+        print(f"Recording for {duration_seconds} seconds.")
+        start_time = time.time()
+
+        try:
+            while time.time() - start_time < duration_seconds:
+                packet = q.get()  # Blocking call, waits for new data
+                recorder.write(packet)
+        except KeyboardInterrupt:
+            # Keyboard interrupt (Ctrl + C) detected
+            pass
+
+    print(f"Recording complete. Video saved as {', '.join(recorder.files)}.")
+    return recorder.files
@@ -0,0 +1,225 @@
+import depthai as dai
+from frame_sync import FrameSync
+from metrics import METRICS
+from reconnect import ReconnectSupervisor
+from device_config import DeviceSettings
+import qr_pipeline
+from qr_pipeline import create_pipeline, clamp
+
+oak_d_poe = "1844301021A55C1200"
+
+ROI_SETTLE = 0.03 # s after set_roi() before frames are trusted to carry the new crop
+
+
+class OakSession:
+    ''' One long-lived connection to the OAK-D PoE.
+
+    Owns the pipeline, the camera/nn output queues and the control input so the
+    coarse move and the fine alignment run against the same device instead of
+    closing it and paying the PoE boot + pipeline upload again in between.
+
+    Pass `device` (e.g. fake_device.FakeDevice) to run without hardware.
+    With `crop_mode` use get_crops() instead of get(), see create_pipeline().
+    With a `recorder` (replay.Recorder) every pair returned by get() is recorded.
+    With `events` (ring_buffer.EventRecorder) the device also streams H.265
+    into its ring buffer and event() saves the footage around it.
+    With `roi` set_roi() crops the preview on the device (not with crop_mode);
+    get() then returns the cropped frame and `roi_offset` is its top left
+    corner in full frame px, pass it to QRDecoder.process().
+    Connecting and reconnecting go through `supervisor`
+    (reconnect.ReconnectSupervisor): PoE probe first, then backoff.
+    `settings` (device_config.DeviceSettings) sets the watchdog, XLink chunk
+    size and boot/connect timeouts the device is opened with.
+    '''
+    def __init__(self, mxid=oak_d_poe, device=None, crop_mode=False, recorder=None, events=None, roi=False,
+                 supervisor=None, settings=None):
+        if roi and crop_mode:
+            raise ValueError("roi and crop_mode cannot be combined, crop mode already sends only the codes")
+        self.mxid = mxid
+        self.device = device
+        self.crop_mode = crop_mode
+        self.recorder = recorder
+        self.events = events
+        self.roi = roi
+        self.roi_rect = None # normalized crop in effect, None for the full frame
+        self.roi_offset = (0, 0)
+        self._since = None # get() skips pairs captured before this
+        self.roiQueue = None
+        self.pipeline = None
+        self.qCam = None
+        self.qDet = None
+        self.qCrop = None
+        self._next_crop = None
+        self.crops = None # GRAY8 crops of the last get() in crop_mode
+        self.controlQueue = None
+        self.sync = None
+        self.timestamp = None # capture time of the last detections, see clock()
+        self.latency_ms = None # capture -> frame/detections pair handed to the loop
+        self._owns_device = device is None
+        self.supervisor = supervisor if supervisor is not None else ReconnectSupervisor(mxid, name="poe")
+        self.settings = settings if settings is not None else DeviceSettings()
+
+    def open(self):
+        if self.device is None:
+            if self.pipeline is None:
+                # built once, reused on every reconnect
+                self.pipeline = create_pipeline(self.crop_mode, encoded=self.events is not None, roi=self.roi)
+            # Connect to a device and start the pipeline
+            self.device = self.supervisor.connect(lambda: self.settings.open(self.pipeline, self.mxid))
+
+        if self.crop_mode:
+            self.qCrop = self.device.getOutputQueue("crops", maxSize=16, blocking=False)
+        else:
+            self.qCam = self.device.getOutputQueue("camera", maxSize=4, blocking=False)
+        self.qDet = self.device.getOutputQueue("nn", maxSize=4, blocking=False)
+        self.controlQueue = self.device.getInputQueue('control')
+        if self.roi:
+            self.roiQueue = self.device.getInputQueue('roi_cfg')
+            if self.roi_rect is not None:
+                # a reconnected device starts at the full frame again
+                self.set_roi(self.roi_rect)
+        if self.events is not None and self._owns_device:
+            self.events.attach(self.device.getOutputQueue("h265", maxSize=30, blocking=False))
+
+        if not self.crop_mode:
+            # pair frames and detections of the same capture in the background,
+            # a replayed (injected) device keeps every pair instead of dropping old ones
+            self.sync = FrameSync(self.qCam, self.qDet, self._host_clock, drop_old=self._owns_device).start()
+
+        # read at open time, a station profile (station.py) may have changed them
+        if qr_pipeline.MANUAL_EXPOSURE and not qr_pipeline.USE_EXP_LIMIT_TUNING:
+            self.set_manual_exposure(qr_pipeline.EXP_TIME, qr_pipeline.SENS_ISO)
+        return self
+
+    def reconnect(self):
+        ''' drop a dead link and open the device again with the same pipeline '''
+        self.supervisor.lost()
+        self.event("reconnect")
+        self.close()
+        if self._owns_device:
+            self.device = None
+        return self.open()
+
+    def close(self):
+        if self.sync is not None:
+            self.sync.stop()
+            self.sync = None
+        if self.device is not None and self._owns_device:
+            try:
+                self.device.close()
+            except RuntimeError:
+                pass
+
+    def event(self, reason):
+        ''' save the buffered footage around now, no-op without an EventRecorder '''
+        if self.events is not None:
+            self.events.trigger(reason)
+
+    def set_manual_exposure(self, exp_time, sens_iso):
+        exp_time = clamp(exp_time, 1, 33000)
+        sens_iso = clamp(sens_iso, 100, 1600)
+        print("Setting manual exposure -- time:", exp_time, "  iso:", sens_iso)
+        ctrl = dai.CameraControl()
+        ctrl.setManualExposure(exp_time, sens_iso)
+        self.send_control(ctrl)
+
+    def send_control(self, ctrl):
+        self.controlQueue.send(ctrl)
+
+    def set_roi(self, rect=None):
+        ''' crop the preview to the normalized (xmin, ymin, xmax, ymax) `rect`, None for the full frame
+
+        pairs captured before the crop takes effect are skipped by get()
+        '''
+        if not self.roi:
+            raise ValueError("set_roi() needs a session opened with roi=True")
+        cfg = dai.ImageManipConfig()
+        cfg.setCropRect(*(rect or (0, 0, 1, 1)))
+        self.roiQueue.send(cfg)
+        self.roi_rect = rect
+        if rect is None:
+            self.roi_offset = (0, 0)
+        else:
+            width, height = qr_pipeline.FRAME_SIZE
+            self.roi_offset = (round(rect[0] * width), round(rect[1] * height))
+        self.skip_before(self.clock() + ROI_SETTLE)
+
+    def skip_before(self, t):
+        ''' get() only returns pairs captured at or after `t` (self.clock() time) '''
+        self._since = t if self._since is None else max(self._since, t)
+
+    def get(self):
+        ''' blocking read of the next (frame, detections) pair
+
+        in crop_mode frame is None and the GRAY8 crops are left in self.crops
+        '''
+        while True:
+            if self.crop_mode:
+                detections, self.crops = self.get_crops()
+                frame = None
+            else:
+                frame, detections, self.latency_ms = self.sync.get_synced()
+                self.timestamp = self.sync.timestamp
+            # still in flight when the ROI changed or the belt stopped
+            if self._since is None or self.timestamp >= self._since:
+                break
+        if not self.crop_mode:
+            METRICS.observe("capture_to_loop", self.latency_ms / 1000)
+        if self.recorder is not None:
+            self.recorder.add_frame(frame, detections, self.timestamp)
+        return frame, detections
+
+    def get_crops(self):
+        ''' blocking read of the next detections and their on-device GRAY8 crops
+
+        crops[i] belongs to detections[i], or is None if the device dropped it
+        '''
+        inDet = self.qDet.get()
+        self.timestamp = inDet.getTimestamp().total_seconds()
+        METRICS.observe("xlink_nn", self.clock() - self.timestamp)
+        seq = inDet.getSequenceNum()
+        crops = []
+        while len(crops) < len(inDet.detections):
+            crop = self._next_crop or self.qCrop.get()
+            self._next_crop = None
+            if crop.getSequenceNum() < seq:
+                # left over from a detection message we never read
+                continue
+            if crop.getSequenceNum() > seq:
+                # the rest of this frame's crops were dropped, keep it for the next call
+                self._next_crop = crop
+                crops += [None] * (len(inDet.detections) - len(crops))
+                break
+            crops.append(crop.getFrame())
+        return inDet.detections, crops
+
+    def clock(self):
+        ''' host time on the same clock as the message timestamps
+
+        a replayed device is read ahead by the FrameSync threads, its clock is
+        the capture time of the last pair handed to the loop instead
+        '''
+        if not self._owns_device and self.timestamp is not None:
+            return self.timestamp
+        return self._host_clock()
+
+    def _host_clock(self):
+        # the FrameSync readers measure transport latency on this one
+        if hasattr(self.device, 'clock'):
+            return self.device.clock()
+        return dai.Clock.now().total_seconds()
+
+    def flush(self):
+        ''' discard frames queued while the belt was still moving '''
+        if self.sync is not None:
+            self.sync.flush()
+        else:
+            self.qDet.tryGetAll()
+            self.qCrop.tryGetAll()
+        self._next_crop = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
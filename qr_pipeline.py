@@ -0,0 +1,409 @@
+import time
+import cv2
+import depthai as dai
+import numpy as np
+from qr_tracker import QRTracker
+from blob_cache import get_blob, QR_MODEL
+from metrics import METRICS
+from adaptive import AdaptiveTuner
+import threading
+from decoders import DecoderChain, DecodeExecutor
+
+FRAME_SIZE = (1440,1080)
+FOCUS_VALUE = 175 # 0-255, 0>inf, 150>30cm, 200>10cm, 255>8cm
+FPS = 30
+
+DETECTION_THRESHOLD = 0.9 # minimum confidence threshold for detection
+
+ADAPTIVE_TUNING = False # adapt threshold and bbox expansion from decode results, see adaptive.py
+DETECTION_THRESHOLD_FLOOR = 0.5 # device threshold with ADAPTIVE_TUNING, the host filters above it
+
+USE_EXP_LIMIT_TUNING = False # use exposure limit tuning, will disable manual exposure
+EXP_LIMIT = 8300 # exposure limit in us, either 8300 (default) or 500
+
+MANUAL_EXPOSURE = True # set manual exposure
+EXP_TIME = 1000 # sensor exposure time, range 1 to 33000
+SENS_ISO = 1600 # sesnor sensitivity, range 100 to 1600
+
+BLUR = False # apply blur to image before decoding
+BLUR_KERNEL = (7,7) # blur kernel size (width, height)
+
+BBOX_EXPANSION_PERCENT = 200 # expand bounding box by percent before decoding
+
+ROI_SCALE = 0.5 # smallest finetune ROI as a share of the frame side, see roi_rect()
+ROI_MARGIN = 120 # px kept around the boxes the ROI has to cover
+
+
+class TextHelper:
+    def __init__(self) -> None:
+        self.bg_color = (0, 0, 0)
+        self.color = (255, 255, 255)
+        self.text_type = cv2.FONT_HERSHEY_SIMPLEX
+        self.line_type = cv2.LINE_AA
+    def putText(self, frame, text, coords):
+        cv2.putText(frame, text, coords, self.text_type, 0.8, self.bg_color, 3, self.line_type)
+        cv2.putText(frame, text, coords, self.text_type, 0.8, self.color, 1, self.line_type)
+    def rectangle(self, frame, p1, p2):
+        cv2.rectangle(frame, p1, p2, self.bg_color, 6)
+        cv2.rectangle(frame, p1, p2, self.color, 1)
+
+
+def clamp(num, v0, v1):
+    return max(v0, min(num, v1))
+
+
+def expandBBox(bbox, percent=BBOX_EXPANSION_PERCENT):
+    ''' normalized (xmin, ymin, xmax, ymax) expanded by percent '''
+    xmin, ymin, xmax, ymax = bbox
+    percent /= 200
+    w = xmax - xmin
+    h = ymax - ymin
+    return (max(0, xmin - w * percent), max(0, ymin - h * percent),
+            min(1, xmax + w * percent), min(1, ymax + h * percent))
+
+
+def expandDetection(det, percent=BBOX_EXPANSION_PERCENT):
+    ''' expand bounding box by percent '''
+    det.xmin, det.ymin, det.xmax, det.ymax = expandBBox((det.xmin, det.ymin, det.xmax, det.ymax), percent)
+
+
+def frameNorm(frame, bbox):
+    ''' de-normalize bounding box coordinates '''
+    # crop mode sessions don't send the frame, only its detections
+    height, width = frame.shape[:2] if frame is not None else (FRAME_SIZE[1], FRAME_SIZE[0])
+    normVals = np.full(len(bbox), height)
+    normVals[::2] = width
+    return (np.clip(np.array(bbox), 0, 1) * normVals).astype(int)
+
+
+def roi_rect(boxes, scale=ROI_SCALE, margin=ROI_MARGIN):
+    ''' normalized preview crop covering the full frame px `boxes` plus `margin`
+
+    at least `scale` of the frame and always in the frame's aspect ratio, so
+    the 384x384 network sees the codes undistorted, only larger
+    '''
+    width, height = FRAME_SIZE
+    xmin = min(b[0] for b in boxes) - margin
+    ymin = min(b[1] for b in boxes) - margin
+    xmax = max(b[2] for b in boxes) + margin
+    ymax = max(b[3] for b in boxes) + margin
+    w = min(width, max(xmax - xmin, (ymax - ymin) * width / height, width * scale))
+    h = w * height / width
+    x0 = clamp((xmin + xmax - w) / 2, 0, width - w)
+    y0 = clamp((ymin + ymax - h) / 2, 0, height - h)
+    # whole even pixels, so the offset fed back is exactly where the crop starts
+    x0, y0, w, h = (int(v) // 2 * 2 for v in (x0, y0, w, h))
+    return (x0 / width, y0 / height, (x0 + w) / width, (y0 + h) / height)
+
+
+def scan(img, scanner, blur=BLUR):
+    ''' decode a grayscale crop, None if there is nothing readable '''
+    if img is None:
+        # crop dropped on the device
+        return None
+
+    if blur:
+        # remove high frequency noise
+        img = cv2.GaussianBlur(img, BLUR_KERNEL, 0)
+
+    # decode QR code
+    results = scanner.scan(img)
+
+    if results:
+        # decoding successful
+        return results[0].data.decode('utf-8')
+
+    else:
+        # decoding failed
+        return None
+
+
+def crop_gray(frame, bbox):
+    # crop frame to bbox area
+    img = frame[bbox[1]:bbox[3], bbox[0]:bbox[2]]
+
+    # zbar requires grayscale images
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+
+def decode(frame, bbox, scanner, blur=BLUR):
+    return scan(crop_gray(frame, bbox), scanner, blur)
+
+
+# Runs on the OAK: pairs each detection message with its preview frame by
+# sequence number and asks the crop ImageManip for one GRAY8 crop of every
+# expanded bbox, so the host never receives or converts the full frame.
+CROP_SCRIPT = """
+frames = dict()
+while True:
+    dets = node.io['dets'].get()
+    seq = dets.getSequenceNum()
+    for f in node.io['frames'].tryGetAll():
+        frames[f.getSequenceNum()] = f
+    frame = frames.pop(seq, None)
+    for s in [s for s in frames if s < seq]:
+        del frames[s]
+    if frame is None:
+        continue
+    for det in dets.detections:
+        w = (det.xmax - det.xmin) * EXPAND
+        h = (det.ymax - det.ymin) * EXPAND
+        cfg = ImageManipConfig()
+        cfg.setCropRect(max(0, det.xmin - w), max(0, det.ymin - h), min(1, det.xmax + w), min(1, det.ymax + h))
+        cfg.setFrameType(ImgFrame.Type.GRAY8)
+        node.io['manip_cfg'].send(cfg)
+        node.io['manip_img'].send(frame)
+"""
+
+
+def create_pipeline(crop_mode=False, encoded=False, roi=False):
+    ''' camera -> 384x384 GRAY8 -> QR detection network, plus camera control input
+
+    With crop_mode the full preview stays on the device: a Script node crops
+    every detection to GRAY8 and only the crops ("crops") and detections
+    ("nn") go over XLink, there is no "camera" stream.
+    With encoded the camera video is also H.265 encoded on the device and
+    sent as "h265", for the event ring buffer (see ring_buffer.py).
+    With roi the preview passes an ImageManip that crops it to the rect of
+    the last ImageManipConfig sent to "roi_cfg" (OakSession.set_roi()); the
+    network and the "camera" stream then only see that region.
+    '''
+    pipeline = dai.Pipeline()
+    if USE_EXP_LIMIT_TUNING:
+        if EXP_LIMIT == 500:
+            pipeline.setCameraTuningBlobPath('./tuning_exp_limit_500us.bin')
+        else:
+            pipeline.setCameraTuningBlobPath('./tuning_exp_limit_8300us.bin')
+
+    # Define camera node
+    cam = pipeline.create(dai.node.ColorCamera)
+    cam.setResolution(dai.ColorCameraProperties.SensorResolution.THE_1080_P)
+    cam.setPreviewSize(FRAME_SIZE)
+    cam.setInterleaved(False)
+    cam.initialControl.setManualFocus(FOCUS_VALUE)
+    cam.setFps(FPS)
+
+    # Define image preprocessor node
+    # --> dection model requires 384x384, grayscale input image
+    proc = pipeline.create(dai.node.ImageManip)
+    proc.initialConfig.setResize(384,384)
+    proc.initialConfig.setFrameType(dai.ImgFrame.Type.GRAY8)
+    proc.initialConfig.setKeepAspectRatio(False)
+
+    # Define QR detection model
+    nn = pipeline.create(dai.node.MobileNetDetectionNetwork)
+    # with adaptive tuning the host decides, the device only drops clear misses
+    nn.setConfidenceThreshold(DETECTION_THRESHOLD_FLOOR if ADAPTIVE_TUNING else DETECTION_THRESHOLD)
+    # pinned local copy, no blobconverter/network round trip once the cache is warm
+    nn.setBlobPath(get_blob(QR_MODEL, zoo_type="depthai", shaves=6))
+    nn.input.setQueueSize(1)
+    nn.input.setBlocking(False)
+
+    # Define input nodes
+    controlIn = pipeline.create(dai.node.XLinkIn)
+    controlIn.setStreamName("control")
+
+    # Define output nodes
+    nnOut = pipeline.create(dai.node.XLinkOut)
+    nnOut.setStreamName("nn")
+
+    preview = cam.preview
+    if roi:
+        # full frame until the host sends a crop, the last one stays in effect
+        roiManip = pipeline.create(dai.node.ImageManip)
+        roiManip.setMaxOutputFrameSize(FRAME_SIZE[0] * FRAME_SIZE[1] * 3)
+        roiManip.inputConfig.setWaitForMessage(False)
+        roiManip.inputImage.setQueueSize(1)
+        roiManip.inputImage.setBlocking(False)
+        roiIn = pipeline.create(dai.node.XLinkIn)
+        roiIn.setStreamName("roi_cfg")
+        roiIn.out.link(roiManip.inputConfig)
+        cam.preview.link(roiManip.inputImage)
+        preview = roiManip.out
+
+    # Link the nodes
+    preview.link(proc.inputImage)
+    proc.out.link(nn.input)
+    nn.out.link(nnOut.input)
+    controlIn.out.link(cam.inputControl)
+
+    if encoded:
+        videoEnc = pipeline.create(dai.node.VideoEncoder)
+        videoEnc.setDefaultProfilePreset(FPS, dai.VideoEncoderProperties.Profile.H265_MAIN)
+        # a keyframe every second, an event clip starts at most 1 s early
+        videoEnc.setKeyframeFrequency(FPS)
+        encOut = pipeline.create(dai.node.XLinkOut)
+        encOut.setStreamName("h265")
+        cam.video.link(videoEnc.input)
+        videoEnc.bitstream.link(encOut.input)
+
+    if not crop_mode:
+        camOut = pipeline.create(dai.node.XLinkOut)
+        camOut.setStreamName("camera")
+        preview.link(camOut.input)
+        return pipeline
+
+    # Define on-device crop nodes
+    script = pipeline.create(dai.node.Script)
+    script.setScript(CROP_SCRIPT.replace("EXPAND", str(BBOX_EXPANSION_PERCENT / 200)))
+    script.inputs['frames'].setBlocking(False)
+    script.inputs['frames'].setQueueSize(4)
+    preview.link(script.inputs['frames'])
+    nn.out.link(script.inputs['dets'])
+
+    crop = pipeline.create(dai.node.ImageManip)
+    crop.inputConfig.setWaitForMessage(True)
+    crop.setMaxOutputFrameSize(FRAME_SIZE[0] * FRAME_SIZE[1])
+    script.outputs['manip_cfg'].link(crop.inputConfig)
+    script.outputs['manip_img'].link(crop.inputImage)
+
+    cropOut = pipeline.create(dai.node.XLinkOut)
+    cropOut.setStreamName("crops")
+    crop.out.link(cropOut.input)
+
+    return pipeline
+
+
+class QRResult:
+    def __init__(self, text, bbox, confidence):
+        self.text = text
+        self.bbox = bbox # expanded bbox in full frame pixels
+        self.confidence = confidence
+
+    def __repr__(self):
+        return f"QRResult({self.text!r}, bbox={list(self.bbox)}, confidence={self.confidence:.2f})"
+
+
+def _timed_decode(decode_fn, bbox):
+    with METRICS.time("decode"):
+        return decode_fn(bbox)
+
+
+class QRDecoder:
+    ''' Detections of one frame -> expanded pixel bboxes -> decoded text.
+
+    Shared by every move/align/finetune loop. Owns the QRTracker decode
+    cache and works on full frames as well as on the crops of a crop_mode
+    session.
+
+    With a `tuner` (adaptive.AdaptiveTuner, on by default with ADAPTIVE_TUNING)
+    the host threshold and the expansion come from the tuner and every zbar
+    decode is reported back to it. A decode that fails at a reduced expansion
+    is retried at `expansion_percent`. Crop mode crops on the device, there
+    only the threshold adapts.
+
+    Crops go through a DecoderChain (zbar, contrast fixes, OpenCV, upscaled)
+    that orders itself by cost per decoded code and stops at a per-frame
+    time budget. The crops of one frame are decoded in parallel by a
+    DecodeExecutor (`executor`, DECODE_WORKERS threads by default).
+    '''
+    def __init__(self, expansion_percent=None, blur=BLUR, tuner=None, executor=None):
+        # looked up here, not at import, so a station profile applies
+        self.expansion_percent = expansion_percent if expansion_percent is not None else BBOX_EXPANSION_PERCENT
+        self.blur = blur
+        self.chain = DecoderChain.default()
+        self.executor = executor if executor is not None else DecodeExecutor()
+        self.tracker = QRTracker()
+        if tuner is None and ADAPTIVE_TUNING:
+            tuner = AdaptiveTuner(self.expansion_percent, DETECTION_THRESHOLD, DETECTION_THRESHOLD_FLOOR)
+        self.tuner = tuner
+        # decode threads report to the tuner concurrently
+        self._tuner_lock = threading.Lock()
+
+    def process(self, frame, detections, crops=None, offset=None):
+        ''' results for one frame, bboxes shifted by `offset` (px) when the frame is a ROI '''
+        with METRICS.time("process"):
+            results = self._process(frame, detections, crops)
+        if offset is not None and any(offset):
+            shift = np.array([offset[0], offset[1], offset[0], offset[1]])
+            for r in results:
+                r.bbox = r.bbox + shift
+        return results
+
+    def _scan(self, img):
+        if img is not None and self.blur:
+            # remove high frequency noise
+            img = cv2.GaussianBlur(img, BLUR_KERNEL, 0)
+        return self.chain(img)
+
+    def _process(self, frame, detections, crops):
+        self.chain.start_frame()
+        tuner = self.tuner
+        if tuner is not None:
+            keep = [i for i, det in enumerate(detections) if tuner.accept(det.confidence)]
+            detections = [detections[i] for i in keep]
+            if crops is not None:
+                crops = [crops[i] for i in keep]
+        # crops made on the device always use the full expansion
+        expansion = self.expansion_percent if tuner is None or frame is None else tuner.expansion
+
+        bboxes = []
+        originals = []
+        for det in detections:
+            originals.append((det.xmin, det.ymin, det.xmax, det.ymax))
+            # expand and denormalize bbox
+            expandDetection(det, expansion)
+            bboxes.append(frameNorm(frame, (det.xmin, det.ymin, det.xmax, det.ymax)))
+
+        # decode QR images, skipping boxes whose text is already known
+        if frame is None:
+            # crop mode: decode the GRAY8 crops made on the device
+            crops = crops if crops is not None else [None] * len(bboxes)
+            by_bbox = {tuple(b): crop for b, crop in zip(bboxes, crops)}
+            decode_fn = lambda bbox: self._scan(by_bbox[tuple(bbox)])
+        else:
+            decode_fn = lambda bbox: self._scan(crop_gray(frame, bbox))
+        if tuner is not None:
+            sources = {tuple(b): (det.confidence, o) for b, det, o in zip(bboxes, detections, originals)}
+            decode_fn = self._tuned(decode_fn, frame, expansion, sources)
+        texts = self.tracker.decode_all(bboxes, lambda bbox: _timed_decode(decode_fn, bbox), self.executor)
+
+        if expansion != self.expansion_percent:
+            # report positions at the configured expansion, the alignment window is tuned to it
+            bboxes = [frameNorm(frame, expandBBox(o, self.expansion_percent)) for o in originals]
+        return [QRResult(text, bbox, det.confidence) for det, bbox, text in zip(detections, bboxes, texts)]
+
+    def _tuned(self, decode_fn, frame, expansion, sources):
+        ''' decode_fn that reports to the tuner and retries a reduced expansion at the full one '''
+        def tuned(bbox):
+            confidence, original = sources[tuple(bbox)]
+            start = time.perf_counter()
+            text = decode_fn(bbox)
+            with self._tuner_lock:
+                self.tuner.record(expansion, confidence, bbox, text is not None, time.perf_counter() - start)
+            if text is None and expansion < self.expansion_percent:
+                full = frameNorm(frame, expandBBox(original, self.expansion_percent))
+                start = time.perf_counter()
+                text = decode_fn(full)
+                with self._tuner_lock:
+                    self.tuner.record(self.expansion_percent, confidence, full, text is not None, time.perf_counter() - start)
+            return text
+        return tuned
+
+def annotate(frame, results, offset=None, scale=1, helper=None):
+    ''' add bbox, confidence, and decoded text to image
+
+    bboxes are full frame px; `offset` is the ROI corner of a cropped frame,
+    `scale` the factor a downscaled frame was resized by
+    '''
+    if frame is None:
+        return
+    c = helper if helper is not None else TextHelper()
+    for r in results:
+        bbox = r.bbox
+        if offset is not None:
+            # full frame bbox drawn on the ROI
+            bbox = bbox - np.array([offset[0], offset[1], offset[0], offset[1]])
+        if scale != 1:
+            bbox = (np.asarray(bbox) * scale).astype(int)
+        c.rectangle(frame, (bbox[0], bbox[1]), (bbox[2], bbox[3]))
+        c.putText(frame, f"{int(r.confidence * 100)}%", (bbox[0] + 10, bbox[1] + 30))
+        c.putText(frame, r.text or "", (bbox[0] + 10, bbox[1] + 60))
+
+
+def find(results, text):
+    ''' first result that decoded to `text` '''
+    for r in results:
+        if r.text == text:
+            return r
+    return None
@@ -0,0 +1,116 @@
+import itertools
+
+
+def iou(a, b):
+    ''' intersection over union of two (xmin, ymin, xmax, ymax) boxes '''
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def centroid_distance(a, b):
+    dx = (a[0] + a[2]) / 2 - (b[0] + b[2]) / 2
+    dy = (a[1] + a[3]) / 2 - (b[1] + b[3]) / 2
+    return (dx * dx + dy * dy) ** 0.5
+
+
+class Track:
+    def __init__(self, track_id, bbox):
+        self.id = track_id
+        self.bbox = tuple(bbox)
+        self.text = None
+        self.decoded_bbox = None # bbox the cached text was decoded from
+        self.missed = 0 # frames since last matched
+        self.failed = 0 # consecutive failed decodes
+
+
+class QRTracker:
+    ''' Assigns track ids to QR detections across frames and caches decoded text.
+
+    Detections are matched to existing tracks greedily by IoU, falling back to
+    centroid distance for fast moving boxes. A track is only decoded again
+    when it is new, its last decode failed, or its box drifted from the one the
+    text came from (IoU below `redecode_iou`), so a STOP marker or panel code
+    sitting in view costs one zbar scan instead of one per frame.
+    '''
+    def __init__(self, match_iou=0.3, max_centroid_px=120, redecode_iou=0.6, max_missed=5):
+        self.match_iou = match_iou
+        self.max_centroid_px = max_centroid_px
+        self.redecode_iou = redecode_iou
+        self.max_missed = max_missed
+        self.tracks = []
+        self._ids = itertools.count()
+        self.decodes = 0
+        self.cache_hits = 0
+
+    def reset(self):
+        self.tracks = []
+
+    def update(self, bboxes):
+        ''' match this frame's boxes to tracks, returns one Track per box (same order) '''
+        bboxes = [tuple(int(v) for v in b) for b in bboxes]
+        pairs = []
+        for i, b in enumerate(bboxes):
+            for t in self.tracks:
+                overlap = iou(b, t.bbox)
+                if overlap >= self.match_iou:
+                    pairs.append((overlap, 0, i, t))
+                else:
+                    dist = centroid_distance(b, t.bbox)
+                    if dist <= self.max_centroid_px:
+                        # ranked after every IoU match, closer first
+                        pairs.append((-dist, 1, i, t))
+        pairs.sort(key=lambda p: (p[1], -p[0]))
+
+        assigned = [None] * len(bboxes)
+        used = set()
+        for _, _, i, t in pairs:
+            if assigned[i] is None and t.id not in used:
+                assigned[i] = t
+                used.add(t.id)
+
+        for i, b in enumerate(bboxes):
+            if assigned[i] is None:
+                assigned[i] = Track(next(self._ids), b)
+                self.tracks.append(assigned[i])
+            assigned[i].bbox = b
+            assigned[i].missed = 0
+
+        for t in self.tracks:
+            if t.id not in used and t not in assigned:
+                t.missed += 1
+        self.tracks = [t for t in self.tracks if t.missed <= self.max_missed]
+        return assigned
+
+    def needs_decode(self, track):
+        if track.text is None or track.decoded_bbox is None:
+            return True
+        return iou(track.bbox, track.decoded_bbox) < self.redecode_iou
+
+    def decode_all(self, bboxes, decode_fn, executor=None):
+        ''' text for every box, calling decode_fn(bbox) only where the cache can't answer
+
+        with an executor (decoders.DecodeExecutor) the misses are decoded together
+        '''
+        tracks = self.update(bboxes)
+        misses = [t for t in tracks if self.needs_decode(t)]
+        self.cache_hits += len(tracks) - len(misses)
+        if executor is not None:
+            results = executor.map(decode_fn, [t.bbox for t in misses])
+        else:
+            results = [decode_fn(t.bbox) for t in misses]
+
+        for track, text in zip(misses, results):
+            self.decodes += 1
+            if text is not None:
+                track.text = text
+                track.decoded_bbox = track.bbox
+                track.failed = 0
+            else:
+                track.failed += 1
+                # keep an older good read unless the code keeps failing
+                if track.failed > self.max_missed:
+                    track.text = None
+        return [t.text for t in tracks]
@@ -0,0 +1,117 @@
+import time
+import random
+
+import depthai as dai
+from metrics import METRICS
+
+BASE_DELAY = 0.5 # s before the first retry, doubled after every failure
+MAX_DELAY = 30 # s, cap of the backoff
+JITTER = 0.25 # +/- share of the delay, cameras that dropped together don't retry in lockstep
+
+OK = "ok"
+MISSING = "missing" # not on the network / USB: link, switch or PoE power
+BUSY = "busy" # booted, the old connection still holds it until its watchdog fires
+
+
+def probe(mxid):
+    ''' (status, DeviceInfo or None) of `mxid` without opening it '''
+    found, info = dai.Device.getDeviceByMxId(mxid)
+    if not found:
+        return MISSING, None
+    if info.state == dai.XLinkDeviceState.X_LINK_BOOTED:
+        return BUSY, info
+    return OK, info
+
+
+class ReconnectSupervisor:
+    ''' Opens a device with exponential backoff, probing it before each attempt.
+
+    connect(open_fn) calls open_fn() (e.g. `lambda: dai.Device(pipeline, info)`)
+    once the probe sees the device in a state it can be opened from, and
+    retries after BASE_DELAY, doubled on every further failure (capped at
+    MAX_DELAY, +/- JITTER), on a failed probe or a RuntimeError. The pipeline and its blob belong to
+    the caller and are reused on every attempt. Without an mxid there is
+    nothing to probe and only the backoff applies.
+
+    Callers report a dropped link with lost(); the time from there (or from
+    the first failed attempt) to the next successful connect is one outage,
+    counted in `reconnects`, summed in `downtime` and observed as the
+    "reconnect" stage in METRICS.
+    '''
+    def __init__(self, mxid=None, name="oak", base_delay=BASE_DELAY, max_delay=MAX_DELAY, jitter=JITTER,
+                 max_retries=None, probe=probe, sleep=time.sleep, clock=time.monotonic, seed=None):
+        self.mxid = mxid
+        self.name = name
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.max_retries = max_retries
+        self.probe = probe
+        self.sleep = sleep
+        self.clock = clock
+        self.attempts = 0 # open_fn() calls
+        self.failures = 0 # failed probes and attempts
+        self.connects = 0
+        self.reconnects = 0
+        self.downtime = 0.0 # s, summed over all outages
+        self.last_downtime = None
+        self._down_since = None
+        self._random = random.Random(seed)
+
+    def delay(self, failures):
+        ''' backoff before retry number `failures` (1 for the first retry) '''
+        delay = min(self.max_delay, self.base_delay * 2 ** max(0, failures - 1))
+        return delay * (1 + self._random.uniform(-self.jitter, self.jitter))
+
+    def check(self):
+        ''' probe status, OK without an mxid or probe '''
+        if self.mxid is None or self.probe is None:
+            return OK
+        try:
+            return self.probe(self.mxid)[0]
+        except RuntimeError as e:
+            return f"probe failed ({e})"
+
+    def lost(self):
+        ''' the link went down now '''
+        if self._down_since is None:
+            self._down_since = self.clock()
+
+    def recovered(self):
+        ''' a connection is up (again), closes the outage started by lost() '''
+        self.connects += 1
+        if self._down_since is not None:
+            self.reconnects += 1
+            self.last_downtime = self.clock() - self._down_since
+            self.downtime += self.last_downtime
+            self._down_since = None
+            METRICS.observe("reconnect", self.last_downtime)
+            print(f"[{self.name}] Reconnected after {self.last_downtime:.1f} s")
+
+    def connect(self, open_fn):
+        ''' open_fn()'s result once it succeeds, RuntimeError after max_retries failures '''
+        failures = 0
+        while True:
+            status = self.check()
+            if status == OK:
+                self.attempts += 1
+                try:
+                    result = open_fn()
+                except RuntimeError as e:
+                    status = f"error: {e}"
+                else:
+                    self.recovered()
+                    return result
+
+            failures += 1
+            self.failures += 1
+            self.lost()
+            if self.max_retries is not None and failures > self.max_retries:
+                raise RuntimeError(f"[{self.name}] No connection after {failures} attempts, last: {status}")
+            delay = self.delay(failures)
+            print(f"[{self.name}] Device {status}, retrying in {delay:.1f} s")
+            self.sleep(delay)
+
+    def stats(self):
+        return {"connects": self.connects, "reconnects": self.reconnects, "attempts": self.attempts,
+                "failures": self.failures, "downtime": self.downtime, "last_downtime": self.last_downtime}
@@ -1,4 +1,5 @@
 import depthai as dai
+from mp4_recorder import record_stream
 import time
 import datetime
 from pathlib import Path
@@ -37,22 +38,10 @@ def record_oak_s2(mxid=dipro_s2_mxid, duration_seconds=5, output_dir='image_eval
 
         # Create a unique timestamp for the filename
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f'{output_dir}/video_{timestamp}.h265'
+        filename = f'{output_dir}/video_{timestamp}'
 
-        # The .h265 file is a raw stream file (not playable yet)
-        with open(filename, 'wb') as videoFile:
-            print(f"Recording for {duration_seconds} seconds.")
-            start_time = time.time()
-
-            try:
-                while time.time() - start_time < duration_seconds:
-                    h265Packet = q.get()  # Blocking call, waits for new data
-                    h265Packet.getData().tofile(videoFile)  # Appends the packet data to the file
-            except KeyboardInterrupt:
-                # Keyboard interrupt (Ctrl + C) detected
-                pass
-
-        print(f"Recording complete. Video saved as {filename}.")
+        # muxed into (fragmented) MP4 while streaming, PTS from the device timestamps
+        record_stream(q, duration_seconds, filename, camRgb.getVideoSize())
 
 # Function to record video at intervals
 def record_oak_interval(interval_seconds=10, duration_seconds=5, total_duration_seconds=86400, mxid=dipro_s2_mxid, output_dir='image_eval_data'):
@@ -97,21 +86,9 @@ def record_oak_sr(mxid, duration_seconds=5, output_dir='image_eval_data'):
         Path(output_dir).mkdir(parents=True, exist_ok=True)
 
         # Create the filename using time in seconds as milliseconds for uniqueness
-        filename = f"{output_dir}/{int(time.time() * 1000)}.h265"
-
-        # The .h265 file is a raw stream file (not playable yet)
-        with open(filename, 'wb') as videoFile:
-            print(f"Recording for {duration_seconds} seconds.")
-            start_time = time.time()
-
-            try:
-                while time.time() - start_time < duration_seconds:
-                    h265Packet = q.get()  # Blocking call, will wait until new data has arrived
-                    h265Packet.getData().tofile(videoFile)  # Appends the packet data to the opened file
-            except KeyboardInterrupt:
-                # Keyboard interrupt (Ctrl + C) detected
-                pass
-
-        print(f"Recording complete. Video saved as {filename}. ")
+        filename = f"{output_dir}/{int(time.time() * 1000)}"
+
+        # muxed into (fragmented) MP4 while streaming, PTS from the device timestamps
+        record_stream(q, duration_seconds, filename, camRgb.getVideoSize())
 
 record_oak_sr(mxid=dipro_sr)
@@ -1,4 +1,5 @@
 import depthai as dai
+from mp4_recorder import record_stream
 import time
 import argparse
 from pathlib import Path
@@ -38,22 +39,10 @@ def record_oak_s2(mxid, duration_seconds=5, output_dir='image_eval_data'):
 
         # Create a unique timestamp for the filename using time.time()
         timestamp = int(time.time())  # Get seconds since epoch as an integer
-        filename = f'{output_dir}/video_{timestamp}.h265'
+        filename = f'{output_dir}/video_{timestamp}'
 
-        # The .h265 file is a raw stream file (not playable yet)
-        with open(filename, 'wb') as videoFile:
-            print(f"Recording for {duration_seconds} seconds.")
-            start_time = time.time()
-
-            try:
-                while time.time() - start_time < duration_seconds:
-                    h265Packet = q.get()  # Blocking call, waits for new data
-                    h265Packet.getData().tofile(videoFile)  # Appends the packet data to the file
-            except KeyboardInterrupt:
-                # Keyboard interrupt (Ctrl + C) detected
-                pass
-
-        print(f"Recording complete. Video saved as {filename}.")
+        # muxed into (fragmented) MP4 while streaming, PTS from the device timestamps
+        record_stream(q, duration_seconds, filename, camRgb.getVideoSize())
 
 # Function to record video from the OAK-SR
 def record_oak_sr(mxid, duration_seconds=5, output_dir='image_eval_data'):
@@ -86,22 +75,10 @@ def record_oak_sr(mxid, duration_seconds=5, output_dir='image_eval_data'):
 
         # Create a unique timestamp for the filename using time.time()
         timestamp = int(time.time())  # Get seconds since epoch as an integer
-        filename = f'{output_dir}/video_{timestamp}.h265'
-
-        # The .h265 file is a raw stream file (not playable yet)
-        with open(filename, 'wb') as videoFile:
-            print(f"Recording for {duration_seconds} seconds.")
-            start_time = time.time()
-
-            try:
-                while time.time() - start_time < duration_seconds:
-                    h265Packet = q.get()  # Blocking call, waits for new data
-                    h265Packet.getData().tofile(videoFile)  # Appends the packet data to the file
-            except KeyboardInterrupt:
-                # Keyboard interrupt (Ctrl + C) detected
-                pass
-
-        print(f"Recording complete. Video saved as {filename}.")
+        filename = f'{output_dir}/video_{timestamp}'
+
+        # muxed into (fragmented) MP4 while streaming, PTS from the device timestamps
+        record_stream(q, duration_seconds, filename, camRgb.getVideoSize())
 
 # Main function to parse arguments and run the appropriate recording function
 if __name__ == "__main__":
@@ -1,7 +1,11 @@
 
 import depthai as dai
+from mp4_recorder import record_stream, Mp4Recorder, is_keyframe
+from reconnect import ReconnectSupervisor
+from device_config import DeviceSettings
 import time
 import datetime
+from pathlib import Path
 
 def record_oak(duration_seconds=5):
     # Create pipeline
@@ -34,37 +38,131 @@ def record_oak(duration_seconds=5):
 
         # Create a unique timestamp for the filename
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f'video_{timestamp}.h265'
+        filename = f'video_{timestamp}'
 
-        # The .h265 file is a raw stream file (not playable yet)
-        with open(filename, 'wb') as videoFile:
-            print(f"Recording for {duration_seconds} seconds.")
-            start_time = time.time()
-
-            try:
-                while time.time() - start_time < duration_seconds:
-                    h265Packet = q.get()  # Blocking call, will wait until new data has arrived
-                    h265Packet.getData().tofile(videoFile)  # Appends the packet data to the opened file
-            except KeyboardInterrupt:
-                # Keyboard interrupt (Ctrl + C) detected
-                pass
-
-        print(f"Recording complete. Video saved as {filename}. ")
+        # muxed into (fragmented) MP4 while streaming, PTS from the device timestamps
+        record_stream(q, duration_seconds, filename, camRgb.getVideoSize())
 
 # Call the function with the default duration (5 seconds)
 # record_oak()
 
 
-def record_oak_interval(interval_seconds=10,duration_seconds=5,total_duration_seconds=86400):
-    start_time = time.time()
+FPS = 30
 
-    while time.time() - start_time < total_duration_seconds:
-        record_oak(duration_seconds)  # Call the record_oak function
+# Runs on the OAK between the camera and the encoder: frames only reach the
+# encoder while the host has the gate open, so between clips the device
+# neither encodes nor sends anything over XLink.
+GATE_SCRIPT = """
+recording = False
+while True:
+    gate = node.io['gate'].tryGet()
+    if gate is not None:
+        recording = gate.getData()[0] == 1
+    frame = node.io['frames'].get()
+    if recording:
+        node.io['out'].send(frame)
+"""
 
-        # Wait for the specified interval before recording again
-        time.sleep(interval_seconds)
 
-# Example: Record every 5 seconds for a total duration of 30 seconds
-record_oak_interval(interval_seconds=5, duration_seconds = 5, total_duration_seconds=30)
+def create_gated_pipeline():
+    pipeline = dai.Pipeline()
+
+    camRgb = pipeline.create(dai.node.ColorCamera)
+    script = pipeline.create(dai.node.Script)
+    videoEnc = pipeline.create(dai.node.VideoEncoder)
+    xout = pipeline.create(dai.node.XLinkOut)
+    xinGate = pipeline.create(dai.node.XLinkIn)
+
+    xout.setStreamName('h265')
+    xinGate.setStreamName('gate')
 
+    camRgb.setBoardSocket(dai.CameraBoardSocket.CAM_B)
+    camRgb.setResolution(dai.ColorCameraProperties.SensorResolution.THE_4_K)
+    camRgb.setFps(FPS)
+    videoEnc.setDefaultProfilePreset(FPS, dai.VideoEncoderProperties.Profile.H265_MAIN)
+    # a keyframe every second, clips start and end on one
+    videoEnc.setKeyframeFrequency(FPS)
+
+    script.setScript(GATE_SCRIPT)
+    script.inputs['frames'].setBlocking(False)
+    script.inputs['frames'].setQueueSize(2)
+    script.inputs['gate'].setBlocking(False)
+
+    camRgb.video.link(script.inputs['frames'])
+    xinGate.out.link(script.inputs['gate'])
+    script.outputs['out'].link(videoEnc.input)
+    videoEnc.bitstream.link(xout.input)
+    return pipeline, camRgb.getVideoSize()
+
+
+def _set_gate(gateQueue, recording):
+    buf = dai.Buffer()
+    buf.setData([1 if recording else 0])
+    gateQueue.send(buf)
+
+
+def _record_clip(q, gateQueue, duration_seconds, base, size):
+    ''' one clip from keyframe to keyframe, about `duration_seconds` of device time '''
+    # anything still queued was encoded before the last clip's gate closed
+    q.tryGetAll()
+    _set_gate(gateQueue, True)
+    try:
+        with Mp4Recorder(base, "hevc", FPS, size) as recorder:
+            start = None
+            while True:
+                packet = q.get()
+                ts = packet.getTimestamp().total_seconds()
+                key = is_keyframe(packet.getData(), "hevc")
+                if start is not None and key and ts - start >= duration_seconds:
+                    # the next clip starts on its own keyframe
+                    break
+                recorder.write(packet)
+                if start is None and recorder.frames:
+                    start = ts
+    finally:
+        _set_gate(gateQueue, False)
+    print(f"Clip saved as {', '.join(recorder.files)}.")
+    return recorder.files
+
+
+def record_oak_interval(interval_seconds=10,duration_seconds=5,total_duration_seconds=86400,output_dir='.',settings=None):
+    ''' one clip every `interval_seconds` on a single device session
+
+    the pipeline is uploaded once and stays up between clips with the
+    encoder gated off; a lost device is reopened with backoff by a
+    ReconnectSupervisor, reusing the same pipeline
+    '''
+    pipeline, size = create_gated_pipeline()
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    start_time = time.time()
+    clips = 0
+    supervisor = ReconnectSupervisor(name="sr")
+    settings = settings if settings is not None else DeviceSettings()
 
+    while time.time() - start_time < total_duration_seconds:
+        try:
+            with supervisor.connect(lambda: settings.open(pipeline)) as device:
+                q = device.getOutputQueue(name="h265", maxSize=30, blocking=True)
+                gateQueue = device.getInputQueue("gate")
+
+                while time.time() - start_time < total_duration_seconds:
+                    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+                    _record_clip(q, gateQueue, duration_seconds, f'{output_dir}/video_{timestamp}', size)
+                    clips += 1
+
+                    # Wait for the specified interval before recording again
+                    time.sleep(interval_seconds)
+        except RuntimeError as e:
+            print(f"Error: {e}")
+            print("Lost connection to camera. Reconnecting...")
+            supervisor.lost()
+        except KeyboardInterrupt:
+            break
+
+    print(f"Recorded {clips} clips in {time.time() - start_time:.0f} s, "
+          f"{supervisor.reconnects} reconnects, {supervisor.downtime:.0f} s down")
+    return clips
+
+if __name__ == "__main__":
+    # Example: Record every 5 seconds for a total duration of 30 seconds
+    record_oak_interval(interval_seconds=5, duration_seconds = 5, total_duration_seconds=30)
@@ -0,0 +1,282 @@
+import json
+import time
+import queue
+import struct
+import argparse
+import threading
+
+import cv2
+import numpy as np
+
+from fake_device import FakeDevice, FakeDetection
+from metrics import METRICS
+
+# Recording file (.oakrec): MAGIC, then records of
+#   kind (1 byte) | payload length (uint32 LE) | payload
+# header and command payloads are JSON, a frame payload is
+#   meta length (uint32 LE) | meta JSON | MJPEG bytes (empty if no frame)
+# Times are on the session clock, the same one as the frame timestamps.
+MAGIC = b"OAKREC1\n"
+HEADER, FRAME, COMMAND = 0, 1, 2
+
+_RECORD = struct.Struct("<BI")
+_META = struct.Struct("<I")
+
+JPEG_QUALITY = 90
+MAX_PENDING = 16 # full BGR frames (~4.7 MB each) waiting for the encoder before new ones are dropped
+
+
+def _det_to_list(det):
+    return [det.xmin, det.ymin, det.xmax, det.ymax, det.confidence, det.label]
+
+
+class Recorder:
+    ''' Writes frames, detections and conveyor commands of a live run to a .oakrec file.
+
+    JPEG encoding and disk writes run on a writer thread so recording does not
+    slow down the loop being recorded. When the encoder is `max_pending`
+    frames behind new frames are dropped and counted in `dropped` (their
+    sequence numbers stay unused), commands are never dropped. Pass it as OakSession(recorder=...) and
+    wrap the conveyor in RecordingConveyor to capture both sides.
+    '''
+    def __init__(self, path, clock=time.monotonic, quality=JPEG_QUALITY, max_pending=MAX_PENDING, **info):
+        self.path = path
+        self.clock = clock
+        self.quality = quality
+        self.frames = 0
+        self.commands = 0
+        self.dropped = 0
+        self._f = open(path, "wb")
+        self._f.write(MAGIC)
+        self._write(HEADER, json.dumps(dict(info, version=1, created=time.time())).encode())
+        self._queue = queue.Queue(max_pending)
+        self._thread = threading.Thread(target=self._run, name="recorder", daemon=True)
+        self._thread.start()
+
+    def _write(self, kind, payload):
+        self._f.write(_RECORD.pack(kind, len(payload)))
+        self._f.write(payload)
+
+    def add_frame(self, frame, detections, timestamp, seq=None):
+        ''' detections are normalized dai.ImgDetection-likes
+
+        crop mode runs have no frame and the crops are not recorded, a replay
+        would have nothing to decode, so they are refused
+        '''
+        if frame is None:
+            raise ValueError("Recorder needs the camera frame, crop mode sessions cannot be recorded")
+        meta = {
+            "seq": self.frames if seq is None else seq,
+            "ts": timestamp,
+            "detections": [_det_to_list(d) for d in detections],
+        }
+        self.frames += 1
+        try:
+            self._queue.put_nowait((FRAME, meta, frame))
+        except queue.Full:
+            self.dropped += 1
+
+    def add_command(self, name, args=(), t=None):
+        self.commands += 1
+        t = self.clock() if t is None else t
+        self._queue.put((COMMAND, {"t": t, "name": name, "args": list(args)}, None))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            kind, meta, frame = item
+            if kind == FRAME:
+                jpeg = b""
+                if frame is not None:
+                    ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+                    jpeg = buf.tobytes() if ok else b""
+                meta = json.dumps(meta).encode()
+                self._write(FRAME, _META.pack(len(meta)) + meta + jpeg)
+            else:
+                self._write(kind, json.dumps(meta).encode())
+
+    def close(self):
+        if self._f.closed:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._f.close()
+        print(f"Recorded {self.frames - self.dropped} frames ({self.dropped} dropped) and {self.commands} commands "
+              f"to {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class RecordingConveyor:
+    ''' Passes commands through to `conveyor` and logs them with the session clock.
+
+    Every call lands in `log` as (t, name, args); with a recorder it also goes
+    into the recording. Other attributes (latency_stats, close, ...) are the
+    wrapped conveyor's.
+    '''
+    def __init__(self, conveyor, clock, recorder=None):
+        self.conveyor = conveyor
+        self.clock = clock
+        self.recorder = recorder
+        self.log = []
+
+    def _log(self, name, *args):
+        t = self.clock()
+        self.log.append((t, name, args))
+        if self.recorder is not None:
+            self.recorder.add_command(name, args, t)
+
+    def speed(self, hz):
+        self._log("speed", hz)
+        return self.conveyor.speed(hz)
+
+    def forward(self):
+        self._log("forward")
+        return self.conveyor.forward()
+
+    def reverse(self):
+        self._log("reverse")
+        return self.conveyor.reverse()
+
+    def stop(self):
+        self._log("stop")
+        return self.conveyor.stop()
+
+    def pulse(self, direction, duration, speed=None):
+        self._log("pulse", direction, duration, speed)
+        return self.conveyor.pulse(direction, duration, speed)
+
+    def __getattr__(self, name):
+        return getattr(self.conveyor, name)
+
+
+def read_recording(path):
+    ''' yields (kind, meta, jpeg bytes or None) for every record in the file '''
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an .oakrec recording")
+        while True:
+            head = f.read(_RECORD.size)
+            if len(head) < _RECORD.size:
+                return
+            kind, size = _RECORD.unpack(head)
+            payload = f.read(size)
+            if len(payload) < size:
+                # recording cut off mid-record, e.g. the run was killed
+                return
+            if kind == FRAME:
+                (meta_size,) = _META.unpack_from(payload)
+                meta = json.loads(payload[_META.size:_META.size + meta_size])
+                yield kind, meta, payload[_META.size + meta_size:] or None
+            else:
+                yield kind, json.loads(payload), None
+
+
+class ReplayDevice(FakeDevice):
+    ''' FakeDevice that serves a .oakrec recording with its recorded timestamps.
+
+    `info` is the recording header and `recorded_commands` fills with
+    (t, name, args) as the replay reaches them. With `realtime` frames are
+    paced by their capture timestamps, otherwise served as fast as they are read.
+    '''
+    def __init__(self, path, realtime=False):
+        self.path = path
+        self.info = {}
+        self.recorded_commands = []
+        self.frames_served = 0
+        super().__init__(self._frames_from(path), realtime=realtime)
+
+    def _frames_from(self, path):
+        for kind, meta, jpeg in read_recording(path):
+            if kind == HEADER:
+                self.info = meta
+            elif kind == COMMAND:
+                self.recorded_commands.append((meta["t"], meta["name"], tuple(meta["args"])))
+            elif kind == FRAME:
+                frame = None
+                if jpeg is not None:
+                    frame = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+                detections = [FakeDetection(*d) for d in meta["detections"]]
+                self.frames_served += 1
+                yield frame, detections, meta["ts"]
+
+
+def _first(log, name):
+    for t, cmd, args in log:
+        if cmd == name:
+            return t
+    return None
+
+
+def replay_move(path, realtime=False, panel_id=None, speed=None, predictor=None):
+    ''' run conveyor_poe_4.move() on a recording against a simulated belt
+
+    returns a dict with throughput and the replayed vs recorded stop time
+    '''
+    import conveyor_poe_4
+    from oak_session import OakSession
+    from actuator import ConveyorActuator, SimulatedConveyor
+
+    device = ReplayDevice(path, realtime=realtime)
+    with OakSession(device=device) as session, ConveyorActuator(SimulatedConveyor()) as actuator:
+        conveyor = RecordingConveyor(actuator, session.clock)
+        start = time.perf_counter()
+        stop_x = None
+        try:
+            stop_x = conveyor_poe_4.move(panel_id or "11-111-111", speed or 19, 'forw', False, session, conveyor,
+                                         predictor=predictor)
+        except EOFError:
+            print("Recording ended before move() stopped the belt")
+        elapsed = time.perf_counter() - start
+
+    recorded_stop = _first(device.recorded_commands, "stop")
+    replayed_stop = _first(conveyor.log, "stop")
+    result = {
+        "frames": device.frames_served,
+        "elapsed": elapsed,
+        "fps": device.frames_served / elapsed if elapsed > 0 else 0.0,
+        "stop_x": stop_x,
+        "recorded_stop": recorded_stop,
+        "replayed_stop": replayed_stop,
+    }
+    print(f"Replayed {result['frames']} frames in {elapsed:.2f} s ({result['fps']:.1f} fps)")
+    print(f"Predicted stop x: {stop_x}")
+    print(METRICS.report())
+    if recorded_stop is not None and replayed_stop is not None:
+        print(f"Stop issued at {replayed_stop:.3f} s, recorded run at {recorded_stop:.3f} s "
+              f"({(replayed_stop - recorded_stop) * 1000:+.0f} ms)")
+    return result
+
+
+def _info(path):
+    for kind, meta, _ in read_recording(path):
+        if kind == HEADER:
+            return meta
+    return {}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a recorded move() run without camera or belt.")
+    parser.add_argument("path", help=".oakrec file written by Recorder")
+    parser.add_argument("--realtime", action="store_true", help="Pace frames by their recorded timestamps")
+    parser.add_argument("--panel", help="Panel id to look for (default: the one in the recording)")
+    parser.add_argument("--profile", action="store_true", help="Run under cProfile and print the hot spots")
+    args = parser.parse_args()
+
+    info = _info(args.path)
+    panel_id = args.panel or info.get("panel_id")
+    speed = info.get("speed")
+    if args.profile:
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.runcall(replay_move, args.path, args.realtime, panel_id, speed)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+    else:
+        replay_move(args.path, args.realtime, panel_id, speed)
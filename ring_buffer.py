@@ -0,0 +1,138 @@
+import time
+import datetime
+import threading
+from collections import deque
+from pathlib import Path
+
+from mp4_recorder import Mp4Recorder, is_keyframe
+
+PRE_SECONDS = 5
+POST_SECONDS = 5
+MAX_BYTES = 64 * 1024 * 1024 # hard cap on buffered footage, ~60 s of 1080p H.265
+
+
+class PacketRingBuffer:
+    ''' The last `seconds` of encoded packets, by device timestamp.
+
+    Holds references to the dai messages themselves (getData() is a view on
+    the message memory), nothing is copied per frame. Old packets are evicted
+    by age and, as a safety net, once the buffer holds more than `max_bytes`.
+    '''
+    def __init__(self, seconds, max_bytes=MAX_BYTES):
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self._packets = deque() # (ts, size, packet)
+        self._bytes = 0
+
+    def append(self, packet, ts):
+        size = len(packet.getData())
+        self._packets.append((ts, size, packet))
+        self._bytes += size
+        while self._packets and (ts - self._packets[0][0] > self.seconds or self._bytes > self.max_bytes):
+            self._bytes -= self._packets.popleft()[1]
+
+    def since(self, ts):
+        ''' packets from the last keyframe at or before `ts` on '''
+        packets = list(self._packets)
+        start = 0
+        for i, (t, _, packet) in enumerate(packets):
+            if t > ts:
+                break
+            if is_keyframe(packet.getData(), "hevc"):
+                start = i
+        return [p for _, _, p in packets[start:]]
+
+    def __len__(self):
+        return len(self._packets)
+
+
+class _Event:
+    def __init__(self, reason, packets, deadline):
+        self.reasons = [reason]
+        self.packets = packets
+        self.deadline = deadline
+
+
+class EventRecorder:
+    ''' Keeps an H.265 ring buffer and saves pre/post event footage on trigger().
+
+    A reader thread drains the encoded stream into a PacketRingBuffer of
+    `pre_seconds`. trigger(reason) starts an event: the buffered packets are
+    kept, the next `post_seconds` are appended, and the clip is muxed to
+    <output_dir>/<time>_<reason>.mp4 on its own thread. Triggers while an
+    event is open only add their reason, so a condition that holds for many
+    frames gives one clip. If the stream ends (device lost) open events are
+    written right away with what they have.
+    '''
+    def __init__(self, output_dir='event_clips', pre_seconds=PRE_SECONDS, post_seconds=POST_SECONDS, fps=30, size=(1920, 1080)):
+        self.output_dir = Path(output_dir)
+        self.post_seconds = post_seconds
+        self.fps = fps
+        self.size = size
+        self.buffer = PacketRingBuffer(pre_seconds + 1) # +1 s to reach back to a keyframe
+        self.pre_seconds = pre_seconds
+        self.saved = []
+        self._event = None
+        self._last_ts = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def attach(self, q):
+        ''' start draining `q` (again, after a reconnect) '''
+        self._thread = threading.Thread(target=self._reader, args=(q,), name="event-recorder", daemon=True)
+        self._thread.start()
+        return self
+
+    def _reader(self, q):
+        while True:
+            try:
+                packet = q.get()
+            except Exception:
+                # link lost or device closed, keep what the open event has
+                self._finish()
+                return
+            ts = packet.getTimestamp().total_seconds()
+            with self._lock:
+                self._last_ts = ts
+                self.buffer.append(packet, ts)
+                event = self._event
+                if event is not None:
+                    event.packets.append(packet)
+            if event is not None and ts >= event.deadline:
+                self._finish()
+
+    def trigger(self, reason):
+        with self._lock:
+            if self._event is not None:
+                if reason not in self._event.reasons:
+                    self._event.reasons.append(reason)
+                return
+            if self._last_ts is None:
+                return
+            print(f"Event {reason}, saving {self.pre_seconds} s before and {self.post_seconds} s after")
+            packets = self.buffer.since(self._last_ts - self.pre_seconds)
+            self._event = _Event(reason, packets, self._last_ts + self.post_seconds)
+
+    def _finish(self):
+        with self._lock:
+            event, self._event = self._event, None
+        if event is not None:
+            threading.Thread(target=self._save, args=(event,), name="event-writer", daemon=True).start()
+
+    def _save(self, event):
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        base = self.output_dir / f"{timestamp}_{'+'.join(event.reasons)}"
+        with Mp4Recorder(base, "hevc", self.fps, self.size) as recorder:
+            for packet in event.packets:
+                recorder.write(packet)
+        self.saved += recorder.files
+        print(f"Event clip saved as {', '.join(recorder.files)}")
+
+    def wait(self, timeout=None):
+        ''' block until an open event has its post-event footage and is written '''
+        end = None if timeout is None else time.monotonic() + timeout
+        while self._event is not None and (end is None or time.monotonic() < end):
+            time.sleep(0.1)
+        for t in threading.enumerate():
+            if t.name == "event-writer":
+                t.join(None if end is None else max(0, end - time.monotonic()))
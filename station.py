@@ -0,0 +1,391 @@
+import os
+import copy
+import time
+import argparse
+import threading
+
+# One station profile is a YAML file with the per-line tuning, any key left
+# out keeps the value below (the constants in the modules). Example:
+#   camera:
+#     exposure_us: 800
+#     iso: 1200
+#   alignment:
+#     target_min_x: 690
+#     target_max_x: 770
+#   conveyor:
+#     speed: 22
+#
+# section -> key -> (type, min, max, live). live keys take effect on a
+# running station when the file changes, the others on the next start.
+SCHEMA = {
+    "camera": {
+        "mxid": (str, None, None, False),
+        "frame_size": (list, None, None, False),
+        "fps": (int, 1, 60, False),
+        "focus": (int, 0, 255, True),
+        "manual_exposure": (bool, None, None, False),
+        "exposure_us": (int, 1, 33000, True),
+        "iso": (int, 100, 1600, True),
+    },
+    "detection": {
+        "threshold": (float, 0, 1, False),
+        "bbox_expansion_percent": (int, 0, 400, False),
+    },
+    "alignment": {
+        "target_min_x": (int, 0, None, True),
+        "target_max_x": (int, 0, None, True),
+        "far_x": (int, 0, None, False), # conveyor_poe_3.py reads it once at start
+        "speed": (int, 1, 60, True),
+        "px_per_second": (float, 1, None, True),
+        "budge_step": (float, 0.01, 5, False),
+    },
+    "conveyor": {
+        "speed": (int, 1, 60, False), # the coarse move runs at the speed it started with
+    },
+    "device": {
+        "watchdog_ms": (int, 0, None, False),
+        "watchdog_initial_delay_ms": (int, 0, None, False),
+        "xlink_chunk_size": (int, 0, None, False),
+        "bootup_timeout_ms": (int, 0, None, False),
+        "connect_timeout_ms": (int, 0, None, False),
+    },
+}
+
+
+_DEFAULTS = None
+
+
+def default_profile():
+    ''' the values the modules run with when no profile is loaded
+
+    read from the modules once, before any apply() changes them
+    '''
+    global _DEFAULTS
+    if _DEFAULTS is None:
+        _DEFAULTS = _module_values()
+    return copy.deepcopy(_DEFAULTS)
+
+
+def _module_values():
+    import qr_pipeline
+    import alignment
+    import device_config
+    from oak_session import oak_d_poe
+
+    return {
+        "camera": {
+            "mxid": oak_d_poe,
+            "frame_size": list(qr_pipeline.FRAME_SIZE),
+            "fps": qr_pipeline.FPS,
+            "focus": qr_pipeline.FOCUS_VALUE,
+            "manual_exposure": qr_pipeline.MANUAL_EXPOSURE,
+            "exposure_us": qr_pipeline.EXP_TIME,
+            "iso": qr_pipeline.SENS_ISO,
+        },
+        "detection": {
+            "threshold": qr_pipeline.DETECTION_THRESHOLD,
+            "bbox_expansion_percent": qr_pipeline.BBOX_EXPANSION_PERCENT,
+        },
+        "alignment": {
+            "target_min_x": alignment.TARGET_MIN_X,
+            "target_max_x": alignment.TARGET_MAX_X,
+            "far_x": 840,
+            "speed": alignment.ALIGN_SPEED,
+            "px_per_second": alignment.PX_PER_SECOND,
+            "budge_step": 0.25,
+        },
+        "conveyor": {
+            "speed": 19,
+        },
+        "device": device_config.DeviceSettings().as_dict(),
+    }
+
+
+def validate(values, name="profile"):
+    ''' raise ValueError on unknown keys, wrong types and out of range values '''
+    for section, keys in values.items():
+        if section not in SCHEMA:
+            raise ValueError(f"{name}: unknown section {section!r}, expected one of {sorted(SCHEMA)}")
+        if not isinstance(keys, dict):
+            raise ValueError(f"{name}: section {section} has to be a mapping")
+        for key, value in keys.items():
+            if key not in SCHEMA[section]:
+                raise ValueError(f"{name}: unknown key {section}.{key}, expected one of {sorted(SCHEMA[section])}")
+            kind, low, high, _ = SCHEMA[section][key]
+            if value is None:
+                if section == "device":
+                    continue # keep the depthai default
+                raise ValueError(f"{name}: {section}.{key} has no value")
+            # bool is a subclass of int but not a number here
+            if kind in (int, float) and isinstance(value, bool):
+                raise ValueError(f"{name}: {section}.{key} = {value!r} should be {kind.__name__}")
+            # YAML has no int/float distinction for whole numbers
+            if not (isinstance(value, kind) or (kind is float and isinstance(value, int))):
+                raise ValueError(f"{name}: {section}.{key} = {value!r} should be {kind.__name__}")
+            if low is not None and value < low or high is not None and value > high:
+                raise ValueError(f"{name}: {section}.{key} = {value} is outside {low}..{high}")
+
+    camera = values.get("camera", {})
+    size = camera.get("frame_size")
+    if size is not None and (len(size) != 2 or not all(isinstance(v, int) and not isinstance(v, bool) and v > 0 for v in size)):
+        raise ValueError(f"{name}: camera.frame_size should be [width, height], got {size}")
+    align = values.get("alignment", {})
+    if "target_min_x" in align and "target_max_x" in align and align["target_min_x"] >= align["target_max_x"]:
+        raise ValueError(f"{name}: alignment.target_min_x has to be below target_max_x")
+    if size is not None and align.get("target_max_x", 0) >= size[0]:
+        raise ValueError(f"{name}: alignment.target_max_x is outside the {size[0]} px wide frame")
+
+
+class StationProfile:
+    ''' Validated per-line settings: pipeline constants, alignment window, belt speeds.
+
+    Loaded profiles are merged onto default_profile(), so a file only lists
+    what differs on that line. apply() sets the pipeline constants and must
+    run before the session builds its pipeline; controller(), predictor()
+    and device_settings() make the objects the loops take. apply_live()
+    pushes the `live` keys of SCHEMA into a running station.
+    '''
+    def __init__(self, values=None, path=None):
+        self.path = path
+        validate(values or {}, path or "profile")
+        self.values = default_profile()
+        for section, keys in (values or {}).items():
+            self.values[section].update(keys)
+        validate(self.values, path or "profile")
+
+    def __getitem__(self, section):
+        return self.values[section]
+
+    @property
+    def name(self):
+        return os.path.splitext(os.path.basename(self.path))[0] if self.path else "default"
+
+    @property
+    def mxid(self):
+        return str(self["camera"]["mxid"])
+
+    @property
+    def speed(self):
+        return self["conveyor"]["speed"]
+
+    def apply(self):
+        ''' set the qr_pipeline constants the pipeline and the decoders are built from '''
+        import qr_pipeline
+        camera, detection = self["camera"], self["detection"]
+        qr_pipeline.FRAME_SIZE = tuple(camera["frame_size"])
+        qr_pipeline.FPS = camera["fps"]
+        qr_pipeline.FOCUS_VALUE = camera["focus"]
+        qr_pipeline.MANUAL_EXPOSURE = camera["manual_exposure"]
+        qr_pipeline.EXP_TIME = camera["exposure_us"]
+        qr_pipeline.SENS_ISO = camera["iso"]
+        qr_pipeline.DETECTION_THRESHOLD = detection["threshold"]
+        qr_pipeline.BBOX_EXPANSION_PERCENT = detection["bbox_expansion_percent"]
+        return self
+
+    def controller(self, **kwargs):
+        from alignment import AlignmentController
+        align = self["alignment"]
+        return AlignmentController(align["target_min_x"], align["target_max_x"], align["speed"],
+                                   align["px_per_second"], **kwargs)
+
+    def predictor(self, **kwargs):
+        from alignment import ArrivalPredictor
+        align = self["alignment"]
+        return ArrivalPredictor(target_x=(align["target_min_x"] + align["target_max_x"]) / 2,
+                                half_window=(align["target_max_x"] - align["target_min_x"]) / 2, **kwargs)
+
+    def device_settings(self):
+        from device_config import DeviceSettings
+        return DeviceSettings.from_dict(self["device"])
+
+    def diff(self, other):
+        ''' [(section, key)] whose value differs from `other` '''
+        return [(s, k) for s, keys in self.values.items() for k, v in keys.items() if other[s].get(k) != v]
+
+    def apply_live(self, changed, session=None, controller=None, predictor=None):
+        ''' push the changed live keys into running objects, returns the keys that need a restart '''
+        camera, align = self["camera"], self["alignment"]
+        restart = [(s, k) for s, k in changed if not SCHEMA[s][k][3]]
+        changed = set(changed)
+        if session is not None and session.controlQueue is not None:
+            import depthai as dai
+            if changed & {("camera", "exposure_us"), ("camera", "iso")} and camera["manual_exposure"]:
+                session.set_manual_exposure(camera["exposure_us"], camera["iso"])
+            if ("camera", "focus") in changed:
+                ctrl = dai.CameraControl()
+                ctrl.setManualFocus(camera["focus"])
+                session.send_control(ctrl)
+        if controller is not None:
+            controller.target_min = align["target_min_x"]
+            controller.target_max = align["target_max_x"]
+            controller.speed = align["speed"]
+            if ("alignment", "px_per_second") in changed:
+                # otherwise keep the rate the controller has learned since
+                controller.px_per_second = align["px_per_second"]
+        if predictor is not None:
+            predictor.target_x = (align["target_min_x"] + align["target_max_x"]) / 2
+            predictor.half_window = (align["target_max_x"] - align["target_min_x"]) / 2
+        return restart
+
+
+def load_profile(path=None):
+    ''' StationProfile from a YAML file, the defaults without one '''
+    if path is None:
+        return StationProfile()
+    import yaml
+
+    with open(path) as f:
+        values = yaml.safe_load(f) or {}
+    if not isinstance(values, dict):
+        raise ValueError(f"{path}: a station profile is a mapping of sections")
+    camera = values.get("camera")
+    if isinstance(camera, dict) and camera.get("mxid") is not None:
+        # an all digit mxid comes out of YAML as a number
+        camera["mxid"] = str(camera["mxid"])
+    return StationProfile(values, path)
+
+
+class ProfileWatcher:
+    ''' Reloads a profile file when it changes and hands it to `on_change`.
+
+    Polls the file's mtime every `interval` s on its own thread.
+    on_change(profile, changed) gets the new StationProfile and the
+    (section, key) pairs that differ from the previous one. A file that
+    does not load or validate is reported and the last good profile stays.
+    '''
+    def __init__(self, path, on_change, interval=1.0, profile=None):
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self.profile = profile if profile is not None else load_profile(path)
+        self.reloads = 0
+        self.errors = 0
+        self._mtime = os.path.getmtime(path)
+        self._halt = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profile-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._halt.wait(self.interval):
+            self.check()
+
+    def check(self):
+        ''' reload if the file changed, True if a new profile was applied '''
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        try:
+            profile = load_profile(self.path)
+        except Exception as e:
+            # keep running on the last good profile, a half saved file is common
+            self.errors += 1
+            print(f"Profile {self.path} not reloaded: {e}")
+            return False
+        changed = profile.diff(self.profile)
+        self.profile = profile
+        if not changed:
+            return False
+        self.reloads += 1
+        print(f"Profile {self.path} reloaded: {', '.join(f'{s}.{k}' for s, k in changed)}")
+        self.on_change(profile, changed)
+        return True
+
+    def stop(self):
+        self._halt.set()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def live_updater(session=None, controller=None, predictor=None):
+    ''' on_change for ProfileWatcher that applies the live keys and warns about the rest '''
+    def on_change(profile, changed):
+        restart = profile.apply_live(changed, session, controller, predictor)
+        if restart:
+            print(f"Restart to apply {', '.join(f'{s}.{k}' for s, k in restart)}")
+    return on_change
+
+
+def compare(paths, recording=None, start_xs=(650, 790, 850, 1000, 1200), panel_id=None):
+    ''' run the timing harness once per profile and print one row each
+
+    every profile gets the simulated coarse move (stop error against the
+    target window at its belt speed) and the simulated fine alignment from
+    `start_xs` (aligned runs, pulses, belt time). With a .oakrec `recording`
+    move() is also replayed against it with the profile's speed, target and
+    bbox expansion (camera settings are baked into the recording).
+    '''
+    from alignment import simulate, simulate_coarse_move
+    from metrics import METRICS
+
+    base = copy.deepcopy(default_profile())
+    rows = []
+    for path in paths:
+        profile = load_profile(path)
+        align = profile["alignment"]
+        target_x = (align["target_min_x"] + align["target_max_x"]) / 2
+        stop_x = simulate_coarse_move(speed=profile.speed, target_x=target_x)
+        results = [simulate(x, target_min=align["target_min_x"], target_max=align["target_max_x"],
+                            speed=align["speed"], px_per_second=align["px_per_second"]) for x in start_xs]
+        row = {
+            "profile": profile.name,
+            "coarse_error": stop_x - target_x,
+            "aligned": sum(r.converged for r in results),
+            "moves": sum(r.moves for r in results) / len(results),
+            "align_s": sum(r.elapsed for r in results) / len(results),
+        }
+        if recording is not None:
+            from replay import replay_move
+            METRICS.reset()
+            profile.apply()
+            replayed = replay_move(recording, panel_id=panel_id, speed=profile.speed, predictor=profile.predictor())
+            decode = METRICS.summary().get("process", {})
+            row.update(fps=replayed["fps"], stop_x=replayed["stop_x"], process_p50=decode.get("p50"))
+        rows.append(row)
+    # leave the modules as they were for whoever runs next in this process
+    StationProfile(base).apply()
+
+    print(f"\n{'profile':<16}{'coarse px':>10}{'aligned':>9}{'pulses':>8}{'align s':>9}"
+          + (f"{'fps':>8}{'stop x':>8}{'proc ms':>9}" if recording is not None else ""))
+    for row in rows:
+        line = (f"{row['profile']:<16}{row['coarse_error']:>+10.0f}{row['aligned']:>5}/{len(start_xs):<3}"
+                f"{row['moves']:>8.1f}{row['align_s']:>9.2f}")
+        if recording is not None:
+            p50 = row["process_p50"]
+            line += f"{row['fps']:>8.1f}{str(row['stop_x']):>8}{(p50 or 0) * 1000:>9.2f}"
+        print(line)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and compare station profiles.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    check = sub.add_parser("check", help="Validate profiles and print the merged settings")
+    check.add_argument("paths", nargs="+", help="Station profile YAML files")
+    bench = sub.add_parser("compare", help="Run the simulation (and replay) harness for each profile")
+    bench.add_argument("paths", nargs="+", help="Station profile YAML files")
+    bench.add_argument("--recording", type=str, help=".oakrec to replay move() on for each profile")
+    bench.add_argument("--panel", type=str, help="Panel id for the replay")
+    args = parser.parse_args()
+
+    if args.command == "check":
+        for path in args.paths:
+            profile = load_profile(path)
+            print(f"{path}: ok")
+            for section, keys in profile.values.items():
+                print(f"  {section}: " + ", ".join(f"{k}={v}" for k, v in keys.items()))
+    else:
+        start = time.perf_counter()
+        compare(args.paths, args.recording, panel_id=args.panel)
+        print(f"\nCompared {len(args.paths)} profiles in {time.perf_counter() - start:.1f} s")
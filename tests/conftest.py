@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the modules live flat in the repo root, run with `python -m pytest tests`
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
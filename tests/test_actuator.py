@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from actuator import ConveyorActuator, SimulatedConveyor
+
+
+@pytest.fixture
+def belt():
+    backend = SimulatedConveyor()
+    actuator = ConveyorActuator(backend)
+    yield actuator, backend
+    actuator.close()
+
+
+def names(backend):
+    return [(name, args) for _, name, args in backend.log]
+
+
+def test_calls_return_without_waiting_for_the_belt():
+    backend = SimulatedConveyor(command_delay=0.2)
+    with ConveyorActuator(backend) as actuator:
+        start = time.monotonic()
+        cmd = actuator.speed(20)
+        assert time.monotonic() - start < 0.1
+        cmd.wait(2)
+        assert cmd.latency is not None
+    assert names(backend)[0] == ("speed", (20,))
+
+
+def test_pulse_timing(belt):
+    actuator, backend = belt
+    actuator.pulse('reve', 0.2, 19).wait(2)
+    assert names(backend) == [("speed", (19,)), ("reverse", ()), ("stop", ())]
+    started, stopped = backend.log[1][0], backend.log[2][0]
+    assert stopped - started == pytest.approx(0.2, abs=0.05)
+
+
+def test_stop_preempts_a_running_pulse(belt):
+    actuator, backend = belt
+    pulse = actuator.pulse('forw', 2.0)
+    time.sleep(0.05)
+    actuator.stop().wait(2)
+    assert pulse.finished - pulse.started < 0.5
+    assert names(backend) == [("forward", ()), ("stop", ()), ("stop", ())]
+
+
+def test_stop_skips_moves_queued_before_it():
+    backend = SimulatedConveyor(command_delay=0.1)
+    with ConveyorActuator(backend) as actuator:
+        # keeps the thread busy while the rest is queued
+        busy = actuator.speed(20)
+        while busy.started is None:
+            time.sleep(0.001)
+        skipped = [actuator.pulse('forw', 1.0), actuator.reverse()]
+        actuator.stop()
+        # issued after the stop, runs normally
+        actuator.forward().wait(2)
+    assert names(backend)[:3] == [("speed", (20,)), ("stop", ()), ("forward", ())]
+    assert all(cmd.started is not None for cmd in skipped)
+
+
+def test_errors_reach_the_caller(belt):
+    actuator, backend = belt
+
+    def fail(hz):
+        raise RuntimeError("drive offline")
+
+    backend.speed = fail
+    with pytest.raises(RuntimeError, match="drive offline"):
+        actuator.speed(20).wait(2)
+    # the thread survives it
+    actuator.forward().wait(2)
+    assert names(backend) == [("forward", ())]
+
+
+def test_close_stops_the_belt():
+    backend = SimulatedConveyor()
+    actuator = ConveyorActuator(backend)
+    actuator.forward()
+    actuator.close()
+    assert names(backend)[-1] == ("stop", ())
+    with pytest.raises(RuntimeError):
+        actuator.forward()
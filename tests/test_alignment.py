@@ -0,0 +1,74 @@
+from alignment import AlignmentController, SimClock, SimulatedBelt, SimulatedCamera, simulate
+
+
+def controller_on(start_x, noise_px=0, **kwargs):
+    clock = SimClock()
+    belt = SimulatedBelt(start_x, clock)
+    camera = SimulatedCamera(belt, noise_px=noise_px, seed=0)
+    controller = AlignmentController(clock=clock, sleep=clock.sleep, **kwargs)
+    return controller, camera, belt
+
+
+def test_already_aligned_does_not_move():
+    controller, camera, belt = controller_on(740)
+    result = controller.align(camera, belt)
+    assert result.converged
+    assert result.moves == 0
+    assert belt.x == 740
+
+
+def test_converges_from_either_side():
+    for start_x in (650, 790, 850, 1000, 1200):
+        result = simulate(start_x)
+        assert result.converged, (start_x, result)
+        assert 700 <= result.final_x <= 780
+        assert result.moves <= 3
+
+
+def test_pulse_direction_and_length():
+    controller = AlignmentController(px_per_second=600, gain=1.0, min_pulse=0.05, max_pulse=2.0)
+    assert controller.pulse_for(1040) == ('reve', 0.5)
+    direction, duration = controller.pulse_for(680)
+    assert direction == 'forw'
+    assert duration == 0.1
+    # clamped on both ends
+    assert controller.pulse_for(745)[1] == 0.05
+    assert controller.pulse_for(5000)[1] == 2.0
+
+
+def test_rate_is_learned_from_the_first_pulse():
+    # starting guess twice the real rate: the first pulse is too short
+    controller, camera, belt = controller_on(1100, px_per_second=1200)
+    assert not controller.rate_measured
+    result = controller.align(camera, belt)
+    assert result.converged
+    assert controller.rate_measured
+    # the belt runs 19 Hz * 32 px/s per Hz, less the ramp-up
+    assert 450 < controller.px_per_second < 700
+
+
+def test_overshoot_is_measured_on_the_far_side():
+    # starting guess far below the real rate: the first pulse runs past the window
+    controller, camera, belt = controller_on(1100, px_per_second=200, gain=1.0, max_pulse=5.0)
+    result = controller.align(camera, belt)
+    assert result.overshoot > 0
+    assert result.converged
+    assert result.moves >= 2
+
+
+def test_gives_up_when_the_panel_is_lost():
+    controller, camera, belt = controller_on(1000)
+    camera.miss_rate = 1.0
+    result = controller.align(camera, belt)
+    assert not result.converged
+    assert result.final_x is None
+    assert result.moves == 0
+
+
+def test_gives_up_after_max_moves():
+    # a belt that barely moves never reaches the window
+    controller, camera, belt = controller_on(1200, max_moves=3)
+    belt.px_per_hz = 0.1
+    result = controller.align(camera, belt)
+    assert not result.converged
+    assert result.moves == 3
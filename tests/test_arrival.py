@@ -0,0 +1,99 @@
+from alignment import ArrivalPredictor, simulate_coarse_move
+
+
+def predictor(**kwargs):
+    kwargs.setdefault("stop_latency", 0)
+    kwargs.setdefault("coast_px", 0)
+    return ArrivalPredictor(target_x=740, half_window=40, **kwargs)
+
+
+def test_no_sighting_never_stops():
+    assert not predictor().should_stop(1.0)
+
+
+def test_single_sighting_before_the_window_keeps_going():
+    p = predictor()
+    p.update(0.0, 600)
+    assert not p.should_stop(0.0)
+
+
+def test_single_sighting_in_or_past_the_window_stops():
+    for x in (700, 740, 900):
+        p = predictor()
+        p.update(0.0, x)
+        assert p.should_stop(0.0), x
+
+
+def test_single_sighting_in_reverse():
+    p = predictor(direction=-1)
+    p.update(0.0, 900)
+    assert not p.should_stop(0.0)
+    p = predictor(direction=-1)
+    p.update(0.0, 600)
+    assert p.should_stop(0.0)
+
+
+def test_velocity_fit():
+    p = predictor()
+    for i in range(5):
+        p.update(i * 0.1, 100 + i * 60)
+    assert abs(p.velocity - 600) < 1e-6
+
+
+def test_jitter_is_not_velocity():
+    p = predictor()
+    for i, x in enumerate((500, 502, 499, 501)):
+        p.update(i * 0.1, x)
+    assert p.velocity is None
+
+
+def test_stops_on_the_frame_closest_to_target():
+    # 600 px/s at 10 fps: 60 px per frame, stop once within half a frame of 740
+    p = predictor()
+    stopped = None
+    for i in range(20):
+        t = i * 0.1
+        p.update(t, 200 + 600 * t)
+        if p.should_stop(t):
+            stopped = 200 + 600 * t
+            break
+    assert stopped is not None
+    assert abs(stopped - 740) <= 30
+
+
+def test_stop_latency_and_coast_stop_earlier():
+    p = predictor(stop_latency=0.1, coast_px=10)
+    p.update(0.0, 500)
+    p.update(0.1, 560)
+    # 560 + 600 * 0.1 + 10 = 630
+    assert abs(p.stop_position(0.1) - 630) < 1e-6
+
+
+def test_extrapolates_over_missed_frames():
+    p = predictor()
+    p.update(0.0, 500)
+    p.update(0.1, 560)
+    assert not p.should_stop(0.1)
+    # panel not decoded for a while, the fit still says it reached the target
+    assert p.should_stop(0.4)
+
+
+def test_coarse_move_stops_in_window():
+    for speed in (19, 25, 30):
+        assert 700 <= simulate_coarse_move(speed=speed) <= 780, speed
+
+
+def test_record_outcome_corrects_the_coast():
+    p = predictor(coast_px=8)
+    p.update(0.0, 500)
+    p.update(0.1, 560)
+    p.should_stop(0.1)
+    # the panel came to rest 20 px further than predicted
+    p.record_outcome(p.predicted_x + 20)
+    assert p.coast_px == 18
+    p.reset()
+    assert p.coast_px == 18
+    assert p.observations == []
+    # nothing to learn from a move that never predicted a stop
+    p.record_outcome(700)
+    assert p.coast_px == 18
@@ -0,0 +1,72 @@
+import time
+
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("zbar")
+
+from decoders import REORDER_EVERY, DecoderChain
+
+
+class Crop:
+    size = 1
+
+
+class FakeDecoder:
+    def __init__(self, name, text=None, seconds=0.0):
+        self.name = name
+        self.text = text
+        self.seconds = seconds
+        self.calls = 0
+
+    def __call__(self, img):
+        self.calls += 1
+        if self.seconds:
+            time.sleep(self.seconds)
+        return self.text
+
+
+def order(chain):
+    return [d.name for d in chain.decoders]
+
+
+def test_stops_at_the_first_decoder_that_reads_it():
+    a, b, c = FakeDecoder("a"), FakeDecoder("b", "P1"), FakeDecoder("c", "P1")
+    chain = DecoderChain([a, b, c], budget=None)
+    assert chain(Crop()) == "P1"
+    assert (a.calls, b.calls, c.calls) == (1, 1, 0)
+    assert chain(None) is None
+
+
+def test_reorders_by_cost_per_decode():
+    slow = FakeDecoder("slow", seconds=0.001)
+    good = FakeDecoder("good", "P1")
+    chain = DecoderChain([slow, good], budget=None)
+    for _ in range(REORDER_EVERY - 1):
+        chain(Crop())
+    assert order(chain) == ["slow", "good"]
+    chain(Crop())
+    assert order(chain) == ["good", "slow"]
+
+
+def test_untried_fallback_stays_behind_measured_decoders():
+    failing = FakeDecoder("failing")
+    good = FakeDecoder("good", "P1")
+    untried = FakeDecoder("untried", "P1")
+    chain = DecoderChain([failing, good, untried], budget=None)
+    for _ in range(REORDER_EVERY):
+        chain(Crop())
+    assert untried.calls == 0
+    assert order(chain) == ["good", "failing", "untried"]
+
+
+def test_budget_only_runs_the_first_decoder():
+    a, b = FakeDecoder("a", seconds=0.002), FakeDecoder("b", "P1")
+    chain = DecoderChain([a, b], budget=0.001)
+    chain.start_frame()
+    assert chain(Crop()) is None
+    assert b.calls == 0
+    # a new frame gets a new budget
+    chain.budget = 1.0
+    chain.start_frame()
+    assert chain(Crop()) == "P1"
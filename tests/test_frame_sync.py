@@ -0,0 +1,72 @@
+import pytest
+
+from fake_device import FakeDevice, FakeDetection, FakeImgDetections, FakeImgFrame, FakeOutputQueue
+from frame_sync import FrameSync
+
+
+def queue_of(messages):
+    it = iter(messages)
+    return FakeOutputQueue(lambda: next(it, None))
+
+
+def frames(*seqs):
+    return queue_of([FakeImgFrame(f"frame{s}", s, s / 30) for s in seqs])
+
+
+def detections(*seqs):
+    return queue_of([FakeImgDetections([FakeDetection(0, 0, 0.1, 0.1, label=s)], s, s / 30) for s in seqs])
+
+
+def drain(sync):
+    pairs = []
+    with pytest.raises(EOFError):
+        while True:
+            pairs.append(sync.get_synced(timeout=2))
+    return pairs
+
+
+def test_pairs_by_sequence_number():
+    sync = FrameSync(frames(0, 1, 2), detections(0, 1, 2), clock=lambda: 1.0, drop_old=False).start()
+    pairs = drain(sync)
+    assert [f for f, _, _ in pairs] == ["frame0", "frame1", "frame2"]
+    assert [d[0].label for _, d, _ in pairs] == [0, 1, 2]
+    assert sync.matched == 3
+    assert sync.timestamp == pytest.approx(2 / 30, abs=1e-6)
+
+
+def test_dropped_halves_are_skipped():
+    # detections 1 and 3 and frame 4 never arrive
+    sync = FrameSync(frames(0, 1, 2, 3, 5), detections(0, 2, 4, 5), clock=lambda: 1.0, drop_old=False).start()
+    pairs = drain(sync)
+    assert [f for f, _, _ in pairs] == ["frame0", "frame2", "frame5"]
+    assert [d[0].label for _, d, _ in pairs] == [0, 2, 5]
+
+
+def test_latency_from_capture_time():
+    sync = FrameSync(frames(0), detections(0), clock=lambda: 0.25, drop_old=False).start()
+    (_, _, latency_ms), = drain(sync)
+    assert latency_ms == pytest.approx(250)
+
+
+def test_fake_device_queues():
+    device = FakeDevice([(f"frame{i}", []) for i in range(10)])
+    sync = FrameSync(device.getOutputQueue("camera"), device.getOutputQueue("nn"), device.clock, drop_old=False).start()
+    assert [f for f, _, _ in drain(sync)] == [f"frame{i}" for i in range(10)]
+
+
+def test_drop_old_keeps_the_newest():
+    sync = FrameSync(frames(*range(10)), detections(*range(10)), clock=lambda: 1.0, maxsize=2).start()
+    for t in sync._threads:
+        t.join(2)
+    pairs = drain(sync)
+    # the end-of-stream marker takes one of the two slots
+    assert [f for f, _, _ in pairs] == ["frame9"]
+    assert sync.dropped >= 8
+
+
+def test_flush_keeps_the_end_of_stream():
+    sync = FrameSync(frames(0, 1), detections(0, 1), clock=lambda: 1.0).start()
+    for t in sync._threads:
+        t.join(2)
+    sync.flush()
+    assert drain(sync) == []
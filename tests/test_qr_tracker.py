@@ -0,0 +1,85 @@
+from qr_tracker import QRTracker, iou
+
+
+def test_iou():
+    assert iou((0, 0, 10, 10), (0, 0, 10, 10)) == 1.0
+    assert iou((0, 0, 10, 10), (20, 20, 30, 30)) == 0.0
+    assert abs(iou((0, 0, 10, 10), (5, 0, 15, 10)) - 1 / 3) < 1e-9
+
+
+def test_overlapping_box_keeps_its_track():
+    tracker = QRTracker()
+    first, = tracker.update([(100, 100, 200, 200)])
+    second, = tracker.update([(110, 100, 210, 200)])
+    assert second is first
+
+
+def test_each_box_gets_the_best_overlap():
+    tracker = QRTracker()
+    a, b = tracker.update([(0, 0, 100, 100), (300, 0, 400, 100)])
+    # same boxes, shifted a bit and given in the other order
+    b2, a2 = tracker.update([(310, 0, 410, 100), (10, 0, 110, 100)])
+    assert a2 is a and b2 is b
+
+
+def test_fast_box_matches_by_centroid():
+    tracker = QRTracker(max_centroid_px=120)
+    first, = tracker.update([(100, 100, 150, 150)])
+    # no overlap left, but the centre moved only 80 px
+    second, = tracker.update([(180, 100, 230, 150)])
+    assert second is first
+    third, = tracker.update([(500, 100, 550, 150)])
+    assert third is not first
+
+
+def test_unmatched_track_expires_after_max_missed():
+    tracker = QRTracker(max_missed=2)
+    track, = tracker.update([(100, 100, 200, 200)])
+    tracker.update([])
+    tracker.update([])
+    assert track in tracker.tracks
+    tracker.update([])
+    assert track not in tracker.tracks
+    again, = tracker.update([(100, 100, 200, 200)])
+    assert again is not track
+
+
+def test_cached_text_is_not_decoded_again():
+    tracker = QRTracker()
+    calls = []
+
+    def decode(bbox):
+        calls.append(bbox)
+        return "STOP"
+
+    assert tracker.decode_all([(100, 100, 200, 200)], decode) == ["STOP"]
+    assert tracker.decode_all([(102, 100, 202, 200)], decode) == ["STOP"]
+    assert len(calls) == 1
+    assert tracker.cache_hits == 1
+    # drifted far enough from the decoded box to read it again
+    tracker.decode_all([(150, 100, 250, 200)], decode)
+    assert len(calls) == 2
+
+
+def test_failed_decode_keeps_old_text_for_a_while():
+    tracker = QRTracker(max_missed=2)
+    tracker.decode_all([(100, 100, 200, 200)], lambda bbox: "P1")
+    # far enough to redecode on every frame, every decode fails
+    boxes = [(100 + 60 * i, 100, 200 + 60 * i, 200) for i in range(1, 5)]
+    texts = [tracker.decode_all([b], lambda bbox: None)[0] for b in boxes]
+    assert texts[:2] == ["P1", "P1"]
+    assert texts[-1] is None
+
+
+
+def test_reset_after_the_belt_moved():
+    a, b = (100, 100, 200, 200), (500, 100, 600, 200)
+    tracker = QRTracker()
+    tracker.decode_all([a, b], {a: "A", b: "B"}.get)
+    # a 400 px pulse puts panel A where B was, the track of B still holds its text
+    assert tracker.decode_all([b], {b: "A"}.get) == ["B"]
+
+    tracker = QRTracker()
+    tracker.decode_all([a, b], {a: "A", b: "B"}.get)
+    tracker.reset()
+    assert tracker.decode_all([b], {b: "A"}.get) == ["A"]
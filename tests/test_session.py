@@ -0,0 +1,118 @@
+import itertools
+
+import pytest
+
+pytest.importorskip("depthai")
+cv2 = pytest.importorskip("cv2")
+np = pytest.importorskip("numpy")
+pytest.importorskip("zbar")
+
+import conveyor_poe_4
+import eval_loop_notimeout
+from actuator import ConveyorActuator, SimulatedConveyor
+from alignment import AlignmentController
+from fake_device import FakeDevice, FakeDetection
+from oak_session import OakSession
+from qr_pipeline import FRAME_SIZE
+
+PANEL = "11-111-111"
+FPS = 30
+SIDE = 120 # px side of the printed code
+# QRDecoder reports the detection expanded by 200%, one SIDE more on each side
+ALIGNED = 740 + SIDE
+
+
+def qr_image(text):
+    code = cv2.QRCodeEncoder.create().encode(text)
+    return cv2.resize(code, (SIDE, SIDE), interpolation=cv2.INTER_NEAREST)
+
+
+CODE = qr_image(PANEL)
+
+
+def frame_with_panel(x, y=480):
+    ''' white BGR frame with the panel code at px x, and its detection '''
+    width, height = FRAME_SIZE
+    frame = np.full((height, width, 3), 255, np.uint8)
+    detections = []
+    if x is not None:
+        x = int(x)
+        frame[y:y + SIDE, x:x + SIDE] = CODE[:, :, None]
+        detections.append(FakeDetection(x / width, y / height, (x + SIDE) / width, (y + SIDE) / height))
+    return frame, detections
+
+
+def replay(xs):
+    ''' (frame, detections, timestamp) with the panel at each x, None for no panel '''
+    for i, x in enumerate(xs):
+        frame, detections = frame_with_panel(x)
+        yield frame, detections, i / FPS
+
+
+def test_get_pairs_and_timestamps():
+    with OakSession(device=FakeDevice(replay([300, 320, 340]))) as session:
+        for i in range(3):
+            frame, detections = session.get()
+            assert frame.shape == (FRAME_SIZE[1], FRAME_SIZE[0], 3)
+            assert len(detections) == 1
+            assert session.timestamp == pytest.approx(i / FPS, abs=1e-6)
+            # the replay clock follows the pair handed out, not the readers
+            assert session.clock() == session.timestamp
+        assert session.crops is None
+
+
+def test_flush_skips_frames_from_before_the_stop():
+    with OakSession(device=FakeDevice(replay(itertools.count()))) as session:
+        session.get()
+        stopped = session.clock()
+        session.flush()
+        session.skip_before(stopped + 5 / FPS)
+        session.get()
+        assert session.timestamp >= stopped + 5 / FPS - 1e-6
+
+
+def test_move_stops_the_panel_on_target():
+    # 600 px/s towards the target window, far past it if nothing stops the belt
+    xs = (100 + 600 * i / FPS for i in range(FPS * 3))
+    with OakSession(device=FakeDevice(replay(xs))) as session, \
+            ConveyorActuator(SimulatedConveyor()) as conveyor:
+        x = conveyor_poe_4.move(PANEL, 19, 'forw', False, session, conveyor)
+        conveyor.stop().wait(2)
+        commands = [name for _, name, _ in conveyor.conveyor.log]
+    assert 700 <= x <= 780
+    assert commands[:3] == ["speed", "forward", "stop"]
+
+
+def test_finetune_converged_without_moving():
+    with OakSession(device=FakeDevice(replay(itertools.repeat(ALIGNED)))) as session, \
+            ConveyorActuator(SimulatedConveyor()) as conveyor:
+        result = eval_loop_notimeout.finetune(PANEL, session, conveyor, controller=AlignmentController())
+        conveyor.stop().wait(2)
+        log = [name for _, name, _ in conveyor.conveyor.log]
+    assert result.converged
+    assert result.moves == 0
+    # finetune() only makes sure the belt is stopped
+    assert set(log) == {"stop"}
+
+
+def test_finetune_pulses_towards_the_window():
+    # the replay does not follow the belt, the panel stays put and the controller gives up
+    controller = AlignmentController(max_moves=2, max_pulse=0.05, settle_time=0)
+    with OakSession(device=FakeDevice(replay(itertools.repeat(1000)))) as session, \
+            ConveyorActuator(SimulatedConveyor()) as conveyor:
+        result = eval_loop_notimeout.finetune(PANEL, session, conveyor, controller=controller)
+        conveyor.stop().wait(2)
+        log = [name for _, name, _ in conveyor.conveyor.log]
+    assert not result.converged
+    assert result.moves == 2
+    assert log.count("reverse") == 2
+    assert "forward" not in log
+
+
+def test_finetune_gives_up_when_the_panel_is_gone():
+    frames = replay(itertools.repeat(None, eval_loop_notimeout.MEASURE_MAX_FRAMES + 10))
+    with OakSession(device=FakeDevice(frames)) as session, \
+            ConveyorActuator(SimulatedConveyor()) as conveyor:
+        result = eval_loop_notimeout.finetune(PANEL, session, conveyor, controller=AlignmentController())
+    assert not result.converged
+    assert result.final_x is None
@@ -0,0 +1,95 @@
+import os
+import itertools
+
+import pytest
+
+from alignment import AlignmentController, ArrivalPredictor
+from station import ProfileWatcher, live_updater, validate
+
+
+def test_validate_accepts_a_partial_profile():
+    validate({"camera": {"fps": 30, "exposure_us": 800}, "alignment": {"px_per_second": 550}})
+    # whole numbers from YAML are fine for float keys
+    validate({"detection": {"threshold": 1}})
+    # device keys may be null, the depthai default stays
+    validate({"device": {"watchdog_ms": None}})
+
+
+@pytest.mark.parametrize("values", [
+    {"camera": {"fps": True}},
+    {"camera": {"focus": False}},
+    {"detection": {"threshold": True}},
+    {"camera": {"fps": 30.5}},
+    {"camera": {"mxid": 18443010}},
+    {"camera": {"frame_size": [1440, True]}},
+    {"camera": {"frame_size": [1440]}},
+    {"camera": {"iso": 50}},
+    {"camera": {"fps": None}},
+    {"alignment": {"target_min_x": 780, "target_max_x": 700}},
+    {"camera": {"frame_size": [640, 480]}, "alignment": {"target_max_x": 700}},
+    {"lens": {}},
+    {"camera": {"gain": 2}},
+    {"camera": [30]},
+])
+def test_validate_rejects(values):
+    with pytest.raises(ValueError):
+        validate(values)
+
+
+# every write gets its own mtime, even on file systems with a coarse clock
+_mtimes = itertools.count(1_000_000, 10)
+
+
+def write(path, text):
+    path.write_text(text)
+    mtime = next(_mtimes)
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def profile_file(tmp_path):
+    # loading a profile reads the defaults from qr_pipeline
+    pytest.importorskip("yaml")
+    pytest.importorskip("depthai")
+    pytest.importorskip("cv2")
+    pytest.importorskip("numpy")
+    path = tmp_path / "line1.yaml"
+    write(path, "alignment:\n  target_min_x: 700\n  target_max_x: 780\n")
+    return path
+
+
+def test_watcher_reloads_changed_keys(profile_file):
+    calls = []
+    watcher = ProfileWatcher(str(profile_file), lambda profile, changed: calls.append(changed))
+    assert not watcher.check()
+    write(profile_file, "alignment:\n  target_min_x: 690\n  target_max_x: 770\nconveyor:\n  speed: 22\n")
+    assert watcher.check()
+    assert sorted(calls[0]) == [("alignment", "target_max_x"), ("alignment", "target_min_x"), ("conveyor", "speed")]
+    assert watcher.profile["alignment"]["target_min_x"] == 690
+    assert watcher.reloads == 1
+
+
+def test_watcher_keeps_the_last_good_profile(profile_file):
+    calls = []
+    watcher = ProfileWatcher(str(profile_file), lambda profile, changed: calls.append(changed))
+    write(profile_file, "camera:\n  fps: true\n")
+    assert not watcher.check()
+    write(profile_file, "alignment: [\n")
+    assert not watcher.check()
+    assert watcher.errors == 2
+    assert watcher.profile["alignment"]["target_min_x"] == 700
+    # saved again without a change
+    write(profile_file, "alignment:\n  target_min_x: 700\n  target_max_x: 780\n")
+    assert not watcher.check()
+    assert calls == []
+
+
+def test_live_updater_moves_the_window(profile_file):
+    controller = AlignmentController()
+    predictor = ArrivalPredictor()
+    watcher = ProfileWatcher(str(profile_file), live_updater(controller=controller, predictor=predictor))
+    write(profile_file, "alignment:\n  target_min_x: 600\n  target_max_x: 700\n")
+    assert watcher.check()
+    assert (controller.target_min, controller.target_max) == (600, 700)
+    assert predictor.target_x == 650
+    assert predictor.half_window == 50
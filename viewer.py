@@ -0,0 +1,109 @@
+import time
+import threading
+from pathlib import Path
+
+import cv2
+from qr_pipeline import TextHelper, annotate
+
+VIEW_FPS = 10 # frames per second taken from the detection loop at most
+VIEW_SCALE = 0.5 # annotated copy is this size of the camera frame
+
+
+class AnnotationSink:
+    ''' Draws the results of the detection loop on a downscaled copy, on its own thread.
+
+    submit() is all the loop calls. Without a viewer (`show`) or a recorder
+    (`record_path`, an .mp4/.avi written with cv2.VideoWriter) it returns
+    right away. Otherwise it takes at most `fps` frames per second and only
+    hands over references: resizing, drawing, imshow and encoding happen on
+    the sink thread. A frame the thread has not picked up yet is replaced by
+    the newer one, so a slow display never holds the loop up. `quit` turns
+    True when 'q' is pressed in the window.
+    '''
+    def __init__(self, show=False, record_path=None, fps=VIEW_FPS, scale=VIEW_SCALE, window="Image"):
+        self.show = show
+        self.record_path = record_path
+        self.fps = fps
+        self.scale = scale
+        self.window = window
+        self.quit = False
+        self.rendered = 0
+        self.dropped = 0
+        self._next = 0.0
+        self._pending = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._writer = None
+        self._thread = None
+        if self.active:
+            self._thread = threading.Thread(target=self._run, name="annotation", daemon=True)
+            self._thread.start()
+
+    @property
+    def active(self):
+        return self.show or self.record_path is not None
+
+    def submit(self, frame, results, offset=None):
+        ''' queue `frame` (BGR, full frame or ROI at `offset`) with its QRResults for drawing '''
+        if not self.active or frame is None:
+            return
+        now = time.monotonic()
+        if now < self._next:
+            return
+        self._next = now + 1 / self.fps
+        # the loop does not touch a frame or its results after this, no copy needed
+        with self._cond:
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = (frame, list(results), offset)
+            self._cond.notify()
+
+    def _run(self):
+        helper = TextHelper()
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closed:
+                    self._cond.wait()
+                if self._pending is None:
+                    break
+                frame, results, offset = self._pending
+                self._pending = None
+
+            small = cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+            annotate(small, results, offset, self.scale, helper)
+            if self.show:
+                cv2.imshow(self.window, small)
+                if cv2.waitKey(1) == ord('q'):
+                    self.quit = True
+            if self.record_path is not None:
+                self._record(small)
+            self.rendered += 1
+
+        if self._writer is not None:
+            self._writer.release()
+        if self.show:
+            cv2.destroyWindow(self.window)
+
+    def _record(self, img):
+        if self._writer is None:
+            Path(self.record_path).parent.mkdir(parents=True, exist_ok=True)
+            self._size = (img.shape[1], img.shape[0])
+            fourcc = cv2.VideoWriter_fourcc(*("mp4v" if str(self.record_path).endswith(".mp4") else "MJPG"))
+            self._writer = cv2.VideoWriter(str(self.record_path), fourcc, self.fps, self._size)
+        if (img.shape[1], img.shape[0]) != self._size:
+            # a ROI frame, same aspect ratio as the full frame
+            img = cv2.resize(img, self._size)
+        self._writer.write(img)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()